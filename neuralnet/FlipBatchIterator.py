@@ -1,5 +1,8 @@
 import sys
 import pdb
+import time
+import threading
+import Queue
 sys.path.append('~/roof/Lasagne/lasagne')
 sys.path.append('~/roof/nolearn/nolearn')
 import numpy as np
@@ -11,42 +14,98 @@ from data_augment import Augmenter
 
 CROP_SIZE = 32
 IMG_SIZE = 40
+AUGMENT_SEED = 42
 
 
 
 class ResizeBatchIterator(BatchIterator):
     def transform(self, Xb, yb):
-        temp_Xb = np.empty((Xb.shape[0], Xb.shape[1], CROP_SIZE, CROP_SIZE))
-        for i, x in enumerate(Xb):
-            x_transposed = x.transpose(1,2,0) 
-            x_resized = utils.resize_rgb(x_transposed, w=CROP_SIZE, h=CROP_SIZE)
-            x_new = x_resized.transpose(2,0,1)
-            temp_Xb[i, :, :, :]  = x_new
-        return temp_Xb, yb
+        return utils.resize_neural_patches(Xb, w=CROP_SIZE, h=CROP_SIZE), yb
 
 
 class FlipBatchIterator(BatchIterator):
     '''Subclass of batchiterator that performs data augmentation on the data batches before to feed them into the lasagne NeuralNet 
+    The flips and crops are drawn from a RandomState seeded with seed, so that training runs can be reproduced
     '''
+    def __init__(self, batch_size, seed=AUGMENT_SEED, **kwargs):
+        super(FlipBatchIterator, self).__init__(batch_size, **kwargs)
+        self.random_state = np.random.RandomState(seed)
+
     def transform(self, Xb, yb):
-        #if Xb.shape[0] < 128:
-            #pdb.set_trace()
         Xb, yb = super(FlipBatchIterator, self).transform(Xb, yb)
-        #X = np.empty((Xb.shape[0], 3, utils.CROP_SIZE, utils.CROP_SIZE))
-        #for i, x in enumerate(Xb):
-            #patch = utils.neural_to_cv2(x)
-            #patch = Augmenter.random_flip(patch) 
-            #patch = Augmenter.random_crop(patch, (CROP_SIZE, CROP_SIZE))
-            #X[i, :, :,: ] = utils.cv2_to_neural(patch, w=utils.CROP_SIZE, h=utils.CROP_SIZE)
-        temp_Xb = np.empty((Xb.shape[0], Xb.shape[1], CROP_SIZE, CROP_SIZE))
-        for i, x in enumerate(Xb):
-            patch = x.transpose(1,2,0) 
-            patch = Augmenter.random_flip(patch)
-            patch = Augmenter.random_crop(patch, (CROP_SIZE, CROP_SIZE))
-            x_resized = utils.resize_rgb(patch, w=CROP_SIZE, h=CROP_SIZE)
-            x_new = x_resized.transpose(2,0,1)
-            temp_Xb[i, :, :, :]  = x_new
+        #the crop is already CROP_SIZE, so the patches do not need to be resized afterwards
+        temp_Xb = Augmenter.random_flip_crop_batch(Xb, (CROP_SIZE, CROP_SIZE), self.random_state)
         return temp_Xb, yb
 
 
 
+class _BatchFailure(object):
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+_END_OF_EPOCH = object()
+
+
+class PrefetchBatchIterator(object):
+    '''Wraps a batch iterator so that the next batches are built in a background thread while the net trains on the current one.
+    At most prefetch batches are kept ready. The seconds spent waiting for a batch are stored per epoch in wait_times
+    '''
+    def __init__(self, batch_iterator, prefetch=2):
+        self.batch_iterator = batch_iterator
+        self.prefetch = prefetch
+        self.wait_times = list()
+
+    def __call__(self, X, y=None):
+        self.batch_iterator = self.batch_iterator(X, y)
+        return self
+
+    def __getattr__(self, name):
+        #anything else, like batch_size, comes from the wrapped iterator. Special names like __getstate__ are not delegated,
+        #or pickling the net would store the state of the wrapped iterator instead of this one
+        if name == 'batch_iterator' or (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+        return getattr(self.batch_iterator, name)
+
+    def __iter__(self):
+        batches = Queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=PrefetchBatchIterator._produce, args=(iter(self.batch_iterator), batches, stop))
+        worker.daemon = True
+        worker.start()
+
+        wait_time = 0.
+        try:
+            while True:
+                start = time.time()
+                batch = batches.get()
+                wait_time += time.time()-start
+                if batch is _END_OF_EPOCH:
+                    break
+                if isinstance(batch, _BatchFailure):
+                    raise batch.exc_info[0], batch.exc_info[1], batch.exc_info[2]
+                yield batch
+        finally:
+            #also reached if training stops in the middle of an epoch: the worker sees the event and exits
+            stop.set()
+            self.wait_times.append(wait_time)
+
+    @staticmethod
+    def _produce(batch_iter, batches, stop):
+        try:
+            for batch in batch_iter:
+                if not PrefetchBatchIterator._put(batches, batch, stop):
+                    return
+        except Exception:
+            PrefetchBatchIterator._put(batches, _BatchFailure(sys.exc_info()), stop)
+            return
+        PrefetchBatchIterator._put(batches, _END_OF_EPOCH, stop)
+
+    @staticmethod
+    def _put(batches, item, stop):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
@@ -55,44 +55,44 @@ class AucCurve(object):
                 self.unique_probs.update((probs))
 
         self.unique_probs = sorted(self.unique_probs)
-        for thres in self.unique_probs:
-            print 'TRESHOLD: {}'.format(thres)
-            #find true pos
-            #for current threshold, for each roof type separately
-            eval = Evaluation(correct_roofs=self.correct_roofs, img_names=self.img_names, method=self.method) 
-            eval.detections = Detections()
-            for roof_type in utils.ROOF_TYPES:
-                for img_name in self.img_names:
-                    eval.detections.update_roof_num(self.correct_roofs[roof_type][img_name], roof_type)
-
-            filtered_detections = dict()
-            total_detections = defaultdict(int)#detections for current threshols, across all images, but per roof_type 
+        thresholds = np.array(self.unique_probs)
+
+        #score every image once, and get the counts for all thresholds from the sweep
+        roof_num = defaultdict(int)
+        true_pos = dict()
+        total_detections = dict()
+        easy_true_pos = dict()
+        easy_false_pos = dict()
+        for roof_type in utils.ROOF_TYPES:
+            true_pos[roof_type] = np.zeros(len(thresholds), dtype=int)
+            total_detections[roof_type] = np.zeros(len(thresholds), dtype=int)
+            easy_true_pos[roof_type] = np.zeros(len(thresholds), dtype=int)
+            easy_false_pos[roof_type] = np.zeros(len(thresholds), dtype=int)
+
             for img_name in self.img_names:
-                #score the entire image set at that prob point
-                filtered_detections[img_name] = dict()
-                for roof_type in utils.ROOF_TYPES:
-                    #the detections are the viola detections
-                    #the filtering is done with the probs taken from the neural network
-                    filtered_detections[img_name][roof_type] = self.detections[roof_type][img_name][np.array(self.probs[roof_type][img_name]) > thres]
-                    total_detections[roof_type] += len(filtered_detections[img_name][roof_type])
-                    eval.detections.set_detections(detection_list=filtered_detections[img_name][roof_type], img_name=img_name, roof_type=roof_type)
-
-                 
-                eval.score_img(img_name, (1200,2000), fast_scoring=True, write_file=False)
-
-            for roof_type in utils.ROOF_TYPES:
-                if total_detections[roof_type]>0 and eval.detections.roof_num[roof_type]>0:
-                    recall = float(eval.detections.true_positive_num[roof_type])/(eval.detections.roof_num[roof_type])
-                    precision = float(eval.detections.true_positive_num[roof_type])/(total_detections[roof_type]) 
+                roofs = self.correct_roofs[roof_type][img_name]
+                roof_num[roof_type] += len(roofs)
+                counts = AucCurve.sweep_image(roofs, self.detections[roof_type][img_name], 
+                                                self.probs[roof_type][img_name], thresholds)
+                true_pos[roof_type] += counts[0]
+                total_detections[roof_type] += counts[1]
+                easy_true_pos[roof_type] += counts[2]
+                easy_false_pos[roof_type] += counts[3]
+
+        for roof_type in utils.ROOF_TYPES:
+            for t in range(len(thresholds)):
+                if total_detections[roof_type][t]>0 and roof_num[roof_type]>0:
+                    recall = float(true_pos[roof_type][t])/(roof_num[roof_type])
+                    precision = float(true_pos[roof_type][t])/(total_detections[roof_type][t]) 
                 else:
                     recall = 0
                     precision = 1 
                 self.recall[roof_type].append(recall)
                 self.precision[roof_type].append(precision)
 
-                if total_detections[roof_type]>0 and eval.detections.roof_num[roof_type]>0:
-                    easy_recall = float(eval.detections.easy_true_pos_num[roof_type])/(eval.detections.roof_num[roof_type])
-                    easy_precision = float(eval.detections.easy_true_pos_num[roof_type])/(eval.detections.easy_true_pos_num[roof_type]+eval.detections.easy_false_pos_num[roof_type]) 
+                if total_detections[roof_type][t]>0 and roof_num[roof_type]>0:
+                    easy_recall = float(easy_true_pos[roof_type][t])/(roof_num[roof_type])
+                    easy_precision = float(easy_true_pos[roof_type][t])/(easy_true_pos[roof_type][t]+easy_false_pos[roof_type][t]) 
                 else:
                     easy_recall = 0
                     easy_precision = 1
@@ -123,6 +123,54 @@ class AucCurve(object):
 
 
 
+    @staticmethod
+    def sweep_image(roofs, detections, probs, thresholds, voc_threshold=utils.VOC_threshold):
+        '''Score one image for every threshold at once. At each threshold we keep the detections with prob > threshold,
+        as if Evaluation.score_img had been called on them.
+
+        Returns arrays with one entry per threshold:
+            true positives, number of detections kept, easy true positives, easy false positives
+        '''
+        probs = np.asarray(probs).reshape(-1)
+        if probs.dtype.kind != 'f':
+            probs = probs.astype(float)
+        #compare in the dtype of the probabilities, as probs > thres does
+        thresholds = np.asarray(thresholds, dtype=probs.dtype)
+        voc_scores, detection_roof_portions = Evaluation.get_score_matrix(roofs, detections)
+        easy_matches = np.logical_or(voc_scores > voc_threshold, detection_roof_portions > 0.5)
+
+        #sort the detections by decreasing prob: at each threshold, the detections kept are a prefix of this order
+        order = np.argsort(-probs, kind='mergesort')
+        kept_num = len(probs) - np.searchsorted(np.sort(probs), thresholds, side='right')
+
+        #easy metrics: a detection is an easy false pos regardless of the other detections, 
+        #and a roof is found as soon as the most probable detection that covers it is kept
+        easy_false_pos = np.concatenate(([0], np.cumsum(np.invert(np.any(easy_matches, axis=0))[order])))[kept_num]
+        roof_found_prob = np.array([np.max(probs[matches]) if np.any(matches) else -np.inf for matches in easy_matches])
+        easy_true_pos = np.sum(roof_found_prob[None, :] > thresholds[:, None], axis=1) if len(roof_found_prob) > 0 \
+                                                                            else np.zeros(len(thresholds), dtype=int)
+
+        #strict metrics: each roof is matched to its best detection among the ones kept (the first one on ties),
+        #and a true positive is a detection that is the best match of some roof
+        true_pos = np.zeros(len(thresholds), dtype=int)
+        best_score = np.full(len(roofs), -np.inf)
+        best_detection = np.full(len(roofs), len(probs), dtype=int)
+        added = 0
+        for t in np.argsort(-thresholds, kind='mergesort'):
+            if kept_num[t] > added and len(roofs) > 0:
+                new_detections = np.sort(order[added:kept_num[t]])
+                new_scores = voc_scores[:, new_detections]
+                candidate = new_detections[np.argmax(new_scores, axis=1)]
+                candidate_score = np.max(new_scores, axis=1)
+                better = np.logical_or(candidate_score > best_score, 
+                                    np.logical_and(candidate_score == best_score, candidate < best_detection))
+                best_score[better] = candidate_score[better]
+                best_detection[better] = candidate[better]
+            added = max(added, kept_num[t])
+            true_pos[t] = len(np.unique(best_detection[best_score > voc_threshold]))
+        return true_pos, kept_num, easy_true_pos, easy_false_pos
+
+
     def plot_auc(self):
         self.calculate_auc_values()
         for roof_type in utils.ROOF_TYPES:
@@ -0,0 +1,325 @@
+'''
+Benchmarks of the hot paths of the pipeline on synthetic scenes, so that runs can be compared without the data on AFS.
+A scene is a SCENE_ROWS x SCENE_COLS image of textured ground with metal and thatch roofs drawn at known positions.
+    - micro benchmarks time single functions: suppression, scoring, patch extraction, rotations, resizing, window grids
+    - the macro benchmark times Pipeline.process_image on a scene: decode, viola detection with the bundled cascades,
+      patch extraction, a tiny untrained net and suppression
+Everything is seeded, so two runs on the same machine measure the same work.
+Results are written as JSON; pass a previous result file with -c to print the speedup of every benchmark.
+
+Usage: python benchmark.py [-o results.json] [-r repeats] [-s seed] [-m] [-c previous_results.json]
+    -r sets the repeats of the micro benchmarks; the macro one runs at most MACRO_REPEATS times
+    -m skips the macro benchmark, which needs theano and lasagne
+'''
+
+import os
+import sys
+import time
+import json
+import getopt
+import shutil
+import tempfile
+import subprocess
+import platform
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+import utils
+import suppression
+from reporting import Detections, Evaluation
+from image_provider import ImageProvider
+
+SCENE_ROWS = 1200
+SCENE_COLS = 2000
+ROOFS_PER_TYPE = 40
+DETECTIONS_PER_TYPE = 2000
+REPEATS = 5
+SEED = 42
+#the cascades dominate the macro benchmark, so it runs on a smaller scene and fewer times
+MACRO_ROWS = 600
+MACRO_COLS = 1000
+MACRO_REPEATS = 3
+
+#the rectangular metal detector is the one the pipeline rotates; thatch is only detected at angle zero
+BENCHMARK_CASCADES = {'metal': ['cascade_metal_rect_augm1_singlesize_original_pad0_num872_w40_h20_FA0.4_LBP'],
+                      'thatch': ['cascade_thatch_num1372_w30_h30_FA0.4_LBP']}
+
+
+##################################
+# SYNTHETIC DATA
+##################################
+def make_scene(random_state, rows=SCENE_ROWS, cols=SCENE_COLS, roofs_per_type=ROOFS_PER_TYPE):
+    '''Textured ground with bright, rotated metal roofs and dark, axis aligned thatch roofs.
+    Returns the BGR image and, per roof type, the (N, 4) boxes and (N, 4, 2) polygons of the roofs
+    '''
+    image = random_state.randint(60, 110, size=(rows, cols, 3)).astype(np.uint8)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    boxes = dict()
+    polygons = dict()
+    for roof_type in utils.ROOF_TYPES:
+        roof_polygons = list()
+        for _ in range(roofs_per_type):
+            w, h = random_state.randint(20, 60, size=2)
+            x, y = random_state.randint(60, cols-60), random_state.randint(60, rows-60)
+            angle = random_state.uniform(0, 180) if roof_type == 'metal' else 0
+            polygon = np.int0(cv2.cv.BoxPoints(((x, y), (w, h), angle)))
+            color = (200, 200, 205) if roof_type == 'metal' else (40, 90, 120)
+            cv2.fillConvexPoly(image, polygon.astype(np.int32), color)
+            roof_polygons.append(polygon)
+        polygons[roof_type] = np.array(roof_polygons, dtype=int)
+        boxes[roof_type] = utils.polygons2boxes(polygons[roof_type]).astype(int)
+    return image, boxes, polygons
+
+
+def make_detections(random_state, roof_boxes, rows=SCENE_ROWS, cols=SCENE_COLS, detections_per_type=DETECTIONS_PER_TYPE):
+    '''Jittered copies of the roofs plus random false positives, with their probabilities, per roof type
+    '''
+    detections = dict()
+    probs = dict()
+    for roof_type in utils.ROOF_TYPES:
+        roofs = roof_boxes[roof_type]
+        true_num = detections_per_type/4
+        jittered = roofs[random_state.randint(0, len(roofs), size=true_num)] + random_state.randint(-6, 7, size=(true_num, 4))
+        xmin = random_state.randint(0, cols-60, size=detections_per_type-true_num)
+        ymin = random_state.randint(0, rows-60, size=detections_per_type-true_num)
+        size = random_state.randint(15, 60, size=(detections_per_type-true_num, 2))
+        false_pos = np.column_stack((xmin, ymin, xmin+size[:,0], ymin+size[:,1]))
+        detections[roof_type] = np.vstack((jittered, false_pos)).astype(float)
+        probs[roof_type] = random_state.rand(detections_per_type)
+    return detections, probs
+
+
+def make_rotated_polygons(random_state, number, rows=SCENE_ROWS, cols=SCENE_COLS):
+    polygons = list()
+    for _ in range(number):
+        w, h = random_state.randint(20, 60, size=2)
+        x, y = random_state.randint(60, cols-60), random_state.randint(60, rows-60)
+        polygons.append(cv2.cv.BoxPoints(((x, y), (w, h), random_state.uniform(0, 180))))
+    return np.array(polygons)
+
+
+##################################
+# TIMING
+##################################
+class Quiet(object):
+    '''Silence the prints of the code being timed'''
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def measure(func, setup=None, repeats=REPEATS):
+    '''Time repeats calls of func(*setup()), or func() if the setup returns None. The setup is not timed.
+    Returns the min, median and mean in seconds
+    '''
+    times = list()
+    for _ in range(repeats):
+        args = setup() if setup is not None else None
+        args = args if args is not None else ()
+        with Quiet():
+            start = time.time()
+            func(*args)
+            times.append(time.time()-start)
+    return OrderedDict([('min', min(times)), ('median', float(np.median(times))), ('mean', float(np.mean(times))), ('repeats', repeats)])
+
+
+##################################
+# MICRO BENCHMARKS
+##################################
+def micro_benchmarks(random_state, repeats=REPEATS):
+    image, roof_boxes, roof_polygons = make_scene(random_state)
+    detections, probs = make_detections(random_state, roof_boxes)
+    gray = cv2.equalizeHist(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    polygons = make_rotated_polygons(random_state, 1000)
+    patches = np.ascontiguousarray(random_state.rand(1000, 3, utils.PATCH_H, utils.PATCH_W), dtype=np.float32)
+    results = OrderedDict()
+
+    results['nms'] = measure(lambda: suppression.batched_non_max_suppression(detections, probs, overlapThres=0.3), repeats=repeats)
+    results['soft_nms'] = measure(lambda: suppression.batched_non_max_suppression(detections, probs, overlapThres=0.3, soft=True),
+                                                                                                                repeats=repeats)
+
+    img_name = 'scene.jpg'
+    correct_roofs = dict((roof_type, {img_name: roof_boxes[roof_type]}) for roof_type in utils.ROOF_TYPES)
+    def score_setup():
+        scene_detections = Detections()
+        for roof_type in utils.ROOF_TYPES:
+            scene_detections.set_detections(roof_type=roof_type, img_name=img_name, detection_list=detections[roof_type])
+        evaluation = Evaluation(method='benchmark', detections=scene_detections, correct_roofs=correct_roofs, img_names=[img_name])
+        return (evaluation,)
+    results['score_img'] = measure(lambda evaluation: evaluation.score_img(img_name, image.shape[:2], write_file=False),
+                                                                                setup=score_setup, repeats=repeats)
+
+    results['four_point_transform_1000'] = measure(lambda: utils.extract_neural_patches(image, polygons, w=utils.PATCH_W, h=utils.PATCH_H),
+                                                                                                                repeats=repeats)
+
+    rotated = utils.rotate_image(gray, 45)
+    rotated_detections = utils.convert_detections_to_polygons(np.column_stack((detections['metal'][:,:2],
+                                                            detections['metal'][:,2:]-detections['metal'][:,:2])))
+    results['rotate_detection_polygons'] = measure(lambda: utils.rotate_detection_polygons(rotated_detections, rotated, 45,
+                                                                            image.shape[:2], remove_off_img=True), repeats=repeats)
+    results['rotate_image'] = measure(lambda: utils.rotate_image(gray, 45), repeats=repeats)
+
+    results['resize_rgb_scene'] = measure(lambda: utils.resize_rgb(image, w=SCENE_COLS/2, h=SCENE_ROWS/2), repeats=repeats)
+    results['resize_neural_patches_1000'] = measure(lambda: utils.resize_neural_patches(patches), repeats=repeats)
+
+    #the grid is cached per shape, so clear the cache to time its generation
+    results['window_grid'] = measure(lambda: utils.window_grid(image.shape, 4, (15, 15), scale=1.3, minSize=(50, 50)),
+                                                                setup=utils.clear_window_grids, repeats=repeats)
+    return results
+
+
+##################################
+# MACRO BENCHMARK
+##################################
+def build_tiny_net():
+    '''A one conv layer net with random weights: it scores patches at the cost of a real (small) net
+    '''
+    import lasagne
+    import my_net
+    layers, layer_params = my_net.MyNeuralNet.produce_layers(1)
+    net = my_net.MyNeuralNet(layers=layers, num_layers=1,
+                            input_shape=(None, 3, utils.CROP_SIZE, utils.CROP_SIZE), output_num_units=3,
+                            output_nonlinearity=lasagne.nonlinearities.softmax,
+                            update_learning_rate=0.01, update_momentum=0.9,
+                            max_epochs=1, verbose=0, net_name='benchmark', **layer_params)
+    net.initialize()
+    return net
+
+
+class TinyExperiment(object):
+    '''Scores patches like Experiment.predict_proba, with the tiny net and without a scaler
+    '''
+    def __init__(self, net):
+        self.net = net
+
+    def predict_proba(self, X):
+        return self.net.predict_proba(utils.resize_neural_patches(X))
+
+
+def write_annotation(xml_file, roof_boxes):
+    '''Write the roofs of a scene like an annotation file of the full dataset, see DataLoader.get_all_roofs_full_dataset
+    '''
+    with open(xml_file, 'w') as f:
+        f.write('<annotation>\n')
+        for roof_type in utils.ROOF_TYPES:
+            for xmin, ymin, xmax, ymax in roof_boxes[roof_type]:
+                f.write('<object><action>{}</action><bndbox><xmin>{}</xmin><ymin>{}</ymin><xmax>{}</xmax><ymax>{}</ymax>'
+                        '</bndbox></object>\n'.format(roof_type, xmin, ymin, xmax, ymax))
+        f.write('</annotation>\n')
+
+
+def build_pipeline(in_path, net):
+    '''A viola Pipeline on the scenes of in_path, with the benchmark cascades and the tiny net as its only net per roof type
+    '''
+    from detection_pipeline import Pipeline
+    from ensemble import Ensemble
+    ensemble = Ensemble([], neural_nets=dict([(roof_type, [TinyExperiment(net)]) for roof_type in utils.ROOF_TYPES]))
+    detector_params = dict(detector_names=BENCHMARK_CASCADES, full_dataset=True)
+    return Pipeline(method='viola', data_fold=utils.VALIDATION, full_dataset=True, in_path=in_path, out_path=in_path, 
+                    ensemble=ensemble, detector_params=detector_params)
+
+
+def macro_benchmark(random_state, repeats=MACRO_REPEATS):
+    image, roof_boxes, _ = make_scene(random_state, rows=MACRO_ROWS, cols=MACRO_COLS, roofs_per_type=ROOFS_PER_TYPE/4)
+    temp_dir = tempfile.mkdtemp()+'/'
+    try:
+        #every run gets its own copy of the scene, like the images of a pipeline run, 
+        #so the decoded image and its rotations are not reused from the previous run
+        img_names = ['scene{}.jpg'.format(i) for i in range(repeats)]
+        for img_name in img_names:
+            cv2.imwrite(temp_dir+img_name, image)
+            write_annotation(temp_dir+img_name[:-3]+'xml', roof_boxes)
+        with Quiet():
+            pipe = build_pipeline(temp_dir, build_tiny_net())
+        ImageProvider.start_run()
+        records = list()
+        next_img_name = iter(img_names).next
+        def run_scene(img_name):
+            records.append(pipe.process_image(img_name, len(records), len(img_names), temp_dir)[-1])
+        results = OrderedDict()
+        try:
+            results['end_to_end'] = measure(run_scene, setup=lambda: (next_img_name(),), repeats=repeats)
+        finally:
+            pipe.close()
+        #the stages of the fastest run
+        results['end_to_end']['stages'] = min(records, key=lambda record: record['total_secs'])
+        return results
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+##################################
+# RESULTS
+##################################
+def get_metadata(seed, repeats):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([('time', time.strftime('%Y-%m-%d %H:%M:%S')), ('commit', commit), ('seed', seed), ('repeats', repeats),
+                        ('python', platform.python_version()), ('numpy', np.__version__), ('opencv', cv2.__version__),
+                        ('machine', platform.node()), ('cpus', os.sysconf('SC_NPROCESSORS_ONLN'))])
+
+
+def compare(previous, current):
+    '''Print the median time of every benchmark of both runs and the speedup
+    '''
+    print '{:<32}{:>12}{:>12}{:>10}'.format('benchmark', 'before', 'after', 'speedup')
+    for kind in ['micro', 'macro']:
+        for name, result in current.get(kind, dict()).iteritems():
+            if name in previous.get(kind, dict()):
+                before = previous[kind][name]['median']
+                print '{:<32}{:>12.4f}{:>12.4f}{:>9.2f}x'.format(name, before, result['median'], before/max(result['median'], 1e-9))
+
+
+def main():
+    out_file = 'benchmark_{}.json'.format(time.strftime('%Y%m%d_%H%M%S'))
+    repeats = REPEATS
+    seed = SEED
+    macro = True
+    previous_file = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "o:r:s:mc:")
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-o':
+            out_file = arg
+        elif opt == '-r':
+            repeats = int(arg)
+        elif opt == '-s':
+            seed = int(arg)
+        elif opt == '-m':
+            macro = False
+        elif opt == '-c':
+            previous_file = arg
+
+    results = OrderedDict()
+    results['metadata'] = get_metadata(seed, repeats)
+    results['micro'] = micro_benchmarks(np.random.RandomState(seed), repeats=repeats)
+    if macro:
+        results['macro'] = macro_benchmark(np.random.RandomState(seed), repeats=min(repeats, MACRO_REPEATS))
+
+    with open(out_file, 'w') as f:
+        json.dump(results, f, indent=1)
+    print 'Saved benchmark results to {}'.format(out_file)
+
+    if previous_file is not None:
+        with open(previous_file, 'r') as f:
+            compare(json.load(f), results)
+    else:
+        for kind in ['micro', 'macro']:
+            for name, result in results.get(kind, dict()).iteritems():
+                print '{:<32}{:>12.4f}s'.format(name, result['median'])
+
+
+if __name__ == '__main__':
+    main()
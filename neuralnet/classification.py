@@ -54,59 +54,56 @@ class Classification(object):
             self.probs[roof_type][img_name] = np.array(probs[roof_type])  
 
 
-    def get_accuracies(self):
-        #find the unique prob points
-        self.unique_probs = set()
-        self.unique_probs.update([1.])
+    def threshold_sweep(self):
+        '''Find the thresholds and count, for each of them, the detections of every image above it.
+        The thresholds are the probabilities of the inhabited images truncated to two decimals, plus 1.
+        counts_above[roof_type] has one row per image (inhabited, then uninhabited) and one column per threshold
+        '''
+        unique_probs = set([1.])
         for roof_type in utils.ROOF_TYPES:
             for img_name in self.img_names:
-                probs = [int(100*p) for p in list(self.probs[roof_type][img_name])]
-                probs = [(float(p)/100) for p in probs]
-                self.unique_probs.update((probs))
+                #truncate in float64, like the per probability int(100*p) did
+                probs = np.asarray(self.probs[roof_type][img_name], dtype=float).reshape(-1)
+                unique_probs.update(((100*probs).astype(int)/100.).tolist())
+        self.unique_probs = sorted(unique_probs)
 
-        self.unique_probs = sorted(self.unique_probs)
-        
+        #sort the probabilities of each image once, then all thresholds are a single searchsorted
+        self.counts_above = dict()
+        for roof_type in utils.ROOF_TYPES:
+            counts = np.empty((len(self.img_names)+len(self.uninhabited), len(self.unique_probs)), dtype=int)
+            for i, img_name in enumerate(self.img_names+self.uninhabited):
+                probs = np.sort(np.asarray(self.probs[roof_type][img_name]).reshape(-1))
+                #compare in the dtype of the probabilities, as probs > thres does
+                thresholds = np.asarray(self.unique_probs, dtype=probs.dtype)
+                counts[i, :] = len(probs) - np.searchsorted(probs, thresholds, side='right')
+            self.counts_above[roof_type] = counts
+
+
+    def get_accuracies(self):
+        self.threshold_sweep()
         self.y_pred = dict()
         self.accuracy = dict()
 
-        for thres in self.unique_probs:
+        for t, thres in enumerate(self.unique_probs):
             self.y_pred[thres] = dict()
             print 'TRESHOLD: {}'.format(thres)
             for roof_type in utils.ROOF_TYPES:
                 if roof_type not in self.accuracy:
                     self.accuracy[roof_type] = list()
-                
-                self.y_pred[thres][roof_type] = np.zeros((self.y_true[roof_type].shape[0]))
-                for i, img_name in enumerate(self.img_names+self.uninhabited):
-                    filtered_detections = self.detections[roof_type][img_name][np.array(self.probs[roof_type][img_name]) > thres]
-                    if len(filtered_detections)>0:
-                        self.y_pred[thres][roof_type][i] = 1
+                #an image is predicted to have roofs if any of its detections is above the threshold
+                self.y_pred[thres][roof_type] = np.array(self.counts_above[roof_type][:, t] > 0, dtype=float)
                 self.accuracy[roof_type].append(classification_report(self.y_true[roof_type], self.y_pred[thres][roof_type]))  
 
     def get_accuracies_any_rooftype(self):
-        #find the unique prob points
-        self.unique_probs = set()
-        self.unique_probs.update([1.])
-        for roof_type in utils.ROOF_TYPES:
-            for img_name in self.img_names:
-                probs = [int(100*p) for p in list(self.probs[roof_type][img_name])]
-                probs = [(float(p)/100) for p in probs]
-                self.unique_probs.update((probs))
-
-        self.unique_probs = sorted(self.unique_probs)
+        self.threshold_sweep()
         self.accuracy_anyRoof = [] 
         self.y_pred_any_roof = dict()
-        for thres in self.unique_probs:
+        counts_any_roof = sum([self.counts_above[roof_type] for roof_type in utils.ROOF_TYPES])
+        for t, thres in enumerate(self.unique_probs):
             self.y_pred[thres] = list() 
             print 'TRESHOLD: {}'.format(thres)
-                
-            self.y_pred_any_roof[thres] = np.zeros((self.y_true_any_roof.shape[0]))
-            for i, img_name in enumerate(self.img_names+self.uninhabited):
-                #if either roof type is not zero, set the prediction to one
-                for roof_type in utils.ROOF_TYPES:
-                    filtered_detections = self.detections[roof_type][img_name][np.array(self.probs[roof_type][img_name]) > thres]
-                    if len(filtered_detections)>0:
-                        self.y_pred_any_roof[thres][i] = 1
+            #if either roof type has a detection above the threshold, set the prediction to one
+            self.y_pred_any_roof[thres] = np.array(counts_any_roof[:, t] > 0, dtype=float)
             self.accuracy_anyRoof.append(classification_report(self.y_true_any_roof, self.y_pred_any_roof[thres]))  
 
 
@@ -122,19 +119,18 @@ class Classification(object):
 
 
     def get_MAE(self):
+        if getattr(self, 'counts_above', None) is None:
+            self.threshold_sweep()
         self.errors = dict()
         self.mae = dict()
         for roof_type in utils.ROOF_TYPES:
             self.errors[roof_type] = defaultdict(list)
             self.mae[roof_type] = dict()
-            for thres in self.unique_probs:
-                for img_name in self.img_names:
-                    filtered_detections = self.detections[roof_type][img_name][np.array(self.probs[roof_type][img_name]) > thres]
-                    self.errors[roof_type][thres].append(math.fabs(len(self.correct_roofs[roof_type]) - len(filtered_detections)))  
-                for img_name in self.uninhabited:
-                    filtered_detections = self.detections[roof_type][img_name][np.array(self.probs[roof_type][img_name]) > thres]
-                    self.errors[roof_type][thres].append(math.fabs(len(self.correct_roofs[roof_type]) - len(filtered_detections)))
-                self.mae[roof_type][thres] = np.mean(np.array(self.errors[roof_type][thres]))
+            #one row of errors per threshold
+            errors = np.abs(len(self.correct_roofs[roof_type]) - self.counts_above[roof_type].T).astype(float)
+            for t, thres in enumerate(self.unique_probs):
+                self.errors[roof_type][thres] = errors[t].tolist()
+                self.mae[roof_type][thres] = np.mean(errors[t])
         for roof_type  in utils.ROOF_TYPES:
             with open(self.out_path+'mae_{}.csv'.format(roof_type), 'w') as f:
                 for thres in self.unique_probs:
@@ -62,6 +62,41 @@ class Augmenter(object):
         patch = img[min_0:(min_0+dst_shape[0]), min_1:(min_1+dst_shape[1]), :]
         return patch
 
+
+    @staticmethod
+    def random_flip_crop_batch(X, dst_shape, random_state, out=None):
+        '''Batch version of random_flip followed by random_crop, for neural patches of shape (batch, channels, rows, cols).
+        The flip codes and crop offsets of the whole batch are drawn at once from random_state, with the same
+        distribution as the per patch methods, and applied with a single gather into a float32 batch
+        '''
+        n, channels, rows, cols = X.shape
+        crop_rows, crop_cols = dst_shape
+        #flips: 0 none, 1 rows (flipCode=0), 2 columns (flipCode=1), 3 both (flipCode=-1)
+        flips = random_state.randint(0, 4, size=n)
+        flip_rows = (flips == 1) | (flips == 3)
+        flip_cols = (flips == 2) | (flips == 3)
+
+        #random_crop draws a margin first, then an offset below that margin
+        margin_0 = random_state.randint(0, max(rows-crop_rows, 1), size=n)
+        margin_1 = random_state.randint(0, max(cols-crop_cols, 1), size=n)
+        min_0 = (random_state.random_sample(n)*margin_0).astype(int)
+        min_1 = (random_state.random_sample(n)*margin_1).astype(int)
+
+        #cropping the flipped patch at an offset is the same as reading the original patch backwards from the other end
+        row_range = np.arange(crop_rows)
+        col_range = np.arange(crop_cols)
+        row_idx = np.where(flip_rows[:,None], rows-1-min_0[:,None]-row_range, min_0[:,None]+row_range)
+        col_idx = np.where(flip_cols[:,None], cols-1-min_1[:,None]-col_range, min_1[:,None]+col_range)
+
+        sample_offset = np.arange(n)[:,None,None,None]*channels
+        channel_offset = np.arange(channels)[None,:,None,None]
+        flat_idx = ((sample_offset+channel_offset)*rows + row_idx[:,None,:,None])*cols + col_idx[:,None,None,:]
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = out if out is not None else np.empty((n, channels, crop_rows, crop_cols), dtype=np.float32)
+        np.take(X.reshape(-1), flat_idx, out=out)
+        return out
+
  
 if __name__ == '__main__':
     path = utils.get_path(data_fold=utils.TRAINING, in_or_out=utils.IN)
@@ -0,0 +1,92 @@
+import threading
+import Queue
+
+import numpy as np
+import cv2
+
+import utils
+
+'''
+The debug images of the pipeline: the ground truth and the detections of a roof type drawn on a copy of the image,
+written as a full resolution jpg. DebugImageWriter draws and writes them in a background thread, so that the
+pipeline only pays for queuing them. The queue is bounded: if the writer falls behind, the pipeline waits for it.
+Policies:
+    - off: no debug images
+    - sample: the debug images of every Nth image
+    - false_neg: the debug images of the images in which the final detections miss a roof
+'''
+
+POLICIES = ['off', 'sample', 'false_neg']
+QUEUE_SIZE = 8
+_STOP = None
+
+
+class DebugImageWriter(object):
+    def __init__(self, policy='off', every=10, queue_size=QUEUE_SIZE):
+        if policy not in POLICIES:
+            raise ValueError('Unknown debug image policy {}, use one of {}'.format(policy, POLICIES))
+        self.policy = policy
+        self.every = every
+        self.queue_size = queue_size
+        self.queue = None
+        self.thread = None
+        self.written = 0
+
+    def wants(self, img_num, false_negatives=False):
+        '''Whether the policy wants the debug images of the img_num-th image
+        '''
+        if self.policy == 'sample':
+            return img_num % self.every == 0
+        elif self.policy == 'false_neg':
+            return false_negatives
+        return False
+
+    def submit(self, image, renders):
+        '''Queue the debug images of an image
+        @param image the image to draw on. It is not modified, so it can be the shared read only image
+        @param renders list of (out_file, roofs, detections): the roofs (or None) and detections are boxes
+        '''
+        if self.thread is None:
+            self.queue = Queue.Queue(maxsize=self.queue_size)
+            self.thread = threading.Thread(target=self.write_queued)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put((image, renders))
+
+    def write_queued(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self.render(*job)
+            except Exception as e:
+                #a debug image is not worth stopping the run for
+                print 'Could not write debug image: {}'.format(e)
+            finally:
+                self.queue.task_done()
+
+    def render(self, image, renders):
+        for out_file, roofs, detections in renders:
+            img = np.copy(image)
+            if roofs is not None:
+                utils.draw_detections(roofs, img, rects=True, color=(0,255,0), thickness=6)
+            if len(detections) > 0:
+                utils.draw_detections(detections, img, rects=True, color=(255,0,0), thickness=3)
+            if cv2.imwrite(out_file, img):
+                self.written += 1
+            else:
+                print 'Could not write debug image {}'.format(out_file)
+
+    def flush(self):
+        '''Wait until the queued images are written
+        '''
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+            self.queue = None
@@ -7,6 +7,9 @@ import re
 from collections import defaultdict
 import pickle
 import cProfile
+import itertools
+import multiprocessing
+from multiprocessing.util import Finalize
 import matplotlib.pyplot as plt
 
 import numpy as np
@@ -30,6 +33,9 @@ import viola_detector
 import utils
 from reporting import Detections, Evaluation
 from timer import Timer
+import instrumentation
+from image_provider import ImageProvider
+from debug_images import DebugImageWriter
 import suppression
 from slide_neural import SlidingWindowNeural
 from ensemble import Ensemble
@@ -47,7 +53,8 @@ class Pipeline(object):
                     pickle_viola=None,# single_detector=True, 
                     in_path=None, out_path=None, neural=None, 
                     ensemble=None, 
-                    detector_params=None, pipe=None, out_folder_name=None, net_threshold=0.5):
+                    detector_params=None, pipe=None, out_folder_name=None, net_threshold=0.5, soft_nms=False, 
+                    debug_images='off', debug_every=10):
         '''
         Parameters:
         ------------------
@@ -55,6 +62,10 @@ class Pipeline(object):
             Decides if we should do grouping on neural detections
         method:string
             Can be either 'viola' or 'sliding_window'
+        soft_nms: bool
+            Decay the probability of overlapping detections instead of discarding them
+        debug_images: string
+            Which images get debug images: 'off', 'sample' (every debug_every-th image) or 'false_neg' (see debug_images)
         '''
         assert method=='viola' or method=='slide'
 
@@ -62,9 +73,18 @@ class Pipeline(object):
         self.full_dataset = full_dataset
         self.data_fold = data_fold
 
+        #everything but the ensemble is picklable, so worker processes can build their own copy of the pipeline
+        self.worker_params = dict(method=method, data_fold=data_fold, full_dataset=full_dataset, 
+                                metal_groupThres=metal_groupThres, thatch_groupThres=thatch_groupThres, 
+                                groupBounds=groupBounds, erosion=erosion, suppress=suppress, pickle_viola=pickle_viola, 
+                                in_path=in_path, out_path=out_path, neural=neural, detector_params=detector_params, 
+                                pipe=pipe, out_folder_name=out_folder_name, net_threshold=net_threshold, soft_nms=soft_nms, 
+                                debug_images=debug_images, debug_every=debug_every)
+
         self.groupThres = dict()
         self.groupThres['thatch'] = float(metal_groupThres)
         self.groupThres['metal'] = float(thatch_groupThres)
+        self.soft_nms = soft_nms
         self.groupBounds = groupBounds
         self.erosion = erosion
 
@@ -118,107 +138,201 @@ class Pipeline(object):
 
         self.neural_time = defaultdict(int)
         self.viola_time = defaultdict(int)
+        #per image spans and counters, see instrumentation
+        self.instruments = instrumentation.Recorder()
+        #the debug images are drawn and written in the background
+        self.debug_images = DebugImageWriter(policy=debug_images, every=debug_every)
 
 
-    def run(self, img_type='inhabited', img_names=None, in_path=None):
+    def run(self, img_type='inhabited', img_names=None, in_path=None, workers=1):
         '''
         1. Find proposals using ViolaJones or sliding window
         2. Resize the window and classify it
         3. Net returns a list of the roof coordinates of each type - saved in roof_coords
-        '''
 
+        If workers > 1, the images are processed by a pool of worker processes, each with its own 
+        detectors and nets. The results are merged in the same order as img_names.
+        '''
         img_names = img_names if img_names is not None else self.img_names
         in_path = in_path if in_path is not None else self.in_path
-        for i, img_name in enumerate(img_names):
-            print '***************** Image {0}: {1}/{2} *****************'.format(img_name, i, len(img_names)-1)
-
-            #VIOLA: currently it does no scoring, we commented out in viola_detector.py
-            rect_detections = dict()
+        #each image is decoded once for all the stages, and released once the run is done
+        ImageProvider.start_run()
+        if workers > 1:
+            worker_params = dict(self.worker_params)
             if self.method == 'viola':
-                if self.pickle_viola is None:
-                    img = self.viola.detect_roofs(img_name=img_name, in_path=in_path)
-                    current_viola_detections = self.viola.viola_detections 
-                    self.viola_time[img_type] = self.viola.evaluation.detections.total_time
-                else:#use the pickled detections for speed in testing the neural network
-                    current_viola_detections = self.viola_evaluation.detections
-                    self.viola_time[img_type] = self.viola_evaluation.detections.total_time 
-                proposal_patches, proposal_coords, img_shape = self.find_viola_proposals(current_viola_detections, img_name=img_name, in_path=in_path)
-                for roof_type in utils.ROOF_TYPES:
-                    if len(proposal_coords[roof_type]) > 0:
-                        rect_detections[roof_type] = utils.polygons2boxes(proposal_coords[roof_type])
-                    else:
-                        rect_detections[roof_type] = np.array([])
-
-            #SLIDING WINDOW: also does no scoring
-            elif self.method == 'slide':
-                with Timer() as t:
-                    #get the roofs with sliding detector
-                    proposal_coords, rect_detections = self.slider.get_windows(img_name, in_path=in_path) 
-                    #convert them to patches
-                    proposal_patches, img_shape = self.find_slider_proposals(rect_detections, img_name=img_name, in_path=in_path)
-                print 'Sliding window detection for one image took {} seconds'.format(t.secs)
-            else:
-                print 'Unknown detection method {}'.format(self.method)
-                sys.exit(-1)
-
-            if in_path == self.in_path:
-                self.print_detections(rect_detections, img_name, '_viola')
-           
-            #NEURALNET
-            print 'Starting neural classification of image {}'.format(img_name)
+                #split the cores between the workers instead of giving each worker a thread per core
+                threads = max(1, multiprocessing.cpu_count()/workers)
+                worker_params['detector_params'] = dict(self.worker_params['detector_params'], threads=threads)
+            pool = multiprocessing.Pool(processes=workers, initializer=init_pipeline_worker, 
+                                        initargs=(worker_params, self.ensemble.get_params()))
+            jobs = [(img_name, i, len(img_names), in_path) for i, img_name in enumerate(img_names)]
+            results = pool.imap(process_image_in_worker, jobs)
+        else:
+            pool = None
+            results = (self.process_image(img_name, i, len(img_names), in_path) for i, img_name in enumerate(img_names))
+
+        try:
+            for img_name, (rect_detections, probs, viola_secs, neural_secs, record) in itertools.izip(img_names, results):
+                self.viola_time[img_type] += viola_secs
+                self.neural_time[img_type] += neural_secs
+                self.instruments.add(record, img_type)
+
+                #AUC AND CLASSIFICATION USING THE GROUPED DETECTIONS
+                #only do AUC with the inhabited images
+                if in_path == self.in_path:
+                    self.auc.set_detections(rect_detections, img_name)
+                    self.auc.set_probs(probs, img_name)
+                #only do classification if we are using the testing set
+                if self.data_fold == utils.TESTING:
+                    self.classification.set_detections(rect_detections, img_name)
+                    self.classification.set_probs(probs, img_name)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self.debug_images.flush()
+
+        if self.method == 'viola' and self.pickle_viola is not None:
+            #the pickled detections only store the detection time of the whole image set
+            self.viola_time[img_type] = self.viola_evaluation.detections.total_time
+
+
+    def close(self):
+        '''Stop the threads of the viola detector and of the debug image writer, once all the runs are done
+        '''
+        if self.method == 'viola' and self.pickle_viola is None:
+            self.viola.close()
+        self.debug_images.close()
+
+
+    def process_image(self, img_name, img_num, total_imgs, in_path):
+        '''Detect, classify and group the roofs of a single image.
+        Returns the grouped detections and their probabilities, the time spent on detection and on the neural network,
+        and the instrumentation record of the image
+        '''
+        print '***************** Image {0}: {1}/{2} *****************'.format(img_name, img_num, total_imgs-1)
+        instrumentation.start_image(img_name)
+
+        #VIOLA: currently it does no scoring, we commented out in viola_detector.py
+        rect_detections = dict()
+        viola_secs = 0
+        if self.method == 'viola':
+            if self.pickle_viola is None:
+                time_before = self.viola.evaluation.detections.total_time
+                img = self.viola.detect_roofs(img_name=img_name, in_path=in_path)
+                current_viola_detections = self.viola.viola_detections 
+                viola_secs = self.viola.evaluation.detections.total_time - time_before
+            else:#use the pickled detections for speed in testing the neural network
+                current_viola_detections = self.viola_evaluation.detections
+            proposal_patches, proposal_coords, img_shape = self.find_viola_proposals(current_viola_detections, img_name=img_name, in_path=in_path)
+            for roof_type in utils.ROOF_TYPES:
+                if len(proposal_coords[roof_type]) > 0:
+                    rect_detections[roof_type] = utils.polygons2boxes(proposal_coords[roof_type])
+                else:
+                    rect_detections[roof_type] = np.array([])
+
+        #DENSE SLIDING WINDOW: the nets score the windows while sliding, so there are no patches to classify
+        elif self.method == 'slide' and self.slider.dense:
+            with Timer() as t:
+                rect_detections, dense_probs = self.slider.get_dense_windows(img_name, self.ensemble, in_path=in_path) 
+            print 'Dense sliding window scoring for one image took {} seconds'.format(t.secs)
+            proposal_patches = None
+            dense_secs = t.secs
+
+        #SLIDING WINDOW: also does no scoring
+        elif self.method == 'slide':
             with Timer() as t:
-                #NOTE: classified detections only has roofs with prob >= 0.5
+                #get the roofs with sliding detector
+                proposal_coords, rect_detections = self.slider.get_windows(img_name, in_path=in_path) 
+                #convert them to patches
+                proposal_patches, img_shape = self.find_slider_proposals(rect_detections, img_name=img_name, in_path=in_path)
+            print 'Sliding window detection for one image took {} seconds'.format(t.secs)
+        else:
+            print 'Unknown detection method {}'.format(self.method)
+            sys.exit(-1)
+
+        for roof_type in utils.ROOF_TYPES:
+            instrumentation.count('pipeline.proposals', len(rect_detections[roof_type]))
+
+        #the debug images are queued at the end, when we know whether the image has false negatives
+        debug_detections = [(rect_detections, '_viola')]
+       
+        #NEURALNET
+        print 'Starting neural classification of image {}'.format(img_name)
+        with Timer() as t:
+            #NOTE: classified detections only has roofs with prob >= 0.5
+            if proposal_patches is None:
+                classified_detections, probs  = self.neural_classification_AUC(None, rect_detections, probs=dense_probs) 
+            else:
                 classified_detections, probs  = self.neural_classification_AUC(proposal_patches, rect_detections) 
-            print 'Classification took {} secs'.format(t.secs)
-            self.neural_time[img_type] += t.secs
+        print 'Classification took {} secs'.format(t.secs)
+        neural_secs = t.secs if proposal_patches is not None else t.secs+dense_secs
 
-            #GROUPING
-            rect_detections, probs, grouping_time  = self.nonmax_suppression(rect_detections, probs)   
-            self.neural_time[img_type] += grouping_time
-            
-            #PRINTING DETECTIONS
-            if in_path == self.in_path:
-                self.print_detections({'metal':classified_detections['metal'][0],'thatch':classified_detections['thatch'][0]}, img_name, '_neural')
-            det = dict()
-            for roof_type in utils.ROOF_TYPES:
-                det[roof_type] = rect_detections[roof_type][probs[roof_type]>0.5]
-            if in_path == self.in_path:
-                self.print_detections(det, img_name, '_grouped')
-
-            #AUC AND CLASSIFICATION USING THE GROUPED DETECTIONS
-            #only do AUC with the inhabited images
-            if in_path == self.in_path:
-                self.auc.set_detections(rect_detections, img_name)
-                self.auc.set_probs(probs, img_name)
-            #only do classification if we are using the testing set
-            if self.data_fold == utils.TESTING:
-                self.classification.set_detections(rect_detections, img_name)
-                self.classification.set_probs(probs, img_name)
-
-
-    def print_detections(self, detections, img_name, title):
-        if detections is not None:
+        #GROUPING
+        rect_detections, probs, grouping_time  = self.nonmax_suppression(rect_detections, probs)   
+        neural_secs += grouping_time
+        
+        #PRINTING DETECTIONS
+        debug_detections.append(({'metal':classified_detections['metal'][0],'thatch':classified_detections['thatch'][0]}, '_neural'))
+        det = dict()
+        for roof_type in utils.ROOF_TYPES:
+            det[roof_type] = rect_detections[roof_type][probs[roof_type]>0.5]
+        debug_detections.append((det, '_grouped'))
+        if in_path == self.in_path:
+            self.print_detections(debug_detections, img_name, img_num)
+        return rect_detections, probs, viola_secs, neural_secs, instrumentation.end_image()
+
+
+    @instrumentation.timed('pipeline.debug_images')
+    def print_detections(self, titled_detections, img_name, img_num):
+        '''Queue the debug images of an image if the debug policy wants them: for each (detections, title) 
+        and roof type, the ground truth and the detections drawn on the image. The last detections are the final ones
+        '''
+        if self.debug_images.policy == 'off':
+            return
+        false_negatives = self.debug_images.policy == 'false_neg' and self.has_false_negatives(titled_detections[-1][0], img_name)
+        if not self.debug_images.wants(img_num, false_negatives=false_negatives):
+            return
+
+        correct_roofs = self.evaluation_after_neural[0].correct_roofs
+        renders = list()
+        for detections, title in titled_detections:
+            if detections is None:
+                continue
             for roof_type, detects in detections.iteritems():
-                img = cv2.imread(self.in_path+img_name)
+                #the uninhabited images do not have an entry
+                roofs = correct_roofs[roof_type].get(img_name)
+                out_file = 'debug/{}_{}_{}{}.jpg'.format(self.groupThres[roof_type], img_name[:-4], roof_type, title)
+                renders.append((out_file, roofs, np.asarray(detects)))
+        self.debug_images.submit(ImageProvider.get_provider().get_color(self.in_path+img_name), renders)
+        instrumentation.count('pipeline.debug_images', len(renders))
 
-                if img_name in self.evaluation_after_neural[0].correct_roofs[roof_type]:
-                    #the uninhabited images do not have an entry
-                    utils.draw_detections(self.evaluation_after_neural[0].correct_roofs[roof_type][img_name], img, rects=True, color=(0,255,0), thickness=6)
-                if detects.shape[0] > 0: 
-                    utils.draw_detections(detects, img, rects=True, color=(255,0,0), thickness=3)
 
-                cv2.imwrite('debug/{}_{}_{}{}.jpg'.format(self.groupThres[roof_type], img_name[:-4],roof_type, title), img)
+    def has_false_negatives(self, detections, img_name):
+        '''Whether a roof of the image is not matched by any of the detections, i.e. no detection has a VOC 
+        score above utils.VOC_threshold with it, as in Evaluation
+        '''
+        for roof_type in utils.ROOF_TYPES:
+            roofs = self.evaluation_after_neural[0].correct_roofs[roof_type].get(img_name, [])
+            if len(roofs) == 0:
+                continue
+            if len(detections[roof_type]) == 0:
+                return True
+            voc_scores, _ = Evaluation.get_score_matrix(roofs, detections[roof_type])
+            if np.any(~(np.max(voc_scores, axis=1) > utils.VOC_threshold)):
+                return True
+        return False
 
 
     def nonmax_suppression(self, rect_detections, probs):
+        instrumentation.count('nms.in', sum([len(rect_detections[roof_type]) for roof_type in utils.ROOF_TYPES]))
         with Timer() as t:
-            #set detections and score
-            for roof_type in utils.ROOF_TYPES:
-                #proper non max suppression from Felzenszwalb et al.
-                if len(rect_detections[roof_type]) > 0:
-                    rect_detections[roof_type], probs[roof_type] = suppression.non_max_suppression(rect_detections[roof_type], 
-                                        probs[roof_type], overlapThres = self.groupThres[roof_type])
+            #proper non max suppression from Felzenszwalb et al., all roof types at once
+            rect_detections, probs = suppression.batched_non_max_suppression(rect_detections, probs, 
+                                        overlapThres=self.groupThres, soft=self.soft_nms)
         print 'Grouping took {} seconds'.format(t.secs)
+        instrumentation.add_time('nms', t.secs)
+        instrumentation.count('nms.out', sum([len(rect_detections[roof_type]) for roof_type in utils.ROOF_TYPES]))
         return rect_detections, probs, t.secs
 
 
@@ -269,7 +383,8 @@ class Pipeline(object):
         '''
         in_path = self.in_path if in_path is None else in_path
         try:
-            img_full = cv2.imread(in_path+img_name, flags=cv2.IMREAD_COLOR)
+            with instrumentation.span('pipeline.decode'):
+                img_full = ImageProvider.get_provider().get_color(in_path+img_name)
             img_shape = img_full.shape
         except IOError as e:
             print e
@@ -282,17 +397,13 @@ class Pipeline(object):
         for roof_type in ['metal', 'thatch']: 
             all_proposal_coords[roof_type] = viola_detections.get_detections(img_name=img_name, roof_type=roof_type)
             #all_proposal_coords[roof_type] = self.viola.viola_detections.get_detections(img_name=img_name, roof_type=roof_type)
-            patches = np.empty((len(all_proposal_coords[roof_type]), 3, utils.PATCH_W, utils.PATCH_H)) 
-
-            for i, detection in enumerate(all_proposal_coords[roof_type]): 
-                #extract the patch from the image using utils code
-                img = utils.four_point_transform(img_full, detection)
-
-                #transform the patch using utils code
-                patch = utils.cv2_to_neural(img)
-                patches[i, :, :,:] = patch 
 
-            all_proposal_patches[roof_type] = patches  
+            #extract and straighten all patches of this roof type in one go 
+            #they stay at the patch size because the scaler of the nets was fit on patches of that size
+            with instrumentation.span('pipeline.patch_extraction'):
+                all_proposal_patches[roof_type] = utils.extract_neural_patches(img_full, all_proposal_coords[roof_type], 
+                                                                            w=utils.PATCH_W, h=utils.PATCH_H)
+            instrumentation.count('pipeline.patches', len(all_proposal_patches[roof_type]))
 
         return all_proposal_patches, all_proposal_coords, img_shape
 
@@ -301,7 +412,8 @@ class Pipeline(object):
         #rects are in the form of (x, y, w, h)
         in_path = self.in_path if in_path is None else in_path
         try:
-            img_full = cv2.imread(in_path+img_name, flags=cv2.IMREAD_COLOR)
+            with instrumentation.span('pipeline.decode'):
+                img_full = ImageProvider.get_provider().get_color(in_path+img_name)
             img_shape = img_full.shape
         except IOError as e:
             print e
@@ -311,14 +423,21 @@ class Pipeline(object):
         
         #extract patches for neural network classification
         for roof_type in ['metal', 'thatch']: 
-            patches = np.empty((len(slider_rects[roof_type]), 3, utils.PATCH_W, utils.PATCH_H)) 
-
-            for i, rect in enumerate(slider_rects[roof_type]): 
-                #extract the patch from the image using utils code
-                img = img_full[rect.ymin:rect.ymax, rect.xmin:rect.xmax, :]
-                #transform the patch using utils code
-                patch = utils.cv2_to_neural(img)
-                patches[i, :, :,:] = patch 
+            #the roof types usually share the same window grid, so the patches are only extracted once
+            shared = [t for t in all_proposal_patches if slider_rects[t] is slider_rects[roof_type]]
+            if len(shared) > 0:
+                all_proposal_patches[roof_type] = all_proposal_patches[shared[0]]
+                continue
+
+            rects = np.asarray(slider_rects[roof_type], dtype=int).reshape(-1, 4)
+            patches = np.empty((len(rects), 3, utils.PATCH_W, utils.PATCH_H), dtype=np.float32) 
+            with instrumentation.span('pipeline.patch_extraction'):
+                #the time goes into the INTER_AREA resizes, not the loop: cropping the windows of a size together and
+                #resizing them as one stacked image gives the same patches, but was not faster
+                for i, (xmin, ymin, xmax, ymax) in enumerate(rects): 
+                    #extract the patch from the image and transform it using utils code
+                    patches[i, :, :,:] = utils.cv2_to_neural(img_full[ymin:ymax, xmin:xmax, :])
+            instrumentation.count('pipeline.patches', len(patches))
 
             all_proposal_patches[roof_type] = patches  
 
@@ -377,15 +496,20 @@ class Pipeline(object):
 
 
 
-    def neural_classification_AUC(self, proposal_patches, proposal_coords):
+    def neural_classification_AUC(self, proposal_patches, proposal_coords, probs=None):
         #get the classification by evaluating it compared to the real roofs
         #get the probability of it being that type of roof
+        #if the probabilities were already computed (dense sliding window), they are passed in probs
         classified_detections = dict()
+        given_probs = probs
         probs = dict()
         for roof_type in utils.ROOF_TYPES:
             classified_detections[roof_type] = list()
-            if proposal_patches[roof_type].shape[0] > 1:
-                probs[roof_type] = self.ensemble.predict_proba(proposal_patches[roof_type], roof_type=roof_type)
+            if len(proposal_coords[roof_type]) > 1:
+                if given_probs is not None:
+                    probs[roof_type] = given_probs[roof_type]
+                else:
+                    probs[roof_type] = self.ensemble.predict_proba(proposal_patches[roof_type], roof_type=roof_type)
                 #different detections depending on threshold
                 coords = np.array(proposal_coords[roof_type])
                 for thres in self.auc_thresholds:
@@ -412,6 +536,22 @@ class Pipeline(object):
         cv2.imwrite(self.out_path+img_name, img)
 
 
+#each worker process holds its own pipeline, with its own detectors and nets
+worker_pipeline = None
+
+def init_pipeline_worker(pipeline_params, ensemble_params):
+    global worker_pipeline
+    ensemble = Ensemble(**ensemble_params)
+    worker_pipeline = Pipeline(ensemble=ensemble, **pipeline_params)
+    #stop the detector threads and write the queued debug images before the worker exits
+    Finalize(worker_pipeline, worker_pipeline.close, exitpriority=10)
+
+
+def process_image_in_worker(job):
+    img_name, img_num, total_imgs, in_path = job
+    return worker_pipeline.process_image(img_name, img_num, total_imgs, in_path)
+
+
 def setup_params(parameters, pipe_fname, method=None, decision='decideMean'):
     '''
     Get parameters for the pipeline and the components of the pipeline:
@@ -464,6 +604,8 @@ def setup_params(parameters, pipe_fname, method=None, decision='decideMean'):
         detector_params['minSize'] = (50,50)
         detector_params['windowSize'] = (15,15)
         detector_params['stepSize'] = 4
+        if 'dense' in parameters:
+            detector_params['dense'] = parameters['dense'] == 'True'
 
     else:
         print 'Unknown method of detection {}'.format(method)
@@ -476,8 +618,11 @@ def get_main_param_filenum():
     viola_num = -1
     sliding_num = -1
     groupThres = None
+    workers = 1
+    debug_images = 'off'
+    debug_every = 10
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "v:s:d:g:")
+        opts, args = getopt.getopt(sys.argv[1:], "v:s:d:g:w:p:n:")
     except getopt.GetoptError:
         print 'Command line error'
         sys.exit(2)  
@@ -488,14 +633,20 @@ def get_main_param_filenum():
             sliding_num = int(float(arg))
         elif opt == '-g':
             groupThres = float(arg)
-    return viola_num, sliding_num, groupThres 
+        elif opt == '-w':
+            workers = int(float(arg))
+        elif opt == '-p':
+            debug_images = arg
+        elif opt == '-n':
+            debug_every = int(float(arg))
+    return viola_num, sliding_num, groupThres, workers, debug_images, debug_every
 
 
 if __name__ == '__main__':
     full_dataset = False 
     data_fold = utils.TESTING
 
-    viola_num, sliding_num, groupThres = get_main_param_filenum()
+    viola_num, sliding_num, groupThres, workers, debug_images, debug_every = get_main_param_filenum()
     decision = 'decideMean'
 
     pickle_viola = False 
@@ -551,7 +702,8 @@ if __name__ == '__main__':
                     in_path=in_path, out_path=out_path, 
                     groupBounds=groupBounds, 
                     ensemble=neural_ensemble, 
-                    detector_params=detector_params, out_folder_name=pipe_fname, **pipe_params)  
+                    detector_params=detector_params, out_folder_name=pipe_fname, 
+                    debug_images=debug_images, debug_every=debug_every, **pipe_params)  
     #if pickle_auc == False:
     #else:
     #    with open(out_path+'auc.pickle', 'rb') as f:
@@ -565,17 +717,20 @@ if __name__ == '__main__':
         uninhabited_imgs = [i for i in os.listdir(utils.UNINHABITED_PATH)][:1]
     else:
         uninhabited_imgs = [i for i in os.listdir(utils.UNINHABITED_PATH)]
-    pipe.run()
+    pipe.run(workers=workers)
     pipe.auc.plot_auc()
 
     if data_fold == utils.TESTING:
-        pipe.run(img_type='uninhabited', img_names=uninhabited_imgs, in_path=utils.UNINHABITED_PATH)
+        pipe.run(img_type='uninhabited', img_names=uninhabited_imgs, in_path=utils.UNINHABITED_PATH, workers=workers)
+    pipe.close()
     with open(out_path+'timing.csv', 'w') as f:
         if data_fold == utils.TESTING:
             f.write('uninhabited,{},{},{}\n'.format(pipe.viola_time['uninhabited'], pipe.neural_time['uninhabited'], 
                                                                         pipe.viola_time['uninhabited']+pipe.neural_time['uninhabited']))
         f.write('inhabited,{},{},{}\n'.format(pipe.viola_time['inhabited'], pipe.neural_time['inhabited'], 
                                                         pipe.viola_time['inhabited']+pipe.neural_time['inhabited']))
+    #the spans and counters of every image, with the totals of the run
+    pipe.instruments.write(out_path+'timing.json')
     #save the classification and auc
     with open(out_path+'auc.pickle', 'wb') as f:
         pickle.dump(pipe.auc, f)
@@ -6,6 +6,7 @@ import neural_network
 from neural_network import Experiment
 import utils
 import math
+import instrumentation
 
 from collections import defaultdict
 from nolearn.lasagne.visualize import plot_loss
@@ -15,13 +16,20 @@ from nolearn.lasagne.visualize import plot_occlusion
 
 
 class Ensemble(object):
-    def __init__(self, preloaded_paths, scoring_strategy=None, method=None):
+    def __init__(self, preloaded_paths, scoring_strategy=None, method=None, neural_nets=None):
+        self.preloaded_paths = preloaded_paths
         self.method = method
-        self.process_preloaded_paths(preloaded_paths)
-        self.process_paths_get_nets()
+        if neural_nets is None:
+            self.process_preloaded_paths(preloaded_paths)
+            self.process_paths_get_nets()
+        else:
+            #nets that are already built, roof_type -> list of nets with a predict_proba like Experiment
+            self.neural_nets = neural_nets
+            self.num_nets = dict([(roof_type, len(nets)) for roof_type, nets in neural_nets.iteritems()])
         self.net_threshold = 0.5
         self.scoring_strategy = scoring_strategy
 
+    @instrumentation.timed('ensemble.predict')
     def predict_proba(self, X, roof_type=None):
         if roof_type is None:
             avg_probs = dict()
@@ -34,11 +42,29 @@ class Ensemble(object):
         else:
             probs = np.zeros((len(self.neural_nets[roof_type]), X.shape[0]))
             print len(self.neural_nets[roof_type]), X.shape[0]
+            instrumentation.count('ensemble.patches', X.shape[0])
             for n, net in enumerate(self.neural_nets[roof_type]):
                 all_probs = net.predict_proba(X)
                 probs[n, :]  = all_probs[:,1]
             return self.get_score(probs, roof_type)
 
+    @instrumentation.timed('ensemble.predict_dense')
+    def predict_proba_dense(self, image, roof_type, window_size):
+        '''Score all windows of window_size in image with the nets of roof_type, see Experiment.predict_proba_dense.
+        Returns a (rows, cols) map of scores and the step in pixels between windows
+        '''
+        probs = list()
+        for net in self.neural_nets[roof_type]:
+            all_probs, step = net.predict_proba_dense(image, window_size)
+            probs.append(all_probs[1])
+        map_shape = probs[0].shape
+        probs = np.array([p.reshape(-1) for p in probs])
+        return self.get_score(probs, roof_type).reshape(map_shape), step
+
+    def get_params(self):
+        #the parameters needed to build the same ensemble again, for instance in another process
+        return dict(preloaded_paths=self.preloaded_paths, scoring_strategy=self.scoring_strategy, method=self.method)
+
     def get_score(self, probs, roof_type):
         if self.scoring_strategy == 'decideMajority':
             threshold_probs = np.array(probs >= self.net_threshold, dtype=int)    
@@ -115,6 +141,9 @@ class Ensemble(object):
                 neural_params['roof_type'] = roof_type
                 #for each net in the ensemble, we start at a different data batch, that way we get a variety of data for training
                 current_net = Experiment(pipeline=True, method=self.method, starting_batch=starting_batch, **neural_params) 
+                #the first time a pickled net is used, save its artifact so the next startup skips loading the training data
+                if current_net.loaded_from_artifact == False:
+                    current_net.save_artifact()
                 self.neural_nets[roof_type].append(current_net) 
 
 if __name__ == '__main__':
@@ -38,12 +38,13 @@ class DataLoader(object):
         if full_dataset==False:
             folder_path = folder_path if folder_path is not None else utils.get_path(in_or_out=utils.IN, data_fold=utils.TRAINING)
             img_names = [f for f in os.listdir(folder_path) if f.endswith('.jpg')]
+            all_polygons = AnnotationIndex.get_index(folder_path).get_polygons(img_names)
             all_patches = defaultdict(list)
             for img_name in img_names:
                 if merge_imgs == False:
                     all_patches[img_name] = dict()
                 for roof_type in utils.ROOF_TYPES:
-                    polygons = DataLoader.get_polygons(roof_type=roof_type, xml_path=folder_path, xml_name=img_name[:-3]+'xml')
+                    polygons = all_polygons[roof_type][img_name]
                     if merge_imgs == False:
                         all_patches[img_name][roof_type] = DataLoader.extract_patches(polygons, img_path=folder_path+img_name, grayscale=grayscale)
                     else:
@@ -258,28 +259,98 @@ class DataLoader(object):
         #the manually annotated coordinates do not actually make up rectangles
         #so we find the minbounding rects of the polygons to obtain rectangles
 
-        #draw the detections onto a binary image
+        #draw the detections onto a binary image. The image only needs to cover the polygon 
+        #(with a one pixel margin), the contour is shifted back to the coordinates of the full 1200x2000 image
         min_polygons = list()
         for polygon in polygon_list:
-            bitmap = np.zeros((1200, 2000), np.uint8) 
-            utils.draw_detections([polygon], bitmap, fill=True, color=1)
+            polygon = np.array(polygon, dtype=np.int32)
+            xmin, ymin = max(0, polygon[:,0].min()-1), max(0, polygon[:,1].min()-1)
+            xmax, ymax = min(2000, polygon[:,0].max()+2), min(1200, polygon[:,1].max()+2)
+            bitmap = np.zeros((ymax-ymin, xmax-xmin), np.uint8) 
+            utils.draw_detections([polygon-(xmin, ymin)], bitmap, fill=True, color=1)
 
             #get contours
-            contours, hierarchy = cv2.findContours(bitmap, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+            contours, hierarchy = cv2.findContours(bitmap, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=(xmin, ymin))
 
             #get the min bounding rect for the rects
-            min_area_rect = cv2.minAreaRect(contours[0]) # rect = ((center_x,center_y),(width,height),angle)
-            min_area_rect_list = [list(x) if type(x) is tuple else x for x in min_area_rect] 
-            min_area_rect_list[1][0] += padding 
-            min_area_rect_list[1][1] += padding 
-
-            cnt = tuple(tuple(x) if type(x) is list else x for x in min_area_rect_list)#, dtype=np.int32)
-            min_poly = np.int0(cv2.cv.BoxPoints(cnt))
+            (center, (width, height), angle) = cv2.minAreaRect(contours[0]) # rect = ((center_x,center_y),(width,height),angle)
+            min_area_rect = (center, (width+padding, height+padding), angle)
+            min_poly = np.int0(cv2.cv.BoxPoints(min_area_rect))
             min_polygons.append(min_poly)
 
         return np.array(min_polygons)
 
 
+class AnnotationIndex(object):
+    '''
+    The ground truth roofs of the images in a folder, parsed once and shared by every Evaluation 
+    (and through it AucCurve and Classification) built on that folder.
+    For each roof type and image it keeps the roofs as an (N, 4) array of boxes xmin, ymin, xmax, ymax, and 
+    the (N, 4, 2) polygons they come from. An image is parsed again if one of its xml files has changed.
+    '''
+    indexes = dict()
+
+    def __init__(self, xml_path, full_dataset=False):
+        self.xml_path = xml_path
+        self.full_dataset = full_dataset
+        self.boxes = dict([(roof_type, dict()) for roof_type in utils.ROOF_TYPES])
+        self.polygons = dict([(roof_type, dict()) for roof_type in utils.ROOF_TYPES])
+        self.mtimes = dict()
+
+    @staticmethod
+    def get_index(xml_path, full_dataset=False):
+        key = (os.path.abspath(xml_path), full_dataset)
+        if key not in AnnotationIndex.indexes:
+            AnnotationIndex.indexes[key] = AnnotationIndex(xml_path, full_dataset=full_dataset)
+        return AnnotationIndex.indexes[key]
+
+    def get_boxes(self, img_names):
+        '''Returns roof_type -> img_name -> boxes of the roofs
+        '''
+        for img_name in img_names:
+            self.update(img_name)
+        return dict([(roof_type, dict([(img_name, self.boxes[roof_type][img_name]) for img_name in img_names])) 
+                                                                                for roof_type in utils.ROOF_TYPES])
+
+    def get_polygons(self, img_names):
+        '''Returns roof_type -> img_name -> polygons of the roofs
+        '''
+        for img_name in img_names:
+            self.update(img_name)
+        return dict([(roof_type, dict([(img_name, self.polygons[roof_type][img_name]) for img_name in img_names])) 
+                                                                                for roof_type in utils.ROOF_TYPES])
+
+    def get_xml_files(self, img_name):
+        xml_name = img_name[:-3]+'xml'
+        if self.full_dataset:
+            return [self.xml_path+xml_name]
+        #the metal polygons always come from the rectified coordinates, see get_metal_polygons
+        return [utils.RECTIFIED_COORDINATES+xml_name, self.xml_path+xml_name]
+
+    def update(self, img_name):
+        mtimes = [os.path.getmtime(xml_file) for xml_file in self.get_xml_files(img_name)]
+        if self.mtimes.get(img_name) == mtimes:
+            return
+
+        xml_name = img_name[:-3]+'xml'
+        if self.full_dataset:
+            rects = DataLoader.get_all_roofs_full_dataset(xml_name=xml_name, xml_path=self.xml_path)
+            for roof_type in utils.ROOF_TYPES:
+                boxes = np.array(rects[roof_type] if roof_type in rects else [], dtype=int).reshape(-1, 4)
+                self.boxes[roof_type][img_name] = boxes
+                self.polygons[roof_type][img_name] = np.array([utils.convert_rect_to_polygon((xmin, ymin, xmax-xmin, ymax-ymin)) 
+                                                            for xmin, ymin, xmax, ymax in boxes], dtype=int).reshape(-1, 4, 2)
+        else:
+            for roof_type in utils.ROOF_TYPES:
+                polygons = DataLoader.get_polygons(roof_type=roof_type, xml_name=xml_name, xml_path=self.xml_path)
+                self.polygons[roof_type][img_name] = np.array(polygons, dtype=int).reshape(-1, 4, 2)
+                if len(polygons) > 0:
+                    self.boxes[roof_type][img_name] = utils.polygons2boxes(polygons)
+                else:
+                    self.boxes[roof_type][img_name] = np.zeros((0, 4), dtype=int)
+        self.mtimes[img_name] = mtimes
+
+
 #######################################################################
 ## SEPARATING THE DATA INTO TRAIN, VALIDATION AND TESTING SETS
 #######################################################################
@@ -0,0 +1,96 @@
+import os
+from collections import OrderedDict
+
+import cv2
+
+import instrumentation
+
+'''
+ImageProvider decodes each image once per run and hands the same array to every stage that needs it:
+the viola detector, the proposal extraction, the debug images and the evaluation.
+It keeps the last few images in an LRU keyed by path, each with the variants derived from it so far:
+    - color: the BGR image, as cv2.imread(path, flags=cv2.IMREAD_COLOR)
+    - gray: its grayscale version
+    - equalized: the histogram equalized grayscale, what the cascades run on
+The arrays are read only, since they are shared. Code that draws on an image asks for get_copy().
+An image is decoded again if its file has changed.
+
+There is one provider per process: ImageProvider.get_provider() returns it, ImageProvider.start_run() replaces it
+with an empty one. Worker processes each have their own.
+'''
+
+MAX_IMAGES = 4
+
+
+class ImageProvider(object):
+    current = None
+
+    def __init__(self, max_images=MAX_IMAGES):
+        self.max_images = max_images
+        self.images = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_provider():
+        if ImageProvider.current is None:
+            ImageProvider.current = ImageProvider()
+        return ImageProvider.current
+
+    @staticmethod
+    def start_run(max_images=MAX_IMAGES):
+        '''Start a run with an empty provider, so that the images of a previous run are released
+        '''
+        ImageProvider.current = ImageProvider(max_images=max_images)
+        return ImageProvider.current
+
+    def get_entry(self, path):
+        '''The variants of the image at path decoded so far, in the LRU. Raises IOError if the image can't be read
+        '''
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            raise IOError('Cannot open {}'.format(path))
+
+        entry = self.images.pop(path, None)
+        if entry is not None and entry['mtime'] == mtime:
+            self.hits += 1
+            instrumentation.count('images.cache_hits')
+        else:
+            self.misses += 1
+            instrumentation.count('images.decoded')
+            color = cv2.imread(path, flags=cv2.IMREAD_COLOR)
+            if color is None:
+                raise IOError('Cannot open {}'.format(path))
+            color.setflags(write=False)
+            entry = dict(mtime=mtime, color=color)
+            if len(self.images) >= self.max_images:
+                self.images.popitem(last=False)
+        #it's now the most recently used
+        self.images[path] = entry
+        return entry
+
+    def get_color(self, path):
+        return self.get_entry(path)['color']
+
+    def get_gray(self, path):
+        return ImageProvider.add_gray(self.get_entry(path))
+
+    def get_equalized(self, path):
+        entry = self.get_entry(path)
+        if 'equalized' not in entry:
+            entry['equalized'] = cv2.equalizeHist(ImageProvider.add_gray(entry))
+            entry['equalized'].setflags(write=False)
+        return entry['equalized']
+
+    @staticmethod
+    def add_gray(entry):
+        if 'gray' not in entry:
+            entry['gray'] = cv2.cvtColor(entry['color'], cv2.COLOR_BGR2GRAY)
+            entry['gray'].setflags(write=False)
+        return entry['gray']
+
+    def get_copy(self, path):
+        '''A writable copy of the color image, to draw on
+        '''
+        return self.get_color(path).copy()
@@ -0,0 +1,115 @@
+import time
+import json
+import resource
+import functools
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+
+'''
+Lightweight instrumentation of the detection pipeline: named spans (seconds) and counters, collected per image.
+The code being measured calls span(), timed() and count(), which record into the image currently open in this process.
+When no image is open they do nothing, so the detectors and nets can be used on their own without any cost.
+
+Pipeline.process_image opens an image with start_image() and closes it with end_image(), which returns its record.
+A Recorder keeps the records of a run per image type and writes them, with the totals of the run, as JSON.
+Span names are of the form <component>.<stage>, e.g. viola.decode, ensemble.predict, nms.
+'''
+
+_current = None
+
+
+def start_image(img_name):
+    global _current
+    _current = dict(img_name=img_name, start=time.time(), spans=defaultdict(float), counters=defaultdict(int))
+
+
+def end_image():
+    '''Close the current image and return its record
+    '''
+    global _current
+    if _current is None:
+        return None
+    record = OrderedDict()
+    record['img_name'] = _current['img_name']
+    record['total_secs'] = time.time()-_current['start']
+    record['spans'] = dict(_current['spans'])
+    record['counters'] = dict(_current['counters'])
+    record['peak_rss_kb'] = peak_rss_kb()
+    _current = None
+    return record
+
+
+def add_time(name, secs):
+    if _current is not None:
+        _current['spans'][name] += secs
+
+
+def count(name, value=1):
+    if _current is not None:
+        _current['counters'][name] += value
+
+
+@contextmanager
+def span(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_time(name, time.time()-start)
+
+
+def timed(name):
+    '''Decorator that records every call of the function as the span name
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return timed_func
+    return decorator
+
+
+def peak_rss_kb():
+    #ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Recorder(object):
+    def __init__(self):
+        self.images = defaultdict(list)
+
+    def add(self, record, img_type='inhabited'):
+        if record is not None:
+            self.images[img_type].append(record)
+
+    def get_totals(self, img_type):
+        '''Sum the spans and counters over the images of img_type, with per image averages and throughputs
+        '''
+        records = self.images[img_type]
+        spans = defaultdict(float)
+        counters = defaultdict(int)
+        for record in records:
+            for name, secs in record['spans'].iteritems():
+                spans[name] += secs
+            for name, value in record['counters'].iteritems():
+                counters[name] += value
+
+        totals = OrderedDict()
+        totals['images'] = len(records)
+        totals['total_secs'] = sum([record['total_secs'] for record in records])
+        totals['spans'] = dict(spans)
+        totals['counters'] = dict(counters)
+        totals['counters_per_image'] = dict((name, float(value)/len(records)) for name, value in counters.iteritems()) if len(records) > 0 else dict()
+        if spans['ensemble.predict'] > 0:
+            totals['patches_per_sec'] = counters['ensemble.patches']/spans['ensemble.predict']
+        totals['peak_rss_kb'] = max([record['peak_rss_kb'] for record in records]) if len(records) > 0 else 0
+        return totals
+
+    def write(self, path):
+        report = OrderedDict()
+        for img_type, records in self.images.iteritems():
+            report[img_type] = OrderedDict([('totals', self.get_totals(img_type)), ('images', records)])
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print 'Saved timings to {}'.format(path)
@@ -0,0 +1,140 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import utils
+
+'''
+ModelArtifact bundles everything the pipeline needs to score patches with a trained net:
+    - the weights of every layer
+    - the statistics of the DataScaler fitted on the training patches
+    - the layer configuration (number of conv layers, dropout)
+    - the patch and crop sizes the net was trained with
+It is saved as a single .npz next to the pickled weights, so the Ensemble can be set up
+without reloading (and rescaling) the training set.
+
+save_weights and load_weights write and read the weights alone in the same layout, for the best weights
+snapshot of a net in training (see my_net.BestWeights).
+'''
+
+ARTIFACT_VERSION = 1
+ARTIFACT_EXTENSION = '.npz'
+
+
+class ModelArtifact(object):
+    def __init__(self, weights=None, scaler_mean=None, scaler_scale=None, num_layers=None, dropout=0,
+                        roof_type=None, net_name=None, patch_size=utils.PATCH_H, crop_size=utils.CROP_SIZE):
+        '''
+        Parameters:
+        ------------
+        weights: OrderedDict
+            layer name -> list of parameter arrays, as returned by NeuralNet.get_all_params_values()
+        scaler_mean, scaler_scale: np.array
+            per feature mean and standard deviation of the DataScaler
+        '''
+        self.weights = weights
+        self.scaler_mean = scaler_mean
+        self.scaler_scale = scaler_scale
+        self.num_layers = num_layers
+        self.dropout = dropout
+        self.roof_type = roof_type
+        self.net_name = net_name
+        self.patch_size = patch_size
+        self.crop_size = crop_size
+
+
+    def save(self, path):
+        '''Write the artifact to path. The weights are flattened into keys of the form param_<layer>_<index>
+        '''
+        path = path if path.endswith(ARTIFACT_EXTENSION) else path+ARTIFACT_EXTENSION
+        arrays = flatten_weights(self.weights)
+        arrays['version'] = np.array(ARTIFACT_VERSION)
+        arrays['scaler_mean'] = self.scaler_mean
+        arrays['scaler_scale'] = self.scaler_scale
+        arrays['num_layers'] = np.array(self.num_layers)
+        arrays['dropout'] = np.array(self.dropout)
+        arrays['roof_type'] = np.array(str(self.roof_type))
+        arrays['net_name'] = np.array(str(self.net_name))
+        arrays['patch_size'] = np.array(self.patch_size)
+        arrays['crop_size'] = np.array(self.crop_size)
+        save_npz(arrays, path)
+        print 'Saved model artifact to {}'.format(path)
+        return path
+
+
+    @staticmethod
+    def load(path):
+        path = path if path.endswith(ARTIFACT_EXTENSION) else path+ARTIFACT_EXTENSION
+        with np.load(path) as data:
+            version = int(data['version'])
+            if version != ARTIFACT_VERSION:
+                raise ValueError('Model artifact {} has version {}, expected {}'.format(path, version, ARTIFACT_VERSION))
+
+            artifact = ModelArtifact(weights=unflatten_weights(data),
+                                scaler_mean=data['scaler_mean'], scaler_scale=data['scaler_scale'],
+                                num_layers=int(data['num_layers']), dropout=int(data['dropout']),
+                                roof_type=str(data['roof_type']), net_name=str(data['net_name']),
+                                patch_size=int(data['patch_size']), crop_size=int(data['crop_size']))
+
+        if artifact.crop_size != utils.CROP_SIZE or artifact.patch_size != utils.PATCH_H:
+            raise ValueError('Model artifact {} was trained with patch size {} and crop size {}, but utils uses {} and {}'.format(path,
+                                        artifact.patch_size, artifact.crop_size, utils.PATCH_H, utils.CROP_SIZE))
+        return artifact
+
+
+    @staticmethod
+    def load_if_exists(path):
+        path = path if path.endswith(ARTIFACT_EXTENSION) else path+ARTIFACT_EXTENSION
+        if os.path.isfile(path):
+            return ModelArtifact.load(path)
+        return None
+
+
+def get_artifact_path(weights_path, net_name):
+    '''The artifact lives next to the pickled weights, with the same name
+    '''
+    net_name = net_name[:-len('.pickle')] if net_name.endswith('.pickle') else net_name
+    return '{0}{1}{2}'.format(weights_path, net_name, ARTIFACT_EXTENSION)
+
+
+
+def flatten_weights(weights):
+    '''The arrays of an .npz holding weights: the layer names, the number of parameters of each layer
+    and every parameter under a key of the form param_<layer>_<index>
+    '''
+    arrays = dict()
+    arrays['layer_names'] = np.array(weights.keys())
+    arrays['param_counts'] = np.array([len(params) for params in weights.values()], dtype=np.int32)
+    for layer_name, params in weights.iteritems():
+        for i, param in enumerate(params):
+            arrays['param_{}_{}'.format(layer_name, i)] = param
+    return arrays
+
+
+def unflatten_weights(data):
+    '''The weights stored by flatten_weights in the loaded .npz data, as layer name -> list of parameter arrays
+    '''
+    weights = OrderedDict()
+    for layer_name, param_count in zip(data['layer_names'], data['param_counts']):
+        weights[str(layer_name)] = [data['param_{}_{}'.format(layer_name, i)] for i in range(param_count)]
+    return weights
+
+
+def save_npz(arrays, path):
+    #write to a temporary file first so a crash never leaves a truncated file behind
+    temp_path = path+'.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(temp_path, path)
+
+
+def save_weights(weights, path):
+    '''Write the parameter arrays of each layer (as returned by get_all_params_values) to an .npz
+    '''
+    save_npz(flatten_weights(weights), path)
+
+
+def load_weights(path):
+    with np.load(path) as data:
+        return unflatten_weights(data)
@@ -1,5 +1,7 @@
 import load
 import sys
+import time
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
 import cPickle as pickle
@@ -19,6 +21,7 @@ sys.path.append('~/roof/nolearn/nolearn')
 
 from nolearn.lasagne.base import NeuralNet, _sldict, BatchIterator
 import utils
+from model_artifact import save_weights
 
 class MyNeuralNet(NeuralNet):
 	'''
@@ -275,55 +278,181 @@ class MyNeuralNet(NeuralNet):
             return net_layers, params_dict 
 
 
-class EarlyStopping(object):
-    def __init__(self, patience=100, out_file=None):
-        self.patience = patience
+class FullyConvolutionalNet(object):
+    '''
+    Runs a trained MyNeuralNet over a whole image at once. The dense layers become convolutions,
+    so instead of one probability per patch the net outputs a map of probabilities with one entry
+    per window of its input size: entry (i, j) scores the window starting at pixel (i*stride, j*stride).
+    Overlapping windows share their convolutions instead of recomputing them.
+    '''
+    def __init__(self, net):
+        net.initialize()
+        input_layer = net.layers_.values()[0]
+        self.window_size = input_layer.shape[2:]
+        self.stride = 1
+
+        input_var = theano.tensor.tensor4('image')
+        layer = layers.InputLayer((None, input_layer.shape[1], None, None), input_var=input_var)
+        for net_layer in net.layers_.values()[1:]:
+            if isinstance(net_layer, layers.DropoutLayer):
+                continue
+            elif isinstance(net_layer, layers.Conv2DLayer):
+                layer = layers.Conv2DLayer(layer, num_filters=net_layer.num_filters, filter_size=net_layer.filter_size, 
+                                stride=net_layer.stride, pad=net_layer.pad, nonlinearity=net_layer.nonlinearity, 
+                                W=net_layer.W, b=net_layer.b)
+                self.stride *= net_layer.stride[0]
+            elif isinstance(net_layer, layers.MaxPool2DLayer):
+                layer = layers.MaxPool2DLayer(layer, pool_size=net_layer.pool_size, stride=net_layer.stride, ignore_border=True)
+                self.stride *= net_layer.stride[0]
+            elif isinstance(net_layer, layers.DenseLayer):
+                layer = self.dense_to_conv(layer, net_layer)
+            else:
+                raise ValueError('Cannot make layer {} fully convolutional'.format(net_layer.name))
+
+        #the softmax is taken over the classes, which are now the channels of the output map
+        output = layers.get_output(layer, deterministic=True)
+        output = theano.tensor.exp(output - output.max(axis=1, keepdims=True))
+        output = output / output.sum(axis=1, keepdims=True)
+        self.predict_map = theano.function([input_var], output)
+
+    @staticmethod
+    def dense_to_conv(layer, dense_layer):
+        #a dense layer on a (channels, h, w) input is a convolution with a single (h, w) filter per unit
+        input_shape = dense_layer.input_shape
+        channels, h, w = input_shape[1:] if len(input_shape) == 4 else (input_shape[1], 1, 1)
+        W = dense_layer.W.get_value().T.reshape(dense_layer.num_units, channels, h, w)
+        nonlinearity = dense_layer.nonlinearity
+        if nonlinearity is lasagne.nonlinearities.softmax:
+            nonlinearity = lasagne.nonlinearities.identity
+        conv = layers.Conv2DLayer(layer, num_filters=dense_layer.num_units, filter_size=(h, w), 
+                                nonlinearity=nonlinearity, W=W, b=dense_layer.b)
+        #Conv2DLayer flips its filters, the dense layer does not
+        if getattr(conv, 'flip_filters', True):
+            conv.W.set_value(np.ascontiguousarray(W[:, :, ::-1, ::-1]))
+        return conv
+
+    def predict_proba_map(self, image):
+        '''
+        image: scaled image of shape (channels, h, w)
+        Returns the class probabilities of the windows, of shape (classes, rows, cols)
+        '''
+        return self.predict_map(image[None, :, :, :].astype(theano.config.floatX))[0]
+
+
+WEIGHTS_EXTENSION = '_weights.npz'
+
+
+def get_weights_file(path):
+    '''The .npz holding the best weights of the net saved at path (with or without .pickle)
+    '''
+    path = path[:-len('.pickle')] if path.endswith('.pickle') else path
+    return path+WEIGHTS_EXTENSION
+
+
+class BestWeights(object):
+    '''Snapshot of the weights of the best epoch so far, shared by EarlyStopping and SaveBestWeights 
+    so the parameters are only copied once per improving epoch.
+    Once a path is set, the snapshot is written there in a background thread, at most every save_every seconds
+    '''
+    def __init__(self, save_every=60):
         self.best_valid = np.inf
         self.best_valid_epoch = 0
         self.best_valid_accuracy = 0
         self.best_weights = None
-        self.output_file = out_file
+        self.path = None
+        self.save_every = save_every
+        self.last_epoch = None
+        self.improved = False
+        self.saved_epoch = None
+        self.last_save = 0
+        self.writer = None
 
-    def __call__(self, nn, train_history):
-        current_valid = train_history[-1]['valid_loss']
+    def __getstate__(self):
+        #the writer thread can't be pickled
+        state = self.__dict__.copy()
+        state['writer'] = None
+        return state
+
+    def update(self, nn, train_history):
+        '''Take a snapshot if the last epoch is the best so far. Returns whether it was. 
+        Calling it again for the same epoch does nothing
+        '''
         current_epoch = train_history[-1]['epoch']
-        current_valid_accuracy = train_history[-1]['valid_accuracy']
-        if current_valid < self.best_valid:
+        if current_epoch == self.last_epoch:
+            return self.improved
+        self.last_epoch = current_epoch
+        current_valid = train_history[-1]['valid_loss']
+        self.improved = current_valid < self.best_valid
+        if self.improved:
             self.best_valid = current_valid
             self.best_valid_epoch = current_epoch
+            self.best_valid_accuracy = train_history[-1]['valid_accuracy']
             self.best_weights = nn.get_all_params_values()
-            self.best_valid_accuracy = current_valid_accuracy
+        return self.improved
+
+    def save(self):
+        '''Start writing the snapshot unless it is already on disk, a write is still going on, or the last one was too recent
+        '''
+        if self.path is None or self.best_weights is None or self.saved_epoch == self.best_valid_epoch:
+            return
+        if self.writer is not None and self.writer.is_alive():
+            return
+        if time.time() - self.last_save < self.save_every:
+            return
+        self.last_save = time.time()
+        self.saved_epoch = self.best_valid_epoch
+        #update() replaces best_weights instead of modifying it, so the thread can write it as it is
+        self.writer = threading.Thread(target=save_weights, args=(self.best_weights, self.path))
+        self.writer.start()
+
+    def flush(self):
+        '''Wait for the current write and make sure the best snapshot is on disk
+        '''
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.path is not None and self.best_weights is not None and self.saved_epoch != self.best_valid_epoch:
+            save_weights(self.best_weights, self.path)
+            self.saved_epoch = self.best_valid_epoch
+
+
+class EarlyStopping(object):
+    def __init__(self, patience=100, out_file=None, best_weights=None):
+        self.patience = patience
+        self.best_weights = best_weights if best_weights is not None else BestWeights()
+        self.output_file = out_file
 
-        elif self.best_valid_epoch + self.patience < current_epoch:
+    def __call__(self, nn, train_history):
+        current_epoch = train_history[-1]['epoch']
+        best = self.best_weights
+        if not best.update(nn, train_history) and best.best_valid_epoch + self.patience < current_epoch:
             print "Early stopping"
             print("Best valid loss was {:.6f} at epoch {} with accuracy {}.".format(
-                                self.best_valid, self.best_valid_epoch, self.best_valid_accuracy))
-            nn.load_params_from(self.best_weights)
+                                best.best_valid, best.best_valid_epoch, best.best_valid_accuracy))
+            nn.load_params_from(best.best_weights)
+            best.flush()
             if self.output_file is not None:
                 with open(self.output_file, 'a') as f:
-                    log = ['{}'.format(self.best_valid),
-                            '{}'.format(self.best_valid_epoch), 
-                            '{}\t'.format(self.best_valid_accuracy)]
+                    log = ['{}'.format(best.best_valid),
+                            '{}'.format(best.best_valid_epoch), 
+                            '{}\t'.format(best.best_valid_accuracy)]
                     f.write('\t'.join(log))
             raise StopIteration()
 
 
 
 class SaveBestWeights(object):
-    def __init__(self, method=None, full_dataset=None, patience=100):
-        self.best_valid = np.inf
+    '''Write the best weights so far to <weights path><net name>_weights.npz
+    '''
+    def __init__(self, method=None, full_dataset=None, patience=100, best_weights=None):
+        self.best_weights = best_weights if best_weights is not None else BestWeights()
         self.weight_path = utils.get_path(params=True, full_dataset=full_dataset, neural_weights=True, method=method)
 
     def __call__(self, nn, train_history):
-        current_valid = train_history[-1]['valid_loss']
-        current_epoch = train_history[-1]['epoch']
-        if current_valid < self.best_valid:
-            self.best_valid = current_valid
-            self.best_weights = nn.get_all_params_values()
-            
-            weight_name = '{0}{1}.pickle'.format(self.weight_path, nn.net_name, self.best_valid, current_epoch) 
-            with open(weight_name, 'wb') as f:
-                pickle.dump(nn, f, -1)                 
+        if self.best_weights.path is None:
+            self.best_weights.path = get_weights_file('{0}{1}'.format(self.weight_path, nn.net_name))
+        self.best_weights.update(nn, train_history)
+        self.best_weights.save()
 
 class AdjustVariable(object):
     def __init__(self, name, start=0.03, stop=0.001):
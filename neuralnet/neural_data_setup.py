@@ -16,6 +16,7 @@ import get_data
 from get_data import DataLoader
 from augmentation import DataAugmentation
 import utils
+from patch_store import PatchStore
 from FlipBatchIterator import FlipBatchIterator as flip
 
 '''
@@ -39,6 +40,8 @@ class NeuralDataLoad(object):
             #path = '../training_data_full_dataset_neural/'
         self.background_FP_viola_path = '{}{}/falsepos/'.format(path, data_path)
         self.thatch_metal_TP_viola_path = '{}{}/truepos/'.format(path, data_path)
+        #newer data folders keep their patches in a single patch store instead of jpg folders
+        self.patch_store_path = '{}{}/'.format(path, data_path)
         print self.background_FP_viola_path
         print self.thatch_metal_TP_viola_path
 
@@ -56,6 +59,9 @@ class NeuralDataLoad(object):
             when doing an ensemble, we specify which batch we want to start picking up data from
         '''
         assert roof_type=='metal' or roof_type=='thatch' or roof_type=='Both'
+        if PatchStore.exists(self.patch_store_path):
+            return self.load_data_from_store(non_roofs=non_roofs, roof_type=roof_type, starting_batch=starting_batch)
+
         #First get the positive patches
         self.ground_truth_metal_thatch = DataLoader.get_all_patches_folder(merge_imgs=True, full_dataset=self.full_dataset)
         self.viola_metal_thatch = self.get_viola_positive_patches(self.thatch_metal_TP_viola_path)
@@ -112,6 +118,43 @@ class NeuralDataLoad(object):
         return self.X, self.y
 
 
+    def load_data_from_store(self, non_roofs=None, roof_type=None, starting_batch=0):
+        '''Same as load_data, but the viola patches come from the PatchStore of the data folder
+        '''
+        store = PatchStore(self.patch_store_path)
+        self.ground_truth_metal_thatch = DataLoader.get_all_patches_folder(merge_imgs=True, full_dataset=self.full_dataset)
+        self.roof_types = [roof_type] if roof_type!='Both' else utils.ROOF_TYPES
+        positives = dict([(r, store.select([r], positive=True)) for r in self.roof_types])
+        background = store.select(self.roof_types, positive=False, starting_batch=starting_batch)
+
+        #limit the number of background patches, as in load_data
+        roof_num = sum([len(self.ground_truth_metal_thatch[r])+len(positives[r]) for r in self.roof_types])
+        self.non_roof_limit = (non_roofs*roof_num) + roof_num
+        background = background[:max(0, int(math.floor(self.non_roof_limit)) - roof_num + 1)]
+
+        self.X = np.empty((roof_num+len(background), 3, utils.PATCH_W, utils.PATCH_H), dtype='float32')
+        self.y = np.empty((roof_num+len(background)), dtype='int32')
+        self.failed_patches = 0
+        index = 0
+        for roof_type in self.roof_types:
+            label = utils.ROOF_LABEL[roof_type] if len(self.roof_types) > 1 else 1
+            for patch in self.ground_truth_metal_thatch[roof_type]:
+                index = self.process_patch(patch, label, index)
+            store.get_patches(positives[roof_type], out=self.X[index:index+len(positives[roof_type])])
+            self.y[index:index+len(positives[roof_type])] = label
+            index += len(positives[roof_type])
+
+        store.get_patches(background, out=self.X[index:index+len(background)])
+        self.y[index:index+len(background)] = utils.ROOF_LABEL['background']
+        index += len(background)
+
+        self.X = self.X[:index, :,:,:]
+        self.y = self.y[:index]
+        print np.bincount(self.y)
+        self.X, self.y = sklearn.utils.shuffle(self.X, self.y, random_state=42)  # shuffle train data    
+        return self.X, self.y
+
+
     def get_viola_positive_patches(self, path):
         #look at the viola folder, get all of the jpg.s depending on what roof_type the image name contains
         viola_metal_thatch = defaultdict(list)
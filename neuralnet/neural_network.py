@@ -30,11 +30,13 @@ import skimage
 
 #my modules
 import my_net
-from my_net import SaveBestWeights, AdjustVariable, EarlyStopping
+from my_net import SaveBestWeights, AdjustVariable, EarlyStopping, BestWeights
 import FlipBatchIterator as flip
 import utils
 from neural_data_setup import NeuralDataLoad
 from timer import Timer
+import model_artifact
+from model_artifact import ModelArtifact
 
 
 class Experiment(object):
@@ -45,7 +47,7 @@ class Experiment(object):
                     print_out=True, preloaded=False,method='viola',   
                     log=True, plot_loss=True, plot=True,epochs=3000,  
                     roof_type=None, non_roofs=2, data_folder=None, viola_data=None,
-                    net_name=None, num_layers=None, max_roofs=None):
+                    net_name=None, num_layers=None, max_roofs=None, prefetch=2):
         '''
         Parameters:
         ------------
@@ -57,26 +59,41 @@ class Experiment(object):
             Whether learning rate and momentum should adapt over time
         starting_batch: int
             At which point in the data we want to start processing. 
+        prefetch: int
+            How many training batches are built ahead in a background thread. 0 builds them in the training loop
         '''
         #preload weights if a path to weights was provided
         self.pipeline = pipeline
         self.method = method
 
         data_folder = data_folder if viola_data is None else viola_data 
-
-        #we always load the data, because pickling the scaler is not working
-        #Load data
-        print 'Loading data...\n'
         self.full_dataset=full_dataset
         self.roof_type = roof_type
-        self.X, self.y = NeuralDataLoad(data_path=data_folder, full_dataset=self.full_dataset, method=method).load_data(roof_type=self.roof_type, 
-                                                        non_roofs=non_roofs, starting_batch=starting_batch) 
-
-        print 'Data is loaded \n'
-        #set up the data scaler
-        self.scaler = DataScaler()
-        self.X = self.scaler.fit_transform(self.X)
-        print self.X.shape
+        self.weights_path = utils.get_path(neural_weights=True, params=True, method=self.method, full_dataset=full_dataset)
+
+        #in the pipeline, the model artifact holds the scaler statistics, so we don't need the training data
+        artifact = None
+        if self.pipeline and preloaded_path is not None:
+            artifact = ModelArtifact.load_if_exists(model_artifact.get_artifact_path(self.weights_path, preloaded_path))
+
+        if artifact is not None:
+            print 'Loading model artifact for {0}...\n'.format(preloaded_path)
+            self.scaler = DataScaler.from_statistics(artifact.scaler_mean, artifact.scaler_scale)
+            num_layers = artifact.num_layers
+            dropout = artifact.dropout
+            self.X = None
+            self.y = None
+        else:
+            #without an artifact we have to load the data to fit the scaler
+            print 'Loading data...\n'
+            self.X, self.y = NeuralDataLoad(data_path=data_folder, full_dataset=self.full_dataset, method=method).load_data(roof_type=self.roof_type, 
+                                                            non_roofs=non_roofs, starting_batch=starting_batch) 
+
+            print 'Data is loaded \n'
+            #set up the data scaler
+            self.scaler = DataScaler()
+            self.X = self.scaler.fit_transform(self.X)
+            print self.X.shape
      
         #if we are doing the pipeline, we already have a good name for the network, no need to add more info
         if self.pipeline:
@@ -106,8 +123,10 @@ class Experiment(object):
  
 
         self.num_layers = num_layers
+        self.dense_net = None
         print 'Final network name is: {0}'.format(self.net_name)
         self.flip = flip
+        self.prefetch = prefetch
         self.dropout = dropout
         self.non_roofs = non_roofs    #the proportion of non_roofs relative to roofs to be used in data
 
@@ -125,20 +144,29 @@ class Experiment(object):
 
         #preload weights if a path to weights was provided
         self.preloaded_path = preloaded_path 
-        if preloaded_path is not None:
+        self.loaded_from_artifact = artifact is not None
+        if artifact is not None:
+            self.net.load_params_from(artifact.weights)
+        elif preloaded_path is not None:
             preloaded_path = preloaded_path if preloaded_path.endswith('.pickle') else preloaded_path+'.pickle'
-            self.preloaded_path = utils.get_path(neural_weights=True, params=True, method=self.method, full_dataset=full_dataset)+preloaded_path
-            self.net.load_params_from(self.preloaded_path)      
+            self.preloaded_path = self.weights_path+preloaded_path
+            if os.path.isfile(self.preloaded_path):
+                self.net.load_params_from(self.preloaded_path)      
+            else:
+                #nets trained since the best weights are saved as an .npz instead of a pickled net
+                self.net.load_params_from(model_artifact.load_weights(my_net.get_weights_file(self.preloaded_path)))
 
 
     def setup_net(self, print_out=True):
+        #a single snapshot of the best weights, shared by the handlers
+        self.best_weights = BestWeights()
         if print_out:
             self.printer = PrintLogSave(out_file=self.out_file)
-            on_epoch_finished = [self.printer, SaveBestWeights(method=self.method, full_dataset=self.full_dataset), 
-                                            EarlyStopping(patience=200, out_file=self.out_file)]
+            on_epoch_finished = [self.printer, SaveBestWeights(method=self.method, full_dataset=self.full_dataset, best_weights=self.best_weights), 
+                                            EarlyStopping(patience=200, out_file=self.out_file, best_weights=self.best_weights)]
             on_training_started = [SaveLayerInfo(out_file=self.out_file)]
         else:
-            on_epoch_finished = [EarlyStopping(patience=200, out_file=self.out_file)]
+            on_epoch_finished = [EarlyStopping(patience=200, out_file=self.out_file, best_weights=self.best_weights)]
             on_training_started = []
 
         if self.flip:
@@ -146,6 +174,8 @@ class Experiment(object):
             batch_iterator_train=flip.FlipBatchIterator(batch_size=128)
         else:
             batch_iterator_train=flip.ResizeBatchIterator(batch_size=128) 
+        if self.prefetch > 0:
+            batch_iterator_train = flip.PrefetchBatchIterator(batch_iterator_train, prefetch=self.prefetch)
 
         if self.adaptive_learning:
             update_learning_rate = theano.shared(utils.float32(0.03))
@@ -207,9 +237,24 @@ class Experiment(object):
         #fitting the network to X_train
         with Timer() as t:
             self.net.fit(self.X, self.y)
+        #training can also end without early stopping, make sure the best weights are on disk
+        self.best_weights.flush()
 
         self.save_params_to_file(timer=t)
         #self.net.save_weights()
+        self.save_artifact()
+
+
+    def save_artifact(self, path=None):
+        '''Save weights, scaler statistics and layer configuration so the pipeline can load the net
+        without touching the training data
+        '''
+        path = path if path is not None else model_artifact.get_artifact_path(self.weights_path, self.net_name)
+        artifact = ModelArtifact(weights=self.net.get_all_params_values(), 
+                                scaler_mean=self.scaler.get_statistics()[0], scaler_scale=self.scaler.get_statistics()[1], 
+                                num_layers=self.num_layers, dropout=self.dropout, 
+                                roof_type=self.roof_type, net_name=self.net_name)
+        return artifact.save(path)
 
 
 
@@ -229,18 +274,35 @@ class Experiment(object):
         X_test_scaled = self.scaler.transform2(X_test)
 
         #resize the patches from patch size to crop size
-        X_test_cropped = np.empty((X_test_scaled.shape[0], X_test_scaled.shape[1], utils.CROP_SIZE, utils.CROP_SIZE))
-        for i, x in enumerate(X_test_scaled):
-            X_test_cropped[i, :, :, :] = utils.resize_neural_patch(x)
+        X_test_cropped = utils.resize_neural_patches(X_test_scaled)
         return self.net.predict(X_test_cropped)
 
     def predict_proba(self, X_test):
         X_test_scaled = self.scaler.transform2(X_test)
-        X_test_cropped = np.empty((X_test_scaled.shape[0], X_test_scaled.shape[1], utils.CROP_SIZE, utils.CROP_SIZE))
-        for i, x in enumerate(X_test_scaled):
-            X_test_cropped[i, :, :, :] = utils.resize_neural_patch(x)
+        X_test_cropped = utils.resize_neural_patches(X_test_scaled)
         return self.net.predict_proba(X_test_cropped)
 
+    def predict_proba_dense(self, image, window_size):
+        '''Score every window of window_size (h, w) in a cv2 image in one pass of the net.
+        Returns the class probabilities of shape (classes, rows, cols) and the (x, y) step in pixels 
+        of the image between neighbouring windows: window (i, j) starts at (j*step_x, i*step_y)
+        '''
+        if self.dense_net is None:
+            self.dense_net = my_net.FullyConvolutionalNet(self.net)
+            #the scaler works per pixel of a patch; over a whole image we can only scale per channel
+            mean, scale = self.scaler.get_statistics()
+            self.dense_mean = np.asarray(mean, dtype=np.float32).reshape(3, -1).mean(axis=1)
+            self.dense_scale = np.sqrt(np.mean(np.asarray(scale, dtype=np.float32).reshape(3, -1)**2, axis=1))
+
+        #resize the image so that a window becomes as large as the crops the net was trained on
+        fy = float(self.dense_net.window_size[0])/window_size[0]
+        fx = float(self.dense_net.window_size[1])/window_size[1]
+        x = np.asarray(image, dtype=np.float32)/255
+        x = utils.resize_rgb(x, w=int(round(image.shape[1]*fx)), h=int(round(image.shape[0]*fy)))
+        x = (x - self.dense_mean) / self.dense_scale
+        probs = self.dense_net.predict_proba_map(x.transpose(2,0,1))
+        return probs, (self.dense_net.stride/fx, self.dense_net.stride/fy)
+
 
 
     def test_preloaded(self, plot_loss=True, test_case=None):  
@@ -301,6 +363,22 @@ class Experiment(object):
 
 class DataScaler(StandardScaler):
     #Subclass of sklearn.StandardScaler that reshapes data as needed and then calls super to do scaling
+    @staticmethod
+    def from_statistics(mean, scale):
+        #rebuild a fitted scaler from the statistics stored in a model artifact
+        scaler = DataScaler()
+        scaler.mean_ = np.asarray(mean)
+        scaler.scale_ = np.asarray(scale)
+        try:
+            scaler.std_ = scaler.scale_ #older versions of sklearn use std_ instead of scale_
+        except AttributeError:
+            pass
+        return scaler
+
+    def get_statistics(self):
+        scale = self.scale_ if hasattr(self, 'scale_') else self.std_
+        return self.mean_, scale
+
     def fit_transform(self, X):
         X_shape = X.shape
         X = X.reshape(X_shape[0], X_shape[1]*X_shape[2]*X_shape[3])
@@ -337,7 +415,7 @@ class PrintLogSave(PrintLog):
     def __init__(self, out_file=None):
         self.out_file = out_file
         with open(self.out_file+'_history', 'w') as f:
-            f.write('epoch\ttrain_loss\tvalid_loss\ttrain_over_valid_loss_ratio\tvalid_accuracy\n')
+            f.write('epoch\ttrain_loss\tvalid_loss\ttrain_over_valid_loss_ratio\tvalid_accuracy\tdata_wait\n')
 
     def __call__(self, nn, train_history): 
         with open(self.out_file+'_history', 'a') as f:
@@ -345,7 +423,10 @@ class PrintLogSave(PrintLog):
 
     def table(self, nn, train_history):
         info = train_history[-1]
-        return str(info['epoch'])+'\t'+ str(info['train_loss'])+ '\t'+str(info['valid_loss'])+'\t'+str( info['train_loss'] / info['valid_loss'])+'\t'+str(info['valid_accuracy'])+'\n'
+        #seconds the training loop spent waiting for batches this epoch, only known when they are prefetched
+        wait_times = getattr(nn.batch_iterator_train, 'wait_times', None)
+        data_wait = wait_times[-1] if wait_times else ''
+        return str(info['epoch'])+'\t'+ str(info['train_loss'])+ '\t'+str(info['valid_loss'])+'\t'+str( info['train_loss'] / info['valid_loss'])+'\t'+str(info['valid_accuracy'])+'\t'+str(data_wait)+'\n'
         
     def log_to_file(self, nn, log, overwrite=False, binary=False, title=''):
         write_type = 'w' if overwrite else 'a'
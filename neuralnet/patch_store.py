@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import cv2
+
+import utils
+
+'''
+PatchStore holds the training patches of a data folder in two files instead of one jpg per patch:
+    - patches.uint8: the raw patches, as uint8 of shape (patches, channels, PATCH_H, PATCH_W)
+    - patches_index.npz: for every patch its roof type, whether it is a true positive,
+      the image it was taken from and the batch it belongs to, and the channels of the store
+The patch file is opened with np.memmap, so selecting a training set does not decode anything.
+All the patches of a store have the same number of channels: 3 for the neural patches, 1 for the grayscale viola patches.
+'''
+
+PATCHES_FILE = 'patches.uint8'
+INDEX_FILE = 'patches_index.npz'
+BATCH_SIZE = 20000
+
+
+class PatchStoreWriter(object):
+    def __init__(self, path):
+        '''Patches are appended to path+PATCHES_FILE as they come. The index is written on close
+        '''
+        self.path = path
+        self.patches_file = open(path+PATCHES_FILE+'.tmp', 'wb')
+        self.roof_types = list()
+        self.positive = list()
+        self.img_names = list()
+        self.batches = list()
+        self.channels = None
+
+    def add(self, patch, roof_type, positive, img_name):
+        '''Resize the cv2 patch to the size the nets are trained on and append it
+        '''
+        if patch.shape[0] != utils.PATCH_H or patch.shape[1] != utils.PATCH_W:
+            patch = cv2.resize(patch, (utils.PATCH_W, utils.PATCH_H), interpolation=cv2.INTER_AREA)
+        if patch.ndim == 2:
+            #grayscale patches get a channel axis
+            patch = patch[:, :, None]
+        if self.channels is None:
+            self.channels = patch.shape[2]
+        elif patch.shape[2] != self.channels:
+            raise ValueError('The patches of a store must have the same channels: got {}, expected {}'.format(patch.shape[2], self.channels))
+        self.patches_file.write(np.ascontiguousarray(patch.transpose(2,0,1), dtype=np.uint8).tostring())
+
+        self.batches.append(len(self.roof_types)/BATCH_SIZE)
+        self.roof_types.append(roof_type)
+        self.positive.append(positive)
+        self.img_names.append(img_name)
+
+    def close(self):
+        self.patches_file.close()
+        #write the index first: a store is only complete once its patch file has been renamed
+        with open(self.path+INDEX_FILE, 'wb') as f:
+            np.savez(f, roof_types=np.array(self.roof_types, dtype=str), positive=np.array(self.positive, dtype=bool),
+                            img_names=np.array(self.img_names, dtype=str), batches=np.array(self.batches, dtype=np.int32), 
+                            channels=np.int32(self.channels if self.channels is not None else 3))
+        os.rename(self.path+PATCHES_FILE+'.tmp', self.path+PATCHES_FILE)
+        print 'Saved {} patches to {}'.format(len(self.roof_types), self.path+PATCHES_FILE)
+
+
+class PatchStore(object):
+    def __init__(self, path):
+        with np.load(path+INDEX_FILE) as index:
+            self.roof_types = index['roof_types']
+            self.positive = index['positive']
+            self.img_names = index['img_names']
+            self.batches = index['batches']
+            #stores written before grayscale patches were supported only hold color patches
+            self.channels = int(index['channels']) if 'channels' in index.files else 3
+        shape = (len(self.roof_types), self.channels, utils.PATCH_H, utils.PATCH_W)
+        if len(self.roof_types) > 0:
+            self.patches = np.memmap(path+PATCHES_FILE, dtype=np.uint8, mode='r', shape=shape)
+        else:
+            self.patches = np.zeros(shape, dtype=np.uint8)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(path+PATCHES_FILE) and os.path.isfile(path+INDEX_FILE)
+
+    def select(self, roof_types, positive, starting_batch=0):
+        '''Indexes of the true positive (positive=True) or false positive patches of the given roof types.
+        The batches are visited from starting_batch onwards, wrapping around, so that the nets of an ensemble
+        can each start from a different part of the data
+        '''
+        selected = np.where(np.in1d(self.roof_types, roof_types) & (self.positive == positive))[0]
+        if starting_batch > 0 and len(selected) > 0:
+            batch_num = self.batches.max()+1
+            if starting_batch < batch_num:
+                order = np.argsort((self.batches[selected] - starting_batch) % batch_num, kind='mergesort')
+                selected = selected[order]
+        return selected
+
+    def get_patches(self, indexes, out=None):
+        '''Copy the patches at indexes into a float32 array scaled to [0, 1], like utils.cv2_to_neural.
+        Grayscale patches copied into a 3 channel out are repeated on every channel, like cv2.imread does for a grayscale jpg
+        '''
+        out = out if out is not None else np.empty((len(indexes), self.channels, utils.PATCH_H, utils.PATCH_W), dtype=np.float32)
+        #reading the indexes in order keeps the reads from the patch file sequential
+        order = np.argsort(indexes)
+        out[order] = self.patches[np.asarray(indexes)[order]]
+        out *= np.float32(1./255)
+        return out
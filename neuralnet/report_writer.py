@@ -0,0 +1,93 @@
+import os
+import csv
+import atexit
+from StringIO import StringIO
+
+import numpy as np
+
+'''
+ReportWriter buffers the rows of a tabular report and writes them in batches through a single open file.
+There is one writer per report file: ReportWriter.get_writer returns the writer already open for a path,
+so all the Evaluations of a run writing the same report share its handle and buffer.
+Formats:
+    - tsv, csv: text, appended to the file. The header is written when the file is new
+    - npz: binary, one array per column, written when the writer is closed. An existing file is replaced
+Open writers are closed when the interpreter exits.
+'''
+
+FLUSH_EVERY = 500
+EXTENSIONS = {'tsv': '.txt', 'csv': '.csv', 'npz': '.npz'}
+
+
+class ReportWriter(object):
+    _writers = dict()
+
+    def __init__(self, path, columns, fmt='tsv', flush_every=FLUSH_EVERY):
+        if fmt not in EXTENSIONS:
+            raise ValueError('Unknown report format {}, use one of {}'.format(fmt, EXTENSIONS.keys()))
+        self.path = path
+        self.columns = list(columns)
+        self.fmt = fmt
+        self.flush_every = flush_every
+        self.rows = list()
+        self.handle = None
+        if fmt != 'npz':
+            self.delimiter = '\t' if fmt == 'tsv' else ','
+            new_file = not os.path.isfile(path)
+            self.handle = open(path, 'a')
+            if new_file:
+                self.rows.append(self.columns)
+
+    @staticmethod
+    def get_writer(path, columns, fmt='tsv'):
+        writer = ReportWriter._writers.get(path)
+        if writer is None:
+            writer = ReportWriter(path, columns, fmt=fmt)
+            ReportWriter._writers[path] = writer
+        return writer
+
+    @staticmethod
+    def get_path(out_path, report_name, fmt='tsv'):
+        return out_path+report_name+EXTENSIONS[fmt]
+
+    def write(self, row):
+        self.rows.append(row)
+        if self.handle is not None and len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered rows in one go. The npz format keeps its rows until close
+        '''
+        if self.handle is None or len(self.rows) == 0:
+            return
+        text = StringIO()
+        csv.writer(text, delimiter=self.delimiter, lineterminator='\n').writerows(self.rows)
+        self.handle.write(text.getvalue())
+        self.handle.flush()
+        self.rows = list()
+
+    def close(self):
+        if self.handle is not None:
+            self.flush()
+            self.handle.close()
+            self.handle = None
+        elif self.fmt == 'npz':
+            columns = zip(*self.rows) if len(self.rows) > 0 else [[] for _ in self.columns]
+            with open(self.path, 'wb') as f:
+                np.savez(f, **dict((name, np.array(values)) for name, values in zip(self.columns, columns)))
+            self.rows = list()
+        if ReportWriter._writers.get(self.path) is self:
+            del ReportWriter._writers[self.path]
+
+    @staticmethod
+    def flush_all():
+        for writer in ReportWriter._writers.values():
+            writer.flush()
+
+    @staticmethod
+    def close_all():
+        for writer in ReportWriter._writers.values():
+            writer.close()
+
+
+atexit.register(ReportWriter.close_all)
@@ -9,8 +9,14 @@ import pickle
 from sklearn.metrics import precision_recall_curve, average_precision_score
 from matplotlib import pyplot as plt
 
-from get_data import DataLoader #for get_roofs
+from get_data import DataLoader, AnnotationIndex #for get_roofs
 import utils
+from patch_store import PatchStoreWriter
+from report_writer import ReportWriter
+import instrumentation
+from image_provider import ImageProvider
+
+PER_IMAGE_COLUMNS = ['img_name', 'threshold', 'roof_type', 'true_pos', 'false_neg', 'false_pos', 'easy_true_pos', 'easy_false_pos', 'easy_false_neg']
 
 
 class Detections(object):
@@ -157,7 +163,8 @@ class Evaluation(object):
                         detector_names=None, 
                         mergeFalsePos=False,
                         separateDetections=True,
-                        vocGood=0.1, negThres = 0.3, auc_threshold=0.5, correct_roofs=None, img_names=None):
+                        vocGood=0.1, negThres = 0.3, auc_threshold=0.5, correct_roofs=None, img_names=None, 
+                        polygon_scoring=False, report_format='tsv'):
         '''
         Will score the detections class it contains.
 
@@ -172,8 +179,14 @@ class Evaluation(object):
             train a single neural network to distinguish between both types of roofs 
             since the bad detections of either roof must not contain a positive detection
             of the other type of roof (it should be background)
+        polygon_scoring: bool
+            Whether rotated detections are scored exactly as polygons against the roof polygons,
+            instead of as their bounding boxes against the bounding boxes of the roofs
+        report_format: string
+            Format of the per image report: 'tsv', 'csv' or 'npz' (see report_writer)
         '''
         self.TOTAL = 0
+        self.patch_store_writer = None
         self.save_imgs = save_imgs
         #these two are related to saving the FP and TP for neural training
         self.mergeFalsePos=mergeFalsePos
@@ -198,36 +211,25 @@ class Evaluation(object):
 
         #the ground truth roofs for every image and roof type
         if correct_roofs is None:
-            self.correct_roofs = dict()
-            for roof_type in utils.ROOF_TYPES:
-                self.correct_roofs[roof_type] = dict()
             self.full_dataset = full_dataset
-            if full_dataset == False:
-                for img_name in self.img_names:
-                    for roof_type in utils.ROOF_TYPES:
-                        #we receive polygons, so we convert them into boxes so we can use the fast scoring
-                        temp_roofs =  DataLoader.get_polygons(roof_type=roof_type, 
-                                                                    xml_name=img_name[:-3]+'xml' , xml_path=self.in_path)
-                        if len(temp_roofs)>0:
-                            self.correct_roofs[roof_type][img_name] = utils.polygons2boxes(temp_roofs)
-                        else:
-                            self.correct_roofs[roof_type][img_name] = []
-                        self.detections.update_roof_num(self.correct_roofs[roof_type][img_name], roof_type)
-            else:
+            #the annotations of a folder are parsed once and shared by all evaluations
+            self.correct_roofs = AnnotationIndex.get_index(self.in_path, full_dataset=full_dataset).get_boxes(self.img_names)
+            for roof_type in utils.ROOF_TYPES:
                 for img_name in self.img_names:
-                    current_roofs = DataLoader.get_all_roofs_full_dataset(xml_name=img_name[:-3]+'xml' , xml_path=self.in_path)
-                    for roof_type in utils.ROOF_TYPES:
-                        if roof_type not in current_roofs:
-                            self.correct_roofs[roof_type][img_name] = []
-                        else:
-                            self.correct_roofs[roof_type][img_name] = current_roofs[roof_type] 
-
-                        self.detections.update_roof_num(self.correct_roofs[roof_type][img_name], roof_type)
+                    self.detections.update_roof_num(self.correct_roofs[roof_type][img_name], roof_type)
         else:
             self.correct_roofs = correct_roofs
 
+        #the roofs as polygons, to score rotated detections exactly. If we are only given boxes, the boxes are the polygons
+        self.polygon_scoring = polygon_scoring
+        if polygon_scoring and correct_roofs is None:
+            self.roof_polygons = AnnotationIndex.get_index(self.in_path, full_dataset=full_dataset).get_polygons(self.img_names)
+        elif polygon_scoring:
+            self.roof_polygons = self.correct_roofs
+
         #init the report file
         self.out_path = out_path
+        self.report_format = report_format
         if report_name is not None:
             if detector_names is not None:
                 self.init_report(detector_names, report_name=report_name)
@@ -256,9 +258,11 @@ class Evaluation(object):
             report.close()
 
     
+    @instrumentation.timed('evaluation.score')
     def score_img(self, img_name, img_shape, contours=False, fast_scoring=False, write_file=True):
         '''Find best overlap between each roof in an img and the detections,
-        according the VOC score
+        according the VOC score. All roofs are scored against all detections at once 
+        using the matrices from get_score_matrix
         '''
         print 'Scoring {}.....'.format(img_name)
         #start with all detections as false pos; as we find matches, we increase the true_pos, decrese the false_pos numbers
@@ -271,12 +275,6 @@ class Evaluation(object):
         easy_false_negative_logical=dict()
 
         for roof_type in utils.ROOF_TYPES:
-            #this will only be necessary if we work with the neural network
-            #and we want to score roofs by merging nearby detections
-            work_with_contours = False
-            if roof_type=='metal' and contours:
-                work_with_contours = True
-
             #we may want to keep all detections together, but this lowers precision a lot
             #by default, metal and thatch detections are evaluated separately
             if self.keep_detections_separate:
@@ -285,62 +283,115 @@ class Evaluation(object):
                 detections[roof_type] = self.detections.get_detections(img_name=img_name)
 
             print 'Scoring {0}'.format(roof_type)
-            #detections that are wrong accoring to VOC metric
-            false_pos_logical[roof_type] = np.ones(len(detections[roof_type]), dtype=bool) #[roof_type]
-            #this is used to get the training data for TP and FP
-            bad_detection_logical[roof_type] = np.ones(len(detections[roof_type]), dtype=bool) #[roof_type]
+            roofs = self.correct_roofs[roof_type][img_name]
+            #rows are roofs, columns are detections
+            #evaluations pickled before polygon scoring existed score boxes
+            if getattr(self, 'polygon_scoring', False):
+                voc_scores, detection_roof_portions = Evaluation.get_score_matrix(self.roof_polygons[roof_type][img_name], 
+                                                                                detections[roof_type], polygons=True)
+            else:
+                voc_scores, detection_roof_portions = Evaluation.get_score_matrix(roofs, detections[roof_type])
+            matches = voc_scores > self.VOC_threshold
 
-            #how many detections are wrong
-            easy_false_pos_logical[roof_type] = np.ones(len(detections[roof_type]), dtype=bool)
-            #how many roofs we have missed
-            easy_false_negative_logical[roof_type] = np.ones(len(self.correct_roofs[roof_type][img_name]), 
-                                                            dtype=bool)
-
-            for r, roof in enumerate(self.correct_roofs[roof_type][img_name]):
-
-                best_voc_score = -1 
-                best_detection = -1 
-
-                for d, detection in enumerate(detections[roof_type]):                             #for each patch found
-                    if d%1000 ==0:
-                        #print 'Roof {}/{} Detection {}/{}'.format(r, len(self.correct_roofs[roof_type][img_name]), d, len(detections[roof_type]))
-                        pass
-                    if r == 0:#first roof, so insert the current detection and a negative score
-                        best_score_per_detection[roof_type].append([detection, -1])
-
-                    #detection_roof_portion is how much of the detection is covered by roof
-                    if True: #fast_scoring:
-                        voc_score, detection_roof_portion = self.get_score_fast(roof=roof, detection=detection)
-                    else:
-                        voc_score, detection_roof_portion = self.get_score(contours=work_with_contours, 
-                                                        rows=img_shape[0], cols=img_shape[1], roof=roof, detection=detection)
-                    if (voc_score > self.VOC_threshold) and (voc_score > best_voc_score):#this may be a true pos
-                        best_voc_score = voc_score
-                        best_detection = d 
-                    
-                    if (voc_score > self.VOC_threshold) or (detection_roof_portion > 0.5):
-                        easy_false_pos_logical[roof_type][d] = 0
-                        easy_false_negative_logical[roof_type][r] = 0 
+            #detections that are wrong accoring to VOC metric: only the best match of each roof is a true positive
+            false_pos_logical[roof_type] = np.ones(len(detections[roof_type]), dtype=bool) 
+            if voc_scores.size > 0:
+                best_detections = np.argmax(voc_scores, axis=1)
+                matched_roofs = np.any(matches, axis=1)
+                false_pos_logical[roof_type][best_detections[matched_roofs]] = False
+
+                #store the best detection for each roof regardless of whether it is over 0.5
+                for r, d in enumerate(best_detections):
+                    self.detections.set_best_voc(img_name=img_name, roof_type=roof_type, 
+                                        roof_polygon=roofs[r], best_detection=detections[roof_type][d], score=voc_scores[r, d])  
 
-                    if (voc_score > self.VOC_good_detection_threshold[roof_type]): # or detection_roof_portion>self.detection_portion_threshold):
-                        bad_detection_logical[roof_type][d] = 0 #we already know that this wasn't a bad detection
+            #this is used to get the training data for TP and FP
+            bad_detection_logical[roof_type] = np.invert(np.any(voc_scores > self.VOC_good_detection_threshold[roof_type], axis=0))
 
-                    if (voc_score > best_score_per_detection[roof_type][d][1]): #keep track of best match with some roof for each detection
-                        best_score_per_detection[roof_type][d][1] = voc_score
-                        
-                    #store the best detection for this roof regardless of whether it is over 0.5
-                    if voc_score > best_voc_score:
-                        self.detections.set_best_voc(img_name=img_name, roof_type=roof_type, 
-                                            roof_polygon=roof, best_detection=detections[roof_type][d], score=best_voc_score)  
+            #how many detections are wrong and how many roofs we have missed
+            easy_matches = np.logical_or(matches, detection_roof_portions > 0.5)
+            easy_false_pos_logical[roof_type] = np.invert(np.any(easy_matches, axis=0))
+            easy_false_negative_logical[roof_type] = np.invert(np.any(easy_matches, axis=1))
 
-                if best_detection != -1:
-                    false_pos_logical[roof_type][best_detection] = 0 #this detection is not a false positive
+            #keep track of best match with some roof for each detection
+            if voc_scores.size > 0:
+                best_scores = np.maximum(np.max(voc_scores, axis=0), -1).tolist()
+                best_score_per_detection[roof_type] = [[detection, score] for detection, score 
+                                                                in zip(detections[roof_type], best_scores)]
 
         self.update_scores(img_name, detections, false_pos_logical, bad_detection_logical, 
                                     best_score_per_detection, easy_false_pos_logical, easy_false_negative_logical, write_file=write_file)
         #self.save_images(img_name)
 
-       
+
+    @staticmethod
+    def get_score_matrix(roofs, detections, polygons=False):
+        '''Vectorized version of get_score_fast: score every roof against every detection.
+        Roofs can be boxes (xmin, ymin, xmax, ymax) or polygons, detections must be boxes.
+        If polygons is True, roofs and detections are scored as the (convex) polygons they are, 
+        like get_score does, instead of as their bounding boxes.
+        Returns the VOC scores and the portion of each detection covered by roof, both of shape (roofs, detections)
+        '''
+        if polygons:
+            return Evaluation.get_polygon_score_matrix(roofs, detections)
+        roofs = Evaluation._as_boxes(roofs)
+        detections = Evaluation._as_boxes(detections)
+
+        roof_xmin, roof_ymin, roof_xmax, roof_ymax = [roofs[:, i, None] for i in range(4)]
+        detection_xmin, detection_ymin, detection_xmax, detection_ymax = [detections[None, :, i] for i in range(4)]
+
+        dx = np.minimum(roof_xmax, detection_xmax) - np.maximum(roof_xmin, detection_xmin)
+        dy = np.minimum(roof_ymax, detection_ymax) - np.maximum(roof_ymin, detection_ymin)
+        intersection_area = np.where((dx>=0) & (dy>=0), dx*dy, 0)
+
+        #VOC measure
+        roof_area = (roof_xmax - roof_xmin) * (roof_ymax - roof_ymin)
+        detection_area = (detection_xmax - detection_xmin) * (detection_ymax - detection_ymin)
+        union_area = (roof_area + detection_area) - intersection_area
+        with np.errstate(divide='ignore', invalid='ignore'):
+            voc_scores = intersection_area / union_area
+            #How much of the detection is roof? If it's high, they this detection is mostly covering a roof
+            detection_roof_portions = intersection_area / detection_area
+        return voc_scores, detection_roof_portions
+
+
+    @staticmethod
+    def get_polygon_score_matrix(roofs, detections):
+        roofs = Evaluation._as_polygons(roofs)
+        detections = Evaluation._as_polygons(detections)
+
+        #intersect every roof with every detection
+        roof_index, detection_index = np.meshgrid(np.arange(len(roofs)), np.arange(len(detections)), indexing='ij')
+        intersection_area = utils.convex_intersection_areas(roofs[roof_index.reshape(-1)], detections[detection_index.reshape(-1)])
+        intersection_area = intersection_area.reshape(len(roofs), len(detections))
+
+        #VOC measure
+        roof_area = utils.polygon_areas(roofs)[:, None]
+        detection_area = utils.polygon_areas(detections)[None, :]
+        union_area = (roof_area + detection_area) - intersection_area
+        with np.errstate(divide='ignore', invalid='ignore'):
+            voc_scores = intersection_area / union_area
+            detection_roof_portions = intersection_area / detection_area
+        return voc_scores, detection_roof_portions
+
+
+    @staticmethod
+    def _as_polygons(rects):
+        #boxes are converted to the polygon of their corners
+        polygons = np.array(rects, dtype=float)
+        if polygons.ndim == 2 or polygons.size == 0:
+            return utils.boxes2polygons(polygons.reshape(-1, 4))
+        return polygons.reshape(len(polygons), -1, 2)
+
+
+    @staticmethod
+    def _as_boxes(rects):
+        #polygons are converted to their bounding boxes, like get_score_fast does for roofs
+        boxes = np.array(rects, dtype=float)
+        if boxes.ndim == 3:
+            boxes = utils.polygons2boxes(boxes).astype(float)
+        return boxes.reshape(-1, 4)
+
 
     def update_scores(self, img_name, detections, false_pos_logical, bad_detection_logical, 
                                                 best_score_per_detection, easy_false_pos_logical, easy_false_negative_logical, write_file=None):
@@ -401,15 +452,8 @@ class Evaluation(object):
             true_roofs = len(self.correct_roofs[roof_type][img_name])
 
             if write_file:
-                per_roof_report = self.out_path+'per_image_detections.txt'
-                mode = 'a' if os.path.isfile(per_roof_report) else 'w'
-                with open(per_roof_report, mode) as f:
-                    if mode == 'w':
-                        header = ['img_name', 'threshold', 'roof_type', 'true_pos', 'false_neg', 'false_pos', 'easy_true_pos', 'easy_false_pos', 'easy_false_neg', '\n']
-                        f.write('\t'.join(header))
-                    scores = '{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(img_name, self.auc_threshold, roof_type, len(pos_d), len(false_d), true_roofs-len(pos_d), 
-                                                len(easy_true_pos), len(easy_false_pos), len(easy_false_neg))
-                    f.write(scores)
+                self.get_per_image_writer().write([img_name, self.auc_threshold, roof_type, len(pos_d), len(false_d), true_roofs-len(pos_d), 
+                                                len(easy_true_pos), len(easy_false_pos), len(easy_false_neg)])
 
         score_list.append('---')
         score_list.append('All Detections: {0}'.format(len(detections['metal']+detections['thatch'])))
@@ -418,6 +462,13 @@ class Evaluation(object):
         print '\n'.join(score_list)
 
 
+    def get_per_image_writer(self):
+        #evaluations pickled before the report format existed write tsv
+        report_format = getattr(self, 'report_format', 'tsv')
+        path = ReportWriter.get_path(self.out_path, 'per_image_detections', fmt=report_format)
+        return ReportWriter.get_writer(path, PER_IMAGE_COLUMNS, fmt=report_format)
+
+
     def get_score(self, contours=False, rows=1200, cols=2000, roof=None, detection=None):
         #assert len(roof) == 4 and len(detection) == 4
 
@@ -494,8 +545,6 @@ class Evaluation(object):
         log_to_file = list() 
         easy_log = list()
         if print_header: 
-            open(self.out_path+report_name, 'w').close() 
-            open(self.out_path+report_name[:-len('.txt')]+'_easy.txt', 'w').close() 
             if stage is None:
                 log_to_file.append('roof_type\ttotal_roofs\ttotal_time\tdetections\trecall\tprecision\tf1')
                 easy_log.append('roof_type\ttotal_roofs\ttotal_time\tdetections\trecall\tprecision\tf1')
@@ -548,10 +597,14 @@ class Evaluation(object):
 
         log = '\n'.join(log_to_file)
         easy_log = '\n'.join(easy_log)
-        with open(self.out_path+report_name, 'a') as report:
+        #a header starts the summaries from scratch
+        mode = 'w' if print_header else 'a'
+        with open(self.out_path+report_name, mode) as report:
             report.write(log)
-        with open(self.out_path+report_name[:-len('.txt')]+'_easy.txt', 'a') as report:
+        with open(self.out_path+report_name[:-len('.txt')]+'_easy.txt', mode) as report:
             report.write(easy_log)
+        #the per image report is complete once the summary is written
+        ReportWriter.flush_all()
 
         print 'FINAL REPORT'
         print log
@@ -564,7 +617,7 @@ class Evaluation(object):
         '''Displays the ground truth, along with the true and false positives for a given image
         '''
         try:
-            img = cv2.imread(self.in_path+img_name, flags=cv2.IMREAD_COLOR)
+            img = ImageProvider.get_provider().get_copy(self.in_path+img_name)
         except IOError:
             print 'Cannot open {0}'.format(self.in_path+img_name)
             sys.exit(-1)
@@ -624,8 +677,9 @@ class Evaluation(object):
         return bounding_rects
 
 
-    def save_training_TP_FP_using_voc(self, rects=False, neural=True, viola=False, img_names=None):
+    def save_training_TP_FP_using_voc(self, rects=False, neural=True, viola=False, img_names=None, patch_store=True):
         '''use the voc scores to decide if a patch should be saved as a TP or FP or not
+        If patch_store is True, the patches are written to a PatchStore in the data folder instead of jpgs
         '''
         general_path = utils.get_path(neural=neural, viola=viola, data_fold=utils.TRAINING, in_or_out=utils.IN, out_folder_name=self.folder_name)
         general_path = '../slide_training_data_neural/{}'.format(self.folder_name)
@@ -637,6 +691,7 @@ class Evaluation(object):
         path_false = general_path+'falsepos/'
         utils.mkdir(path_false)
         img_names = img_names if img_names is not None else self.img_names
+        self.patch_store_writer = PatchStoreWriter(general_path) if patch_store else None
 
         num_patches = 0 #we can only save around 30000 images per folder!!!
         for i, img_name in enumerate(img_names):
@@ -646,11 +701,9 @@ class Evaluation(object):
             bad_detections = defaultdict(list)
             try:
                 if viola: #viola training will need grayscale patches
-                    img = cv2.imread(self.in_path+img_name, flags=cv2.IMREAD_COLOR)
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                    img = cv2.equalizeHist(img)
+                    img = ImageProvider.get_provider().get_equalized(self.in_path+img_name)
                 else: #neural network will need RGB
-                    img = cv2.imread(self.in_path+img_name, flags=cv2.IMREAD_COLOR)
+                    img = ImageProvider.get_provider().get_color(self.in_path+img_name)
             except:
                 print 'Cannot open image'
                 sys.exit(-1)
@@ -672,6 +725,9 @@ class Evaluation(object):
                 extraction_type = 'background'
                 num_patches = self.save_training_FP_and_TP_helper(num_patches, img_name, bad_detections[roof_type], path_false, 
                                                     general_path, img, roof_type, extraction_type, (0,0,255), rects=rects)               
+        if self.patch_store_writer is not None:
+            self.patch_store_writer.close()
+            self.patch_store_writer = None
 
 
     def save_training_FP_and_TP_helper(self, num_patches, img_name, detections, patches_path, 
@@ -687,7 +743,7 @@ class Evaluation(object):
 
         for i, detection in enumerate(detections):
             batch_path =  'batch{}/'.format(int(num_patches/20000))  
-            if num_patches % 20000 == 0:
+            if num_patches % 20000 == 0 and self.patch_store_writer is None:
                 utils.mkdir('{}falsepos/batch{}/'.format(general_path, num_patches/20000))
                 utils.mkdir('{}truepos/batch{}/'.format(general_path, num_patches/20000))
             num_patches += 1
@@ -699,7 +755,10 @@ class Evaluation(object):
                 bitmap = np.zeros((img.shape[:2]), dtype=np.uint8)
                 padded_detection = utils.add_padding_polygon(detection, bitmap)
                 warped_patch = utils.four_point_transform(img, padded_detection)
-                cv2.imwrite('{0}{1}_{2}_roof{3}.jpg'.format(current_patch_path, roof_type, img_name[:-4], i), warped_patch)
+                if self.patch_store_writer is not None:
+                    self.patch_store_writer.add(warped_patch, roof_type, extraction_type=='good', img_name)
+                else:
+                    cv2.imwrite('{0}{1}_{2}_roof{3}.jpg'.format(current_patch_path, roof_type, img_name[:-4], i), warped_patch)
                 
                 #mark where roofs where taken out from for debugging
                 utils.draw_polygon(padded_detection, img_debug, fill=False, color=color, thickness=2, number=i)
@@ -709,9 +768,12 @@ class Evaluation(object):
                 ymin = (detection.ymin-pad) if (detection.ymin-pad)>0 else detection.ymin
                 xmax = (detection.xmax+pad) if (detection.xmax+pad)<img.shape[1] else detection.xmax
                 ymax = (detection.ymax+pad) if (detection.ymax+pad)<img.shape[0] else detection.ymax
-                patch = img[ymin:ymax, xmin:xmax, :]
+                patch = img[ymin:ymax, xmin:xmax]
                 #print 'saving {0}{1}_{2}_roof{3}.jpg'.format(current_patch_path, roof_type, img_name[:-4], i) 
-                cv2.imwrite('{0}{1}_{2}_roof{3}.jpg'.format(current_patch_path, roof_type, img_name[:-4], i), patch)
+                if self.patch_store_writer is not None:
+                    self.patch_store_writer.add(patch, roof_type, extraction_type=='good', img_name)
+                else:
+                    cv2.imwrite('{0}{1}_{2}_roof{3}.jpg'.format(current_patch_path, roof_type, img_name[:-4], i), patch)
                 self.TOTAL += 1
                 if self.TOTAL % 1000 == 0:
                     print 'Saved {} patches'.format(self.TOTAL)
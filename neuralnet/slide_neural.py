@@ -1,9 +1,12 @@
 import utils
 import math
+import sys
+import numpy as np
 import os
 import cv2
 import pdb
 from timer import Timer
+from image_provider import ImageProvider
 from reporting import Evaluation, Detections
 from collections import defaultdict
 from get_data import Rectangle
@@ -12,8 +15,14 @@ DEBUG = False
 
 
 class SlidingWindowNeural(object):
-    def __init__(self,  data_fold=None, full_dataset=False, out_path=None, in_path=None, output_patches=False, scale=1.5, minSize=(200,200), windowSize=(40,40), stepSize=15):
+    def __init__(self,  data_fold=None, full_dataset=False, out_path=None, in_path=None, output_patches=False, scale=1.5, minSize=(200,200), windowSize=(40,40), stepSize=15, dense=False):
+        '''
+        dense: boolean
+            if True, get_dense_windows scores the windows with the nets while sliding: the nets run once over
+            each pyramid level and the windows are placed at the stride of the nets instead of stepSize
+        '''
         self.scale = scale
+        self.dense = dense
         self.minSize = minSize
         self.windowSize = windowSize
         self.output_patches = output_patches 
@@ -62,7 +71,7 @@ class SlidingWindowNeural(object):
     def get_windows(self, img_name, in_path=None):
         in_path = in_path if in_path is not None else self.in_path
         try:
-            image = cv2.imread(in_path+img_name)
+            image = ImageProvider.get_provider().get_color(in_path+img_name)
         except IOError:
             print 'Could not open file'
             sys.exit(-1)
@@ -73,40 +82,67 @@ class SlidingWindowNeural(object):
             return self.detect(img_name, image, stepSize=stepSize, windowSize=(40,40), scale=1.5, minSize=(200,200))             
 
 
-    def detect(self, img_name, image, stepSize=None, windowSize=None, scale=None, minSize=None):
+    def get_dense_windows(self, img_name, ensemble, in_path=None):
+        in_path = in_path if in_path is not None else self.in_path
+        try:
+            image = ImageProvider.get_provider().get_color(in_path+img_name)
+        except IOError:
+            print 'Could not open file'
+            sys.exit(-1)
+        if self.is_small_image(image):
+            return self.detect_dense(image, ensemble)
+        else:
+            return self.detect_dense(image, ensemble, windowSize=(40,40), scale=1.5, minSize=(200,200))             
+
+
+    def detect_dense(self, image, ensemble, windowSize=None, scale=None, minSize=None):
+        '''Score the windows of every pyramid level with one pass of the nets over the level.
+        Returns the rects of the windows as (N, 4) arrays of xmin, ymin, xmax, ymax 
+        and the probability of each window, per roof type
+        '''
         windowSize = windowSize if windowSize is not None else self.windowSize
-        stepSize = stepSize if stepSize is not None else self.stepSize
         scale = scale if scale is not None else self.scale
         minSize = minSize if minSize is not None else self.minSize
 
-        window_num = 0
-        polygons_metal = list()
-        polygons_thatch = list()
-        rects_metal = list()
-        rects_thatch = list()
+        rects = defaultdict(list)
+        probs = defaultdict(list)
+        for level, resized in enumerate(utils.pyramid(image, scale=scale, minSize=minSize)):
+            if resized.shape[0] < windowSize[0] or resized.shape[1] < windowSize[1]:
+                continue
+            scale_factor = math.pow(scale, level)
+            w = int(scale_factor*windowSize[1]) 
+            h = int(scale_factor*windowSize[0]) 
+            for roof_type in utils.ROOF_TYPES:
+                level_probs, (step_x, step_y) = ensemble.predict_proba_dense(resized, roof_type, windowSize)
+
+                #translate the windows of the probability map back to the original image, like get_translated_coords
+                rows, cols = np.mgrid[:level_probs.shape[0], :level_probs.shape[1]]
+                xmin = (cols.reshape(-1)*step_x*scale_factor).astype(int)
+                ymin = (rows.reshape(-1)*step_y*scale_factor).astype(int)
+                rects[roof_type].append(np.column_stack((xmin, ymin, xmin+w, ymin+h)))
+                probs[roof_type].append(level_probs.reshape(-1))
+
+        for roof_type in utils.ROOF_TYPES:
+            rects[roof_type] = np.concatenate(rects[roof_type]) if len(rects[roof_type]) > 0 else np.zeros((0,4), dtype=int)
+            probs[roof_type] = np.concatenate(probs[roof_type]) if len(probs[roof_type]) > 0 else np.zeros((0))
+        self.total_window_num += sum([len(r) for r in rects.values()])/len(utils.ROOF_TYPES)
+        return dict(rects), dict(probs)
 
-        #loop through pyramid
 
-        for level, resized in enumerate(utils.pyramid(image, scale=scale, minSize=minSize)):
-            for (x, y, window) in utils.sliding_window(resized, stepSize=stepSize, windowSize=windowSize):
-                
-                #self.debug_scaling(image, img_name, resized, x, y, level):
-
-                # if the window does not meet our desired window size, ignore it
-                if window.shape[0] != windowSize[0] or window.shape[1] != windowSize[1]:
-                    continue
-                window_num += 1
-
-                #save the correctly translated coordinates of this window
-                polygon, rectangle = self.get_translated_coords(x, y, level, scale, windowSize)
-                polygons_metal.append(polygon)
-                rects_metal.append(rectangle)
-                
-                polygons_thatch.append(polygon)
-                rects_thatch.append(rectangle)
-        self.total_window_num += window_num
-        rects = {'thatch': rects_thatch, 'metal': rects_metal}
-        polygons = {'thatch': polygons_thatch, 'metal': polygons_metal}
+    def detect(self, img_name, image, stepSize=None, windowSize=None, scale=None, minSize=None):
+        '''The windows over the pyramid of the image, as the (N, 4) array of xmin, ymin, xmax, ymax from utils.window_grid. 
+        Both roof types share the same (read only) array
+        '''
+        windowSize = windowSize if windowSize is not None else self.windowSize
+        stepSize = stepSize if stepSize is not None else self.stepSize
+        scale = scale if scale is not None else self.scale
+        minSize = minSize if minSize is not None else self.minSize
+
+        windows = utils.window_grid(image.shape, stepSize, windowSize, scale=scale, minSize=minSize)
+        self.total_window_num += len(windows)
+        window_polygons = utils.boxes2polygons(windows)
+        rects = {'thatch': windows, 'metal': windows}
+        polygons = {'thatch': window_polygons, 'metal': window_polygons}
         return polygons, rects
 
 
@@ -1,4 +1,6 @@
 # import the necessary packages
+import heapq
+
 import numpy as np
 import pdb
 
@@ -14,55 +16,181 @@ def non_max_suppression(boxes, class_probs, overlapThres=0.3):
     if len(boxes) == 0:
         return []
 
-    # if the bounding boxes integers, convert them to floats --
-    # this is important since we'll be doing a bunch of divisions
-    if boxes.dtype.kind == "i":
-        boxes = boxes.astype("float")
+    kept_boxes, kept_probs = batched_non_max_suppression({0:boxes}, {0:class_probs}, overlapThres)
+    return kept_boxes[0], kept_probs[0]
+
+
+def batched_non_max_suppression(boxes, class_probs, overlapThres=0.3, soft=False, min_prob=0.001):
+    '''Non max suppression of the detections of all roof types in one go
+
+    Parameters:
+    ------------
+    boxes: dict
+        roof_type -> array of boxes in the form of x1, y1, x2, y2
+    class_probs: dict
+        roof_type -> array with the probability of each box
+    overlapThres: float or dict
+        a single threshold, or a threshold per roof_type. A box is suppressed 
+        if more than this portion of it is covered by a better box of the same roof_type
+    soft: boolean
+        soft-NMS (Bodla et al.): instead of discarding the overlapping boxes, 
+        their probability is multiplied by (1-overlap). Boxes whose probability falls 
+        below min_prob are discarded
+
+    Returns dicts with the kept boxes (as ints) and their probabilities, by decreasing probability.
+    A roof type whose boxes have no probabilities (the pipeline does not classify a single proposal)
+    keeps no boxes, like the loop per roof type did. Any other number of probabilities raises a ValueError
+    '''
+    kept_boxes = dict(boxes)
+    kept_probs = dict(class_probs)
+    roof_types = list()
+    typed_boxes = list()
+    typed_probs = list()
+    for roof_type in boxes.keys():
+        roof_boxes = np.array(boxes[roof_type], dtype=float).reshape(-1, 4)
+        roof_probs = np.array(class_probs[roof_type], dtype=float).reshape(-1)
+        if len(roof_boxes) == 0:
+            continue
+        if len(roof_probs) == 0:
+            kept_boxes[roof_type] = np.zeros((0, 4), dtype=int)
+            kept_probs[roof_type] = roof_probs
+            continue
+        if len(roof_probs) != len(roof_boxes):
+            raise ValueError('{} {} boxes with {} probabilities'.format(len(roof_boxes), roof_type, len(roof_probs)))
+        roof_types.append(roof_type)
+        typed_boxes.append(roof_boxes)
+        typed_probs.append(roof_probs)
+    if len(roof_types) == 0:
+        return kept_boxes, kept_probs
 
+    #put the boxes of all roof types together, remembering which roof type each belongs to
+    all_boxes = np.concatenate(typed_boxes)
+    probs = np.concatenate(typed_probs)
+    classes = np.concatenate([np.repeat(c, len(roof_boxes)) for c, roof_boxes in enumerate(typed_boxes)])
+    thresholds = np.array([overlapThres[roof_type] if isinstance(overlapThres, dict) else overlapThres for roof_type in roof_types])
+    thresholds = thresholds[classes]
 
-    # initialize the list of picked indexes	
+    area = (all_boxes[:,2] - all_boxes[:,0] + 1) * (all_boxes[:,3] - all_boxes[:,1] + 1)
+    grid = BoxGrid(all_boxes, classes)
+    if soft:
+        pick, probs = _soft_suppression(all_boxes, probs, area, thresholds, grid, min_prob)
+    else:
+        pick = _hard_suppression(all_boxes, probs, area, thresholds, grid)
+
+    pick = np.array(pick, dtype=int)
+    for c, roof_type in enumerate(roof_types):
+        class_pick = pick[classes[pick] == c]
+        kept_boxes[roof_type] = all_boxes[class_pick].astype("int")
+        kept_probs[roof_type] = probs[class_pick]
+    return kept_boxes, kept_probs
+
+
+def _hard_suppression(boxes, probs, area, thresholds, grid):
+    #visit the boxes from most to least probable; among ties the last box goes first
+    order = np.argsort(probs, kind='mergesort')[::-1]
+    suppressed = np.zeros(len(boxes), dtype=bool)
     pick = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        pick.append(i)
+
+        #only the boxes in the neighbouring cells can overlap this one
+        neighbors = grid.neighbors(i)
+        neighbors = neighbors[~suppressed[neighbors]]
+        overlap = _overlap(boxes[i], boxes[neighbors], area[neighbors])
+        suppressed[neighbors[overlap > thresholds[i]]] = True
+    return pick
 
-    # grab the coordinates of the bounding boxes
-    x1 = boxes[:,0]
-    y1 = boxes[:,1]
-    x2 = boxes[:,2]
-    y2 = boxes[:,3]
-
-    # compute the area of the bounding boxes and sort the bounding
-    # boxes by the bottom-right y-coordinate of the bounding box
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(class_probs)
-
-    # keep looping while some indexes still remain in the indexes
-    # list
-    while len(idxs) > 0:
-        # grab the last index in the indexes list and add the
-        # index value to the list of picked indexes
-        last = len(idxs) - 1
-        i = idxs[last]
+
+def _soft_suppression(boxes, probs, area, thresholds, grid, min_prob):
+    probs = probs.copy()
+    alive = probs >= min_prob
+    #the probabilities change as we go, so keep a heap with lazily updated entries
+    heap = [(-probs[i], i) for i in np.where(alive)[0]]
+    heapq.heapify(heap)
+    pick = []
+    while len(heap) > 0:
+        neg_prob, i = heapq.heappop(heap)
+        if not alive[i] or -neg_prob != probs[i]:
+            continue
+        alive[i] = False
         pick.append(i)
 
-        # find the largest (x, y) coordinates for the start of
-        # the bounding box and the smallest (x, y) coordinates
-        # for the end of the bounding box
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-
-        # compute the width and height of the bounding box
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-
-        # compute the ratio of overlap
-        overlap = (w * h) / area[idxs[:last]]
-        # delete all indexes from the index list that have
-        idxs = np.delete(idxs, np.concatenate(([last],
-            np.where(overlap > overlapThres)[0])))
-    # return only the bounding boxes that were picked using the
-    # integer data type
-    return boxes[pick].astype("int"), class_probs[pick]
-    
+        neighbors = grid.neighbors(i)
+        neighbors = neighbors[alive[neighbors]]
+        overlap = _overlap(boxes[i], boxes[neighbors], area[neighbors])
+        decayed = neighbors[overlap > thresholds[i]]
+        probs[decayed] *= (1 - overlap[overlap > thresholds[i]])
+
+        alive[decayed[probs[decayed] < min_prob]] = False
+        for j in decayed[alive[decayed]]:
+            heapq.heappush(heap, (-probs[j], j))
+    return pick, probs
+
+
+def _overlap(box, boxes, area):
+    '''Portion of each of boxes that is covered by box
+    '''
+    # find the largest (x, y) coordinates for the start of
+    # the bounding box and the smallest (x, y) coordinates
+    # for the end of the bounding box
+    xx1 = np.maximum(box[0], boxes[:,0])
+    yy1 = np.maximum(box[1], boxes[:,1])
+    xx2 = np.minimum(box[2], boxes[:,2])
+    yy2 = np.minimum(box[3], boxes[:,3])
+
+    # compute the width and height of the bounding box
+    w = np.maximum(0, xx2 - xx1 + 1)
+    h = np.maximum(0, yy2 - yy1 + 1)
+    return (w * h) / area
+
+
+class BoxGrid(object):
+    '''Spatial index of boxes. The boxes are bucketed by class and by size, the sizes of a bucket 
+    within a factor of two, and each bucket is a grid whose cells are as large as its largest box. 
+    A box of a bucket can only overlap box i if its top left corner is in the cells from one cell above 
+    and left of box i to the bottom right corner of box i. So a box is only compared with the boxes 
+    near it, also when the boxes have very different sizes, like the windows of a pyramid.
+    Boxes of different classes never meet.
+    '''
+    def __init__(self, boxes, classes):
+        self.boxes = boxes
+        self.classes = classes
+        extents = np.max(boxes[:,2:] - boxes[:,:2], axis=1) + 1
+        sizes = np.floor(np.log2(np.maximum(extents, 1))).astype(int)
+
+        #the cell size of each (class, size) bucket
+        self.cell_sizes = dict()
+        self.bucket_sizes = dict()
+        order = np.lexsort((sizes, classes))
+        keys = np.column_stack((classes, sizes))[order]
+        starts = np.concatenate(([0], np.where(np.any(keys[1:] != keys[:-1], axis=1))[0] + 1))
+        cells = np.zeros((len(boxes), 2), dtype=int)
+        for start, bucket in zip(starts, np.split(order, starts[1:])):
+            c, size = keys[start]
+            cell_size = max(1., np.max(extents[bucket]))
+            self.cell_sizes[(c, size)] = cell_size
+            self.bucket_sizes.setdefault(c, list()).append(size)
+            cells[bucket] = np.floor(boxes[bucket, :2] / cell_size).astype(int)
 
+        #bucket the box indexes by (class, size, cell x, cell y)
+        order = np.lexsort((cells[:,1], cells[:,0], sizes, classes))
+        keys = np.column_stack((classes, sizes, cells))[order]
+        starts = np.concatenate(([0], np.where(np.any(keys[1:] != keys[:-1], axis=1))[0] + 1))
+        self.cells = dict()
+        for start, bucket in zip(starts, np.split(order, starts[1:])):
+            self.cells[tuple(keys[start])] = bucket
 
+    def neighbors(self, i):
+        '''Indexes of the boxes that might overlap box i, including i itself
+        '''
+        x1, y1, x2, y2 = self.boxes[i]
+        c = self.classes[i]
+        buckets = list()
+        for size in self.bucket_sizes[c]:
+            cell_size = self.cell_sizes[(c, size)]
+            x_cells = range(int(np.floor((x1 - cell_size) / cell_size)), int(np.floor(x2 / cell_size)) + 1)
+            y_cells = range(int(np.floor((y1 - cell_size) / cell_size)), int(np.floor(y2 / cell_size)) + 1)
+            buckets.extend([self.cells[(c, size, x, y)] for x in x_cells for y in y_cells if (c, size, x, y) in self.cells])
+        return np.concatenate(buckets)
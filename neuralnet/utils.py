@@ -313,22 +313,40 @@ def get_params_from_file(path):
 # Image Resize 
 ########################
 
-def resize_rgb(img, w=PATCH_W, h=PATCH_H):
-    resized = np.empty((h,w,3))
-    for channel in range(img.shape[-1]):
-        temp = cv2.resize(img[:,:,channel],(w, h), dst=np.empty((w, h)), fx=0, fy=0, interpolation=cv2.INTER_AREA) 
-        resized[:,:,channel]=temp
+def resize_image(img, w, h, out=None):
+    '''Resize all channels of a (rows, cols[, channels]) image with a single cv2.resize.
+    uint8 images stay uint8, anything else is resized as float32.
+    If out is given, the result is written into it, directly if it has the right type and layout
+    '''
+    if img.dtype != np.uint8 and img.dtype != np.float32:
+        img = img.astype(np.float32)
+    if out is not None and out.dtype == img.dtype and out.flags.c_contiguous and out.shape == (h, w)+img.shape[2:]:
+        cv2.resize(img, (w, h), dst=out, interpolation=cv2.INTER_AREA)
+        return out
+    resized = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+    #cv2 drops a single channel axis
+    resized = resized.reshape((h, w)+img.shape[2:])
+    if out is not None:
+        out[...] = resized
+        return out
     return resized
 
-def resize_grayscale(img, w=None, h=None):
-    resized = np.empty((h,w))
-    return cv2.resize(img,(w, h), dst=np.empty((w, h)), fx=0, fy=0, interpolation=cv2.INTER_AREA) 
+def resize_rgb(img, w=PATCH_W, h=PATCH_H, out=None):
+    return resize_image(img, w, h, out=out)
+
+def resize_grayscale(img, w=None, h=None, out=None):
+    return resize_image(img, w, h, out=out)
 
 
 def resize_neural_patch(patch, w=CROP_SIZE, h=CROP_SIZE):
-    resized = np.empty((3, h, w))
-    for channel in range(3):
-        resized[channel, :, :] = cv2.resize(patch[channel,:,:], (w, h), dst=np.empty((h,w)), fx=0, fy=0, interpolation=cv2.INTER_AREA)
+    return resize_image(patch.transpose(1,2,0), w, h).transpose(2,0,1)
+
+def resize_neural_patches(patches, w=CROP_SIZE, h=CROP_SIZE, out=None):
+    '''Resize a batch of (patches, channels, rows, cols) patches into a float32 array, resizing all channels of a patch at once
+    '''
+    resized = out if out is not None else np.empty((patches.shape[0], patches.shape[1], h, w), dtype=np.float32)
+    for i, patch in enumerate(patches):
+        resized[i, :, :, :] = resize_image(patch.transpose(1,2,0), w, h).transpose(2,0,1)
     return resized
 
 ########################
@@ -381,79 +399,86 @@ def sum_mask(array):
     return np.sum(np.sum(array, axis=0), axis=0)
 
 
-def rotate_image(image, angle):
-  '''Rotate image "angle" degrees.
+#rotation matrices and output sizes of rotate_image, per (image shape, angle)
+_rotation_params = dict()
 
-  How it works:
-    - Creates a blank image that fits any rotation of the image. To achieve
-      this, set the height and width to be the image's diagonal.
-    - Copy the original image to the center of this blank image
-    - Rotate using warpAffine, using the newly created image's center
-      (the enlarged blank image center)
-    - Translate the four corners of the source image in the enlarged image
-      using homogenous multiplication of the rotation matrix.
-    - Crop the image according to these transformed corners
+def get_rotation_params(shape, angle):
+  '''Return the affine matrix and the output size (cols, rows) used by rotate_image.
+  They only depend on the shape of the image and the angle, so they are computed once
   '''
+  key = (tuple(shape[:2]), angle)
+  if key in _rotation_params:
+    return _rotation_params[key]
 
-  diagonal = int(math.sqrt(pow(image.shape[0], 2) + pow(image.shape[1], 2)))
-  offset_x = (diagonal - image.shape[0])/2
-  offset_y = (diagonal - image.shape[1])/2
-  #dst_image = np.zeros((diagonal, diagonal, 3), dtype='uint8')
-  dst_image = np.zeros((diagonal, diagonal), dtype='uint8')
+  diagonal = int(math.sqrt(pow(shape[0], 2) + pow(shape[1], 2)))
+  offset_x = (diagonal - shape[0])/2
+  offset_y = (diagonal - shape[1])/2
   image_center = (diagonal/2, diagonal/2)
 
   R = cv2.getRotationMatrix2D(image_center, angle, 1.0)
-  #dst_image[offset_x:(offset_x + image.shape[0]), \
-  #          offset_y:(offset_y + image.shape[1]), \
-  #          :] = image
-  dst_image[offset_x:(offset_x + image.shape[0]), offset_y:(offset_y + image.shape[1])] = image
-  dst_image = cv2.warpAffine(dst_image, R, (diagonal, diagonal), flags=cv2.INTER_LINEAR)
   # Calculate the rotated bounding rect
-  x0 = offset_x
-  x1 = offset_x + image.shape[0]
-  x2 = offset_x
-  x3 = offset_x + image.shape[0]
+  corners = np.ones((3,4))
+  corners[0,:] = [offset_x, offset_x + shape[0], offset_x, offset_x + shape[0]]
+  corners[1,:] = [offset_y, offset_y, offset_y + shape[1], offset_y + shape[1]]
+  c = np.dot(R, corners).astype(int)
+  left, right = c[0].min(), c[0].max()
+  up, down = c[1].min(), c[1].max()
+  h = down - up
+  w = right - left
 
-  y0 = offset_y
-  y1 = offset_y
-  y2 = offset_y + image.shape[1]
-  y3 = offset_y + image.shape[1]
+  # fold the copy into the enlarged image and the crop into the matrix:
+  # a source pixel (x, y) sits at (x+offset_y, y+offset_x) in the enlarged image, 
+  # and the crop starts at column up and row left of the rotated enlarged image
+  M = R.copy()
+  M[:, 2] += np.dot(R[:, :2], [offset_y, offset_x])
+  M[0, 2] -= up
+  M[1, 2] -= left
+  _rotation_params[key] = (M, (int(h), int(w)))
+  return _rotation_params[key]
 
-  corners = np.zeros((3,4))
-  corners[0,0] = x0
-  corners[0,1] = x1
-  corners[0,2] = x2
-  corners[0,3] = x3
-  corners[1,0] = y0
-  corners[1,1] = y1
-  corners[1,2] = y2
-  corners[1,3] = y3
-  corners[2:] = 1
 
-  c = np.dot(R, corners)
+def rotate_image(image, angle):
+  '''Rotate image "angle" degrees.
 
-  x = int(c[0,0])
-  y = int(c[1,0])
-  left = x
-  right = x
-  up = y
-  down = y
+  How it works:
+    - The image is placed in the center of a blank image whose height and width 
+      are the image's diagonal, so that it fits any rotation of the image
+    - It is rotated around the center of the enlarged image and cropped to the 
+      rotated corners of the source image
+    - The placement and the crop are part of the matrix from get_rotation_params, 
+      so all of this is a single warpAffine on the source image
+  '''
+  M, size = get_rotation_params(image.shape, angle)
+  return cv2.warpAffine(image, M, size, flags=cv2.INTER_LINEAR)
 
-  for i in range(4):
-    x = int(c[0,i])
-    y = int(c[1,i])
-    if (x < left): left = x
-    if (x > right): right = x
-    if (y < up): up = y
-    if (y > down): down = y
-  h = down - up
-  w = right - left
 
-  #cropped = np.zeros((w, h, 3), dtype='uint8')
-  cropped = np.zeros((w, h), dtype='uint8')
-  #cropped[:, :, :] = dst_image[left:(left+w), up:(up+h), :]
-  cropped[:, :] = dst_image[left:(left+w), up:(up+h)]
-  return cropped
+class ImageRotator(object):
+    '''Rotates grayscale images and keeps the last few rotations around, 
+    so that all detectors working on an image share the same rotated copies
+    '''
+    def __init__(self, cache_size=len(VIOLA_ANGLES)):
+        self.cache_size = cache_size
+        self.rotated = OrderedDict()
+
+    def rotate(self, image, angle, key=None):
+        '''@param key identifies the image (e.g. its path). Without a key nothing is cached
+        '''
+        if angle == 0:
+            return image
+        if key is None:
+            return rotate_image(image, angle)
+
+        cache_key = (key, image.shape, angle)
+        if cache_key in self.rotated:
+            #move it to the end: it's now the most recently used
+            rotated = self.rotated.pop(cache_key)
+        else:
+            rotated = rotate_image(image, angle)
+            if len(self.rotated) >= self.cache_size:
+                self.rotated.popitem(last=False)
+        self.rotated[cache_key] = rotated
+        return rotated
+
 
 def rotate_image_RGB(image, angle):
   '''Rotate image "angle" degrees.
@@ -680,6 +705,75 @@ def boxes2polygons(boxes):
     return polygons
 
 
+########################
+# POLYGON GEOMETRY
+########################
+
+def polygon_areas(polygons, counts=None):
+    '''Shoelace area of each (K, 2) polygon in an (N, K, 2) array.
+    If counts is given, only the first counts[n] vertices of polygon n are used
+    '''
+    polygons = np.asarray(polygons, dtype=float)
+    K = polygons.shape[1]
+    counts = counts if counts is not None else np.repeat(K, len(polygons))
+    vertex = np.arange(K)[None, :]
+    #the vertex after the last valid one is the first one
+    next_vertex = np.where(vertex+1 < counts[:, None], vertex+1, 0)
+    rows = np.arange(len(polygons))[:, None]
+    x, y = polygons[:, :, 0], polygons[:, :, 1]
+    cross = x*y[rows, next_vertex] - x[rows, next_vertex]*y
+    cross[vertex >= counts[:, None]] = 0
+    return np.abs(np.sum(cross, axis=1))/2
+
+
+def convex_intersection_areas(subjects, clips):
+    '''Area of the intersection of each subject polygon (N, K, 2) with the corresponding 
+    convex clip polygon (N, L, 2), by Sutherland-Hodgman clipping of all N pairs at once
+    '''
+    subjects = np.asarray(subjects, dtype=float)
+    clips = np.asarray(clips, dtype=float)
+    N, K, L = subjects.shape[0], subjects.shape[1], clips.shape[1]
+    rows = np.arange(N)
+
+    #clip against the edges in counterclockwise order, so the inside is on the left of each edge
+    clockwise = np.sum(clips[:,:,0]*np.roll(clips[:,:,1], -1, axis=1) - np.roll(clips[:,:,0], -1, axis=1)*clips[:,:,1], axis=1) < 0
+    clips = np.where(clockwise[:, None, None], clips[:, ::-1, :], clips)
+
+    #each clipping edge adds at most one vertex
+    polygons = np.zeros((N, K+L, 2))
+    polygons[:, :K] = subjects
+    counts = np.repeat(K, N)
+    for e in range(L):
+        a = clips[:, e]
+        b = clips[:, (e+1)%L]
+        edge = b-a
+        side = lambda p: edge[:,0]*(p[:,1]-a[:,1]) - edge[:,1]*(p[:,0]-a[:,0])
+
+        clipped = np.zeros_like(polygons)
+        clipped_counts = np.zeros(N, dtype=int)
+        for i in range(K+L):
+            valid = i < counts
+            current = polygons[:, i]
+            previous = polygons[rows, np.where(i > 0, i-1, np.maximum(counts-1, 0))]
+            current_side, previous_side = side(current), side(previous)
+            current_in, previous_in = current_side >= 0, previous_side >= 0
+
+            #the polygon crosses the edge: add the crossing point
+            crossing = valid & (current_in != previous_in)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = previous_side/(previous_side-current_side)
+                crossing_point = previous + t[:, None]*(current-previous)
+            clipped[rows[crossing], clipped_counts[crossing]] = crossing_point[crossing]
+            clipped_counts += crossing
+
+            #keep the vertices inside the edge
+            inside = valid & current_in
+            clipped[rows[inside], clipped_counts[inside]] = current[inside]
+            clipped_counts += inside
+        polygons, counts = clipped, clipped_counts
+    return polygon_areas(polygons, counts)
+
+
 ########################
 # Perspective transform
 #######################
@@ -724,6 +818,19 @@ def four_point_transform(image, pts): #original_points):
     # return the warped image
     return warped
 
+
+def extract_neural_patches(image, polygons, w=PATCH_W, h=PATCH_H, out=None):
+    '''Straighten every polygon of the image with four_point_transform and resize it like cv2_to_neural, 
+    into a single float32 array of shape (patches, channels, h, w), scaled to [0, 1].
+    The nets and their scalers were trained on patches shrunk with INTER_AREA, so the polygons are not warped straight to w x h
+    '''
+    patches = out if out is not None else np.empty((len(polygons), image.shape[2], h, w), dtype=np.float32)
+    resized = np.empty((h, w, image.shape[2]), dtype=np.float32)
+    for i, polygon in enumerate(polygons):
+        warped = np.asarray(four_point_transform(image, np.asarray(polygon, dtype="float32")), dtype=np.float32)/255
+        patches[i, :, :, :] = resize_image(warped, w, h, out=resized).transpose(2,0,1)
+    return patches
+
 #########################
 # ROTATIONS
 #########################
@@ -765,27 +872,31 @@ def rotate_polygon(polygon, img, angle, dest_img_shape):
 
 def rotate_detection_polygons(detections, img, angle, dest_img_shape, remove_off_img=False):
     '''Rotate all detections that are already in the form of polygons
-    for a given angle and an original image around whose center we rotate
+    for a given angle and an original image around whose center we rotate.
+    Same as calling rotate_polygon on each detection, but all corners are rotated at once
     '''
-    rotated_polygons = np.zeros((detections.shape[0], 4, 2))
-    accepted_number = 0
+    polygons = np.asarray(detections, dtype=float).reshape(-1, 4, 2)
     h, w = dest_img_shape
+    theta = math.radians(angle)
+
+    #translation: how much the image has moved (see rotate_point)
+    oy, ox = tuple(np.array(img.shape[:2])/2)
+    off_y, off_x = (oy-(h/2)), (ox-(w/2))
+    oy, ox = (h/2), (w/2)
+    px = polygons[:, :, 0]-off_x-ox
+    py = polygons[:, :, 1]-off_y-oy
 
-    for detection in detections:
-        accept_polygon=True
-        rotated_pol = rotate_polygon(detection, img, angle, dest_img_shape)
+    #rotate every corner, truncating to ints like rotate_point does
+    rotated_polygons = np.empty(polygons.shape)
+    rotated_polygons[:, :, 0] = (math.cos(theta) * px - math.sin(theta) * py + ox).astype(int)
+    rotated_polygons[:, :, 1] = (math.sin(theta) * px + math.cos(theta) * py + oy).astype(int)
 
-        #remove points that fall off the image
-        if remove_off_img == True:
-            for pnt in rotated_pol:
-                x, y = pnt
-                if (x<0) or (y<0) or (x>w) or (y>h):
-                    accept_polygon = False        
-                    continue
-        if accept_polygon:
-            rotated_polygons[accepted_number, :] = rotate_polygon(detection, img, angle, dest_img_shape)
-            accepted_number += 1
-    return rotated_polygons[:accepted_number,:] 
+    #remove polygons with points that fall off the image
+    if remove_off_img == True:
+        x, y = rotated_polygons[:, :, 0], rotated_polygons[:, :, 1]
+        on_img = np.all((x>=0) & (y>=0) & (x<=w) & (y<=h), axis=1)
+        rotated_polygons = rotated_polygons[on_img]
+    return rotated_polygons 
 
 
 ########################
@@ -912,6 +1023,58 @@ def pyramid(image, scale=1.5, minSize=(30, 30)):
         yield image
 
 
+def pyramid_shapes(shape, scale=1.5, minSize=(30, 30)):
+    '''The (rows, cols) of the levels pyramid yields for an image of this shape, without resizing anything
+    '''
+    h, w = shape[:2]
+    shapes = [(h, w)]
+    while True:
+        w = int(w / scale)
+        h = int(h / scale)
+        if h < minSize[1] or w < minSize[0]:
+            break
+        shapes.append((h, w))
+    return shapes
+
+
+_window_grids = dict()
+
+def window_grid(shape, stepSize, windowSize, scale=1.5, minSize=(30, 30)):
+    '''The windows of full windowSize that sliding_window visits over the pyramid of an image of this shape, 
+    translated back to the original image. Returns an (N, 4) int32 array of xmin, ymin, xmax, ymax, in the order
+    the windows are visited. The array is cached per shape and configuration, so it is read only
+    '''
+    key = (tuple(shape[:2]), stepSize, tuple(windowSize), scale, tuple(minSize))
+    if key in _window_grids:
+        return _window_grids[key]
+
+    grids = list()
+    for level, (rows, cols) in enumerate(pyramid_shapes(shape, scale=scale, minSize=minSize)):
+        #sliding_window crops windowSize[1] rows and windowSize[0] columns, only full windows are kept
+        ys = np.arange(0, rows, stepSize)
+        xs = np.arange(0, cols, stepSize)
+        ys = ys[np.minimum(windowSize[1], rows-ys) == windowSize[0]]
+        xs = xs[np.minimum(windowSize[0], cols-xs) == windowSize[1]]
+
+        scale_factor = math.pow(scale, level)
+        w = int(scale_factor*windowSize[1])
+        h = int(scale_factor*windowSize[0])
+        x = np.tile(xs*scale_factor, len(ys))
+        y = np.repeat(ys*scale_factor, len(xs))
+        grids.append(np.column_stack((x, y, x+w, y+h)).astype(np.int32))
+
+    grid = np.concatenate(grids) if len(grids) > 0 else np.zeros((0, 4), dtype=np.int32)
+    grid.flags.writeable = False
+    _window_grids[key] = grid
+    return grid
+
+
+def clear_window_grids():
+    '''Forget the cached window grids, e.g. to time how long they take to generate
+    '''
+    _window_grids.clear()
+
+
 def sliding_window(image, stepSize, windowSize):
     # slide a window across the image
     for y in xrange(0, image.shape[0], stepSize):
@@ -8,6 +8,8 @@ from collections import defaultdict
 import pickle
 import csv
 import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import cv2
@@ -16,6 +18,8 @@ from scipy import misc, ndimage #load images
 
 import utils
 from timer import Timer
+import instrumentation
+from image_provider import ImageProvider
 
 from reporting import Evaluation, Detections
 import viola_detector_helpers
@@ -47,7 +51,9 @@ class ViolaDetector(object):
             mergeFalsePos=False,
             separateDetections=True,
             vocGood=0.1,
-            pickled_evaluation=False
+            pickled_evaluation=False,
+            threads=None,
+            full_dataset=False
             ):
         '''
         Class used to do preliminary detection of metal and thatch roofs on images
@@ -87,6 +93,11 @@ class ViolaDetector(object):
             whether the patches saved should be strictly the true and false detections
         neg_thres: float
             the threshold voc score under which a detection is considered a negative example for neural training
+        threads: int
+            number of threads used to run the detectors on the different angles of an image. 
+            Defaults to the number of cores
+        full_dataset: boolean
+            whether the roofs of the images in in_path are annotated like the full dataset, see AnnotationIndex
         mergeFalsePos: boolean
             whether the bad detections of the metal and thatch roofs should be saved together or separately.
             If it is true, then only bad detections that are bad for both metal and thatch fall into the bad
@@ -127,9 +138,16 @@ class ViolaDetector(object):
         self.remove_off_img = removeOff
         self.downsized = downsized
 
+        #all (detector, angle) jobs of an image are run by a pool of threads
+        self.setup_job_detectors()
+        self.job_times = defaultdict(float)
+        self.rotator = utils.ImageRotator(cache_size=len(self.angles))
+        threads = threads if threads is not None else multiprocessing.cpu_count()
+        self.thread_pool = ThreadPool(processes=threads) if threads > 1 else None
+
         self.pickled_evaluation = pickled_evaluation
         if pickled_evaluation == False:
-            self.evaluation = Evaluation(full_dataset=False, 
+            self.evaluation = Evaluation(full_dataset=full_dataset, 
                         negThres=self.negThres, method='viola', folder_name=folder_name, 
                         out_path=self.out_folder, detections=self.viola_detections, 
                         in_path=self.in_path, detector_names=detector_names, 
@@ -144,6 +162,7 @@ class ViolaDetector(object):
         #get the detectors
         assert detector_names is not None 
         self.roof_detectors = defaultdict(list)
+        self.detector_paths = defaultdict(list)
         self.detector_names = detector_names
         self.rotate_detectors = list()
 
@@ -157,10 +176,21 @@ class ViolaDetector(object):
                     self.rotate_detectors.append(False)
                 if path.startswith('cascade'):
                     start = '../viola_jones/cascades/' 
-                    self.roof_detectors[roof_type].append(cv2.CascadeClassifier(start+path+'/cascade.xml'))
+                    self.detector_paths[roof_type].append(start+path+'/cascade.xml')
+                    self.roof_detectors[roof_type].append(cv2.CascadeClassifier(self.detector_paths[roof_type][-1]))
                     assert self.roof_detectors[roof_type][-1].empty() == False
                 else:
-                    self.roof_detectors[roof_type].append(cv2.CascadeClassifier('../viola_jones/cascade_'+path+'/cascade.xml'))
+                    self.detector_paths[roof_type].append('../viola_jones/cascade_'+path+'/cascade.xml')
+                    self.roof_detectors[roof_type].append(cv2.CascadeClassifier(self.detector_paths[roof_type][-1]))
+
+
+    def close(self):
+        '''Stop the threads that run the detection jobs. Images detected afterwards run the jobs one by one
+        '''
+        if self.thread_pool is not None:
+            self.thread_pool.close()
+            self.thread_pool.join()
+            self.thread_pool = None
 
 
     def detect_roofs_in_img_folder(self):
@@ -172,6 +202,7 @@ class ViolaDetector(object):
                 img = self.detect_roofs_group(img_name)
             else:
                 img = self.detect_roofs(img_name)
+        self.close()
         '''
             self.evaluation.score_img(img_name, img.shape)
         self.evaluation.print_report()
@@ -184,46 +215,84 @@ class ViolaDetector(object):
         open(self.out_folder+'DONE', 'w').close() 
         '''
 
+    def get_detection_jobs(self):
+        '''List the (roof_type, detector number, angle) combinations we detect with
+        '''
+        jobs = list()
+        for roof_type, detectors in self.roof_detectors.iteritems():
+            for i, detector in enumerate(detectors):
+                for angle in self.angles:
+                    #for thatch we only need one angle
+                    if self.rotate_detectors[i] == False and angle>0 or (roof_type=='thatch' and angle>0):#roof_type == 'thatch' and angle>0:
+                        continue
+                    jobs.append((roof_type, i, angle))
+        return jobs
+
+
+    def setup_job_detectors(self):
+        '''A cascade cannot run on two images at the same time, so each job gets its own copy of its cascade
+        '''
+        self.jobs = self.get_detection_jobs()
+        self.job_detectors = dict()
+        for roof_type, i, angle in self.jobs:
+            if angle == 0:
+                self.job_detectors[(roof_type, i, angle)] = self.roof_detectors[roof_type][i]
+            else:
+                self.job_detectors[(roof_type, i, angle)] = cv2.CascadeClassifier(self.detector_paths[roof_type][i])
+
+
     def detect_roofs(self, img_name, in_path=None):
         in_path = self.in_path if in_path is None else in_path 
         try:
-            rgb_unrotated = cv2.imread(in_path+img_name, flags=cv2.IMREAD_COLOR)
-            gray = cv2.cvtColor(rgb_unrotated, cv2.COLOR_BGR2GRAY)
-            gray = cv2.equalizeHist(gray)
+            with instrumentation.span('viola.decode'):
+                #the image is decoded once and shared with the rest of the pipeline
+                images = ImageProvider.get_provider()
+                rgb_unrotated = images.get_color(in_path+img_name)
+                gray = images.get_equalized(in_path+img_name)
 
-            if self.downsized:
-                rgb_unrotated = utils.resize_rgb(rgb_unrotated, h=rgb_unrotated.shape[0]/2, w=rgb_unrotated.shape[1]/2)
-                gray = utils.resize_grayscale(gray, w=gray.shape[1]/2, h=gray.shape[0]/2)
+                if self.downsized:
+                    rgb_unrotated = utils.resize_rgb(rgb_unrotated, h=rgb_unrotated.shape[0]/2, w=rgb_unrotated.shape[1]/2)
+                    gray = utils.resize_grayscale(gray, w=gray.shape[1]/2, h=gray.shape[0]/2)
 
         except IOError as e:
             print e
             sys.exit(-1)
         else:
-            for roof_type, detectors in self.roof_detectors.iteritems():
-                for i, detector in enumerate(detectors):
-                    for angle in self.angles:
-                        #for thatch we only need one angle
-                        if self.rotate_detectors[i] == False and angle>0 or (roof_type=='thatch' and angle>0):#roof_type == 'thatch' and angle>0:
-                            continue
-
-                        print 'Detecting with detector: '+str(i)
-                        print 'ANGLE '+str(angle)
-
-                        with Timer() as t: 
-                            rotated_image = utils.rotate_image(gray, angle) if angle>0 else gray
-                            delete_image = utils.rotate_image_RGB(rgb_unrotated, angle) if angle>0 else gray
-                            detections, _ = self.detect_and_rectify(detector, rotated_image, angle, rgb_unrotated.shape[:2], rgb_rotated=delete_image) 
-                            if self.downsized:
-                                detections = detections*2
-                            self.viola_detections.set_detections(roof_type=roof_type, img_name=img_name, 
-                                    angle=angle, detection_list=detections, img=rotated_image)
+            with Timer() as total:
+                #rotate the image once per angle, all the detectors share the rotations
+                rotated_images = dict()
+                for angle in set([angle for _, _, angle in self.jobs]):
+                    rotated_images[angle] = self.rotator.rotate(gray, angle, key=in_path+img_name)
+
+                def detect_job(job):
+                    roof_type, i, angle = job
+                    with Timer() as t: 
+                        detections, _ = self.detect_and_rectify(self.job_detectors[job], rotated_images[angle], angle, 
+                                                                rgb_unrotated.shape[:2]) 
+                        if self.downsized:
+                            detections = detections*2
+                    return detections, t.secs
+
+                #cv2 releases the GIL while detecting, so the jobs can run in threads
+                if self.thread_pool is not None:
+                    results = self.thread_pool.map(detect_job, self.jobs)
+                else:
+                    results = [detect_job(job) for job in self.jobs]
 
-                        print 'Time detection: {0}'.format(t.secs)
-                        self.viola_detections.total_time += t.secs
-                        if DEBUG:
-                            rgb_to_write = cv2.imread(in_path+img_name, flags=cv2.IMREAD_COLOR)
-                            utils.draw_detections(detections, rgb_to_write, color=(255,0,0))
-                            cv2.imwrite('{0}{3}{1}_{2}.jpg'.format('', img_name[:-4], angle, roof_type), rgb_to_write)
+            for (roof_type, i, angle), (detections, secs) in zip(self.jobs, results):
+                self.viola_detections.set_detections(roof_type=roof_type, img_name=img_name, 
+                        angle=angle, detection_list=detections, img=rotated_images[angle])
+                print 'Time detection with {0} detector {1} at angle {2}: {3}'.format(roof_type, i, angle, secs)
+                self.job_times[(roof_type, i, angle)] += secs
+                instrumentation.count('viola.detections', len(detections))
+
+                if DEBUG:
+                    rgb_to_write = images.get_copy(in_path+img_name)
+                    utils.draw_detections(detections, rgb_to_write, color=(255,0,0))
+                    cv2.imwrite('{0}{3}{1}_{2}.jpg'.format('', img_name[:-4], angle, roof_type), rgb_to_write)
+            print 'Time detection: {0}'.format(total.secs)
+            self.viola_detections.total_time += total.secs
+            instrumentation.add_time('viola.detect', total.secs)
             return rgb_unrotated
 
 
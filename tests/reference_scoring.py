@@ -0,0 +1,73 @@
+import numpy as np
+
+'''
+The scoring loops the vectorized code replaced, as they were before, so the tests can check that the results did not change.
+'''
+
+
+def get_score_fast(roof, detection):
+    '''Evaluation.get_score_fast: the VOC score of a roof box and a detection box, and how much of the detection is roof
+    '''
+    intersection_area = 0
+    roof_xmin, roof_ymin, roof_xmax, roof_ymax = roof
+    detection_xmin, detection_ymin, detection_xmax, detection_ymax = detection
+
+    dx = min(roof_xmax, detection_xmax) - max(roof_xmin, detection_xmin)
+    dy = min(roof_ymax, detection_ymax) - max(roof_ymin, detection_ymin)
+    if (dx>=0) and (dy>=0):
+        intersection_area = dx*dy
+
+    roof_area = (roof_xmax - roof_xmin) * (roof_ymax - roof_ymin)
+    detection_area = (detection_xmax - detection_xmin) * (detection_ymax - detection_ymin)
+    union_area = (roof_area + detection_area) - intersection_area
+    voc_score = float(intersection_area)/union_area
+    detection_roof_portion = float(intersection_area)/detection_area
+    return voc_score, detection_roof_portion
+
+
+def score_image(roofs, detections, voc_threshold=0.5, good_threshold=0.5):
+    '''The loop of Evaluation.score_img for one roof type of one image.
+    Returns the logicals it computed: false positives, bad detections, easy false positives (per detection)
+    and easy false negatives (per roof), and the best score of each detection
+    '''
+    false_pos = np.ones(len(detections), dtype=bool)
+    bad_detections = np.ones(len(detections), dtype=bool)
+    easy_false_pos = np.ones(len(detections), dtype=bool)
+    easy_false_neg = np.ones(len(roofs), dtype=bool)
+    best_score_per_detection = list()
+
+    for r, roof in enumerate(roofs):
+        best_voc_score = -1
+        best_detection = -1
+        for d, detection in enumerate(detections):
+            if r == 0:
+                best_score_per_detection.append(-1)
+            voc_score, detection_roof_portion = get_score_fast(roof, detection)
+            if (voc_score > voc_threshold) and (voc_score > best_voc_score):
+                best_voc_score = voc_score
+                best_detection = d
+            if (voc_score > voc_threshold) or (detection_roof_portion > 0.5):
+                easy_false_pos[d] = 0
+                easy_false_neg[r] = 0
+            if voc_score > good_threshold:
+                bad_detections[d] = 0
+            if voc_score > best_score_per_detection[d]:
+                best_score_per_detection[d] = voc_score
+        if best_detection != -1:
+            false_pos[best_detection] = 0
+    return dict(false_pos=false_pos, bad_detections=bad_detections, easy_false_pos=easy_false_pos,
+                easy_false_neg=easy_false_neg, best_score_per_detection=best_score_per_detection)
+
+
+def sweep_thresholds(roofs, detections, probs, thresholds, voc_threshold=0.5):
+    '''The per threshold loop of AucCurve.calculate_auc_values for one image:
+    for each threshold, the detections with probs > threshold are scored with score_image.
+    Returns true positives, detections kept, easy true positives and easy false positives per threshold
+    '''
+    counts = list()
+    for thres in thresholds:
+        kept = detections[probs > thres]
+        scores = score_image(roofs, kept, voc_threshold=voc_threshold)
+        counts.append((np.sum(np.invert(scores['false_pos'])), len(kept),
+                        np.sum(np.invert(scores['easy_false_neg'])), np.sum(scores['easy_false_pos'])))
+    return [np.array(c) for c in zip(*counts)] if len(counts) > 0 else [np.zeros(0, dtype=int)]*4
@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'neuralnet'))
+sys.path.insert(0, TESTS_PATH)
+import utils
+from auc_curve import AucCurve
+import reference_scoring
+
+
+def make_image(random_state, roof_num=6, detection_num=40):
+    '''Roof boxes, detections around them and elsewhere, and float32 probabilities that sit on the thresholds
+    '''
+    xmin, ymin = random_state.randint(0, 400, size=(2, roof_num))
+    size = random_state.randint(20, 50, size=(2, roof_num))
+    roofs = np.column_stack((xmin, ymin, xmin+size[0], ymin+size[1]))
+    near = roofs[random_state.randint(0, roof_num, size=detection_num/2)] + random_state.randint(-8, 9, size=(detection_num/2, 4))
+    xmin, ymin = random_state.randint(0, 400, size=(2, detection_num/2))
+    far = np.column_stack((xmin, ymin, xmin+30, ymin+30))
+    detections = np.vstack((near, far))
+    #two decimal probabilities are on the thresholds once truncated, and are not exact in float32
+    probs = (random_state.randint(0, 100, size=detection_num)/100.).astype(np.float32)
+    return roofs, detections, probs
+
+
+class AucCurveTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(3)
+        self.img_names = ['a.jpg', 'b.jpg', 'c.jpg']
+        self.roofs = dict((roof_type, dict()) for roof_type in utils.ROOF_TYPES)
+        self.detections = dict((roof_type, dict()) for roof_type in utils.ROOF_TYPES)
+        self.probs = dict((roof_type, dict()) for roof_type in utils.ROOF_TYPES)
+        for roof_type in utils.ROOF_TYPES:
+            for img_name in self.img_names:
+                roofs, detections, probs = make_image(random_state)
+                self.roofs[roof_type][img_name] = roofs
+                self.detections[roof_type][img_name] = detections
+                self.probs[roof_type][img_name] = probs
+        self.out_path = tempfile.mkdtemp()+'/'
+
+    def tearDown(self):
+        shutil.rmtree(self.out_path)
+
+    def test_sweep_image_float32(self):
+        roofs = self.roofs['metal']['a.jpg']
+        detections = self.detections['metal']['a.jpg']
+        probs = self.probs['metal']['a.jpg']
+        thresholds = sorted(set([1.]+[int(100*p)/100. for p in probs]))
+        counts = AucCurve.sweep_image(roofs, detections, probs, thresholds)
+        expected = reference_scoring.sweep_thresholds(roofs, detections, probs, thresholds)
+        for name, count, expected_count in zip(['true pos', 'kept', 'easy true pos', 'easy false pos'], counts, expected):
+            np.testing.assert_array_equal(count, expected_count, err_msg=name)
+
+    def test_sweep_image_float64(self):
+        roofs = self.roofs['thatch']['b.jpg']
+        detections = self.detections['thatch']['b.jpg']
+        probs = self.probs['thatch']['b.jpg'].astype(np.float64)
+        thresholds = sorted(set([1.]+[int(100*p)/100. for p in probs]))
+        counts = AucCurve.sweep_image(roofs, detections, probs, thresholds)
+        expected = reference_scoring.sweep_thresholds(roofs, detections, probs, thresholds)
+        for count, expected_count in zip(counts, expected):
+            np.testing.assert_array_equal(count, expected_count)
+
+    def test_sweep_image_without_roofs_or_detections(self):
+        counts = AucCurve.sweep_image(np.zeros((0, 4)), self.detections['metal']['a.jpg'], self.probs['metal']['a.jpg'], [0.2, 0.5])
+        np.testing.assert_array_equal(counts[0], [0, 0])
+        counts = AucCurve.sweep_image(self.roofs['metal']['a.jpg'], np.zeros((0, 4)), np.zeros(0, dtype=np.float32), [0.2, 0.5])
+        np.testing.assert_array_equal(counts[1], [0, 0])
+
+    def test_recall_precision(self):
+        auc_curve = AucCurve(self.img_names, self.roofs, self.out_path, 'test')
+        for img_name in self.img_names:
+            auc_curve.set_detections(dict((r, self.detections[r][img_name]) for r in utils.ROOF_TYPES), img_name)
+            auc_curve.set_probs(dict((r, self.probs[r][img_name]) for r in utils.ROOF_TYPES), img_name)
+        auc_curve.calculate_auc_values()
+
+        for roof_type in utils.ROOF_TYPES:
+            true_pos, kept, _, _ = [sum(counts) for counts in zip(*[reference_scoring.sweep_thresholds(self.roofs[roof_type][img_name],
+                                        self.detections[roof_type][img_name], self.probs[roof_type][img_name], auc_curve.unique_probs)
+                                        for img_name in self.img_names])]
+            roof_num = sum([len(self.roofs[roof_type][img_name]) for img_name in self.img_names])
+            recall = np.where(kept > 0, true_pos/float(roof_num), 0)
+            precision = np.where(kept > 0, true_pos/np.maximum(kept, 1).astype(float), 1)
+            np.testing.assert_array_equal(auc_curve.recall[roof_type], recall)
+            np.testing.assert_array_equal(auc_curve.precision[roof_type], precision)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import math
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+from classification import Classification
+
+
+def reference_sweep(classification):
+    '''The thresholds and, per threshold, the detections above it of every image, as the loops before threshold_sweep found them
+    '''
+    unique_probs = set([1.])
+    for roof_type in utils.ROOF_TYPES:
+        for img_name in classification.img_names:
+            probs = [int(100*p) for p in list(classification.probs[roof_type][img_name])]
+            unique_probs.update([(float(p)/100) for p in probs])
+    unique_probs = sorted(unique_probs)
+
+    counts = dict()
+    for roof_type in utils.ROOF_TYPES:
+        counts[roof_type] = np.zeros((len(classification.img_names+classification.uninhabited), len(unique_probs)), dtype=int)
+        for t, thres in enumerate(unique_probs):
+            for i, img_name in enumerate(classification.img_names+classification.uninhabited):
+                probs = np.array(classification.probs[roof_type][img_name])
+                counts[roof_type][i, t] = len(classification.detections[roof_type][img_name][probs > thres])
+    return unique_probs, counts
+
+
+class ThresholdSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()+'/'
+        os.mkdir(self.path+'uninhabited/')
+        self.uninhabited_path = utils.UNINHABITED_PATH
+        utils.UNINHABITED_PATH = self.path+'uninhabited/'
+        for img_name in ['u1.jpg', 'u2.jpg']:
+            open(utils.UNINHABITED_PATH+img_name, 'w').close()
+
+    def tearDown(self):
+        utils.UNINHABITED_PATH = self.uninhabited_path
+        shutil.rmtree(self.path)
+
+    def make_classification(self, dtype):
+        random_state = np.random.RandomState(0)
+        img_names = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+        correct_roofs = dict((roof_type, dict((img_name, np.zeros((i%3, 4))) for i, img_name in enumerate(img_names)))
+                                                                                    for roof_type in utils.ROOF_TYPES)
+        classification = Classification(img_names, self.path, correct_roofs, 'test')
+        for i, img_name in enumerate(img_names+classification.uninhabited):
+            #two decimal probabilities sit on the thresholds; the last image has no detections
+            detection_num = 0 if i == 3 else random_state.randint(5, 30)
+            probs = dict((roof_type, (random_state.randint(0, 101, size=detection_num)/100.).astype(dtype)) for roof_type in utils.ROOF_TYPES)
+            classification.set_probs(probs, img_name)
+            classification.set_detections(dict((roof_type, np.zeros((detection_num, 4))) for roof_type in utils.ROOF_TYPES), img_name)
+        return classification
+
+    def test_sweep_matches_loops_float32(self):
+        classification = self.make_classification(np.float32)
+        classification.threshold_sweep()
+        unique_probs, counts = reference_sweep(classification)
+        self.assertEqual(classification.unique_probs, unique_probs)
+        for roof_type in utils.ROOF_TYPES:
+            np.testing.assert_array_equal(classification.counts_above[roof_type], counts[roof_type])
+
+    def test_sweep_matches_loops_float64(self):
+        classification = self.make_classification(np.float64)
+        classification.threshold_sweep()
+        unique_probs, counts = reference_sweep(classification)
+        self.assertEqual(classification.unique_probs, unique_probs)
+        for roof_type in utils.ROOF_TYPES:
+            np.testing.assert_array_equal(classification.counts_above[roof_type], counts[roof_type])
+
+    def test_mae(self):
+        classification = self.make_classification(np.float32)
+        classification.get_MAE()
+        unique_probs, counts = reference_sweep(classification)
+        for roof_type in utils.ROOF_TYPES:
+            for t, thres in enumerate(unique_probs):
+                errors = [math.fabs(len(classification.correct_roofs[roof_type]) - count) for count in counts[roof_type][:, t]]
+                self.assertEqual(classification.errors[roof_type][thres], errors)
+                self.assertEqual(classification.mae[roof_type][thres], np.mean(np.array(errors)))
+            self.assertTrue(os.path.isfile(self.path+'mae_{}.csv'.format(roof_type)))
+
+
+if __name__ == '__main__':
+    unittest.main()
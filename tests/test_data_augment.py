@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+from data_augment import Augmenter
+
+FLIP_CODES = [None, 0, 1, -1]
+
+
+def reference_flip_crop(X, dst_shape, random_state):
+    '''Flip each patch with cv2.flip and crop it with a slice, with the draws random_flip_crop_batch makes, in the same order
+    '''
+    n, channels, rows, cols = X.shape
+    crop_rows, crop_cols = dst_shape
+    flips = random_state.randint(0, 4, size=n)
+    margin_0 = random_state.randint(0, max(rows-crop_rows, 1), size=n)
+    margin_1 = random_state.randint(0, max(cols-crop_cols, 1), size=n)
+    min_0 = (random_state.random_sample(n)*margin_0).astype(int)
+    min_1 = (random_state.random_sample(n)*margin_1).astype(int)
+    patches = list()
+    for i, patch in enumerate(X):
+        img = patch.transpose(1,2,0)
+        if FLIP_CODES[flips[i]] is not None:
+            img = cv2.flip(img, flipCode=FLIP_CODES[flips[i]])
+        img = img[min_0[i]:min_0[i]+crop_rows, min_1[i]:min_1[i]+crop_cols, :]
+        patches.append(img.transpose(2,0,1))
+    return np.array(patches), flips, min_0, min_1
+
+
+class RandomFlipCropBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.X = np.random.RandomState(0).rand(40, 3, 40, 40).astype(np.float32)
+
+    def assert_matches_reference(self, X, dst_shape, seed=1):
+        batch = Augmenter.random_flip_crop_batch(X, dst_shape, np.random.RandomState(seed))
+        expected, flips, min_0, min_1 = reference_flip_crop(X, dst_shape, np.random.RandomState(seed))
+        self.assertEqual(batch.shape, (len(X), X.shape[1])+tuple(dst_shape))
+        self.assertEqual(batch.dtype, np.float32)
+        for i in range(len(X)):
+            np.testing.assert_array_equal(batch[i], expected[i], err_msg='flip {} crop at {}'.format(FLIP_CODES[flips[i]], (min_0[i], min_1[i])))
+        return flips, min_0, min_1
+
+    def test_all_flips(self):
+        flips, min_0, min_1 = self.assert_matches_reference(self.X, (32, 32))
+        self.assertEqual(set(flips), set(range(4)))
+        self.assertTrue(np.any(min_0 > 0) and np.any(min_1 > 0))
+
+    def test_crop_of_the_whole_patch(self):
+        #margin 0: every patch is only flipped
+        flips, min_0, min_1 = self.assert_matches_reference(self.X, (40, 40))
+        self.assertEqual(set(flips), set(range(4)))
+        self.assertFalse(np.any(min_0) or np.any(min_1))
+
+    def test_margin_in_one_direction(self):
+        self.assert_matches_reference(self.X, (40, 31))
+        self.assert_matches_reference(self.X, (39, 40))
+
+    def test_uint8_and_non_square_patches(self):
+        X = np.random.RandomState(2).randint(0, 256, size=(20, 3, 30, 45)).astype(np.uint8)
+        self.assert_matches_reference(X, (24, 32))
+
+    def test_into_preallocated_batch(self):
+        out = np.empty((len(self.X), 3, 32, 32), dtype=np.float32)
+        batch = Augmenter.random_flip_crop_batch(self.X, (32, 32), np.random.RandomState(1), out=out)
+        self.assertIs(batch, out)
+        np.testing.assert_array_equal(batch, reference_flip_crop(self.X, (32, 32), np.random.RandomState(1))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import pickle
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+from FlipBatchIterator import PrefetchBatchIterator
+
+
+class ListBatchIterator(object):
+    '''The parts of nolearn's BatchIterator the prefetching uses, including its __getstate__ that drops the data
+    '''
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def __call__(self, X, y=None):
+        self.X, self.y = X, y
+        return self
+
+    def __iter__(self):
+        for i in range(0, len(self.X), self.batch_size):
+            yield self.X[i:i+self.batch_size], self.y[i:i+self.batch_size]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for attr in ('X', 'y'):
+            state.pop(attr, None)
+        return state
+
+
+class PrefetchBatchIteratorTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.X = random_state.rand(25, 3, 4, 4).astype(np.float32)
+        self.y = random_state.randint(0, 3, size=25)
+
+    def assert_same_batches(self, batch_iterator):
+        batches = list(batch_iterator(self.X, self.y))
+        expected = list(ListBatchIterator(10)(self.X, self.y))
+        self.assertEqual(len(batches), len(expected))
+        for (Xb, yb), (expected_Xb, expected_yb) in zip(batches, expected):
+            np.testing.assert_array_equal(Xb, expected_Xb)
+            np.testing.assert_array_equal(yb, expected_yb)
+
+    def test_same_batches_as_wrapped_iterator(self):
+        batch_iterator = PrefetchBatchIterator(ListBatchIterator(10), prefetch=1)
+        self.assert_same_batches(batch_iterator)
+        self.assertEqual(batch_iterator.batch_size, 10)
+        self.assertEqual(len(batch_iterator.wait_times), 1)
+
+    def test_pickle_round_trip(self):
+        #save_weights pickles the net with its batch iterators, before and after training
+        batch_iterator = PrefetchBatchIterator(ListBatchIterator(10), prefetch=3)
+        for _ in range(2):
+            copy = pickle.loads(pickle.dumps(batch_iterator, protocol=pickle.HIGHEST_PROTOCOL))
+            self.assertEqual(copy.prefetch, 3)
+            self.assertEqual(copy.batch_size, 10)
+            self.assertEqual(copy.wait_times, batch_iterator.wait_times)
+            self.assertFalse(hasattr(copy.batch_iterator, 'X'))
+            self.assert_same_batches(copy)
+            list(batch_iterator(self.X, self.y))
+
+    def test_batch_failure_is_raised(self):
+        batch_iterator = PrefetchBatchIterator(ListBatchIterator(10))
+        self.assertRaises(TypeError, list, batch_iterator(None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
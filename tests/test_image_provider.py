@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import instrumentation
+from image_provider import ImageProvider
+
+
+class ImageProviderTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()+'/'
+        random_state = np.random.RandomState(0)
+        self.img_paths = list()
+        for i in range(3):
+            img_path = self.path+'img{}.jpg'.format(i)
+            cv2.imwrite(img_path, random_state.randint(0, 256, size=(30, 40, 3)).astype(np.uint8))
+            self.img_paths.append(img_path)
+        self.images = ImageProvider.start_run(max_images=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_same_images_as_decoding_each_time(self):
+        img_path = self.img_paths[0]
+        color = cv2.imread(img_path, flags=cv2.IMREAD_COLOR)
+        gray = cv2.cvtColor(color, cv2.COLOR_BGR2GRAY)
+        np.testing.assert_array_equal(self.images.get_color(img_path), color)
+        np.testing.assert_array_equal(self.images.get_gray(img_path), gray)
+        np.testing.assert_array_equal(self.images.get_equalized(img_path), cv2.equalizeHist(gray))
+
+    def test_cache_hits(self):
+        img_path = self.img_paths[0]
+        instrumentation.start_image('img0.jpg')
+        color = self.images.get_color(img_path)
+        self.assertIs(self.images.get_color(img_path), color)
+        gray = self.images.get_gray(img_path)
+        equalized = self.images.get_equalized(img_path)
+        self.assertIs(self.images.get_gray(img_path), gray)
+        self.assertIs(self.images.get_equalized(img_path), equalized)
+        self.assertEqual((self.images.misses, self.images.hits), (1, 5))
+        counters = instrumentation.end_image()['counters']
+        self.assertEqual((counters['images.decoded'], counters['images.cache_hits']), (1, 5))
+
+    def test_least_recently_used_image_is_released(self):
+        first, second, third = self.img_paths
+        self.images.get_color(first)
+        self.images.get_color(second)
+        self.images.get_color(first)
+        self.images.get_color(third)
+        self.assertEqual(self.images.misses, 3)
+        #the second image was the least recently used
+        self.images.get_color(first)
+        self.assertEqual(self.images.misses, 3)
+        self.images.get_color(second)
+        self.assertEqual(self.images.misses, 4)
+
+    def test_changed_file_is_decoded_again(self):
+        img_path = self.img_paths[0]
+        color = self.images.get_color(img_path)
+        cv2.imwrite(img_path, np.zeros((10, 10, 3), dtype=np.uint8))
+        mtime = os.path.getmtime(img_path)
+        os.utime(img_path, (mtime+10, mtime+10))
+        self.assertEqual(self.images.get_color(img_path).shape, (10, 10, 3))
+        self.assertEqual(color.shape, (30, 40, 3))
+        self.assertEqual(self.images.misses, 2)
+
+    def test_images_are_read_only(self):
+        img_path = self.img_paths[0]
+        for image in [self.images.get_color(img_path), self.images.get_gray(img_path), self.images.get_equalized(img_path)]:
+            self.assertRaises(ValueError, image.__setitem__, (0, 0), 0)
+        copy = self.images.get_copy(img_path)
+        copy[:] = 0
+        self.assertTrue(np.any(self.images.get_color(img_path) > 0))
+
+    def test_missing_or_broken_image(self):
+        self.assertRaises(IOError, self.images.get_color, self.path+'missing.jpg')
+        open(self.path+'broken.jpg', 'w').close()
+        self.assertRaises(IOError, self.images.get_color, self.path+'broken.jpg')
+
+    def test_start_run_releases_images(self):
+        self.images.get_color(self.img_paths[0])
+        images = ImageProvider.start_run()
+        self.assertIs(ImageProvider.get_provider(), images)
+        images.get_color(self.img_paths[0])
+        self.assertEqual(images.misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
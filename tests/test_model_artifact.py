@@ -0,0 +1,53 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import model_artifact
+from model_artifact import ModelArtifact
+
+
+class WeightsTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()+'/'
+        random_state = np.random.RandomState(0)
+        self.weights = OrderedDict([('conv1', [random_state.rand(4, 3, 3, 3).astype(np.float32), np.zeros(4, dtype=np.float32)]),
+                                    ('output', [random_state.rand(16, 3).astype(np.float32), np.ones(3, dtype=np.float32)])])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_same_weights(self, weights):
+        self.assertEqual(weights.keys(), self.weights.keys())
+        for layer_name, params in self.weights.iteritems():
+            self.assertEqual(len(weights[layer_name]), len(params))
+            for param, expected in zip(weights[layer_name], params):
+                self.assertEqual(param.dtype, expected.dtype)
+                np.testing.assert_array_equal(param, expected)
+
+    def test_weights_round_trip(self):
+        model_artifact.save_weights(self.weights, self.path+'net_weights.npz')
+        self.assert_same_weights(model_artifact.load_weights(self.path+'net_weights.npz'))
+        self.assertEqual(os.listdir(self.path), ['net_weights.npz'])
+
+    def test_artifact_round_trip(self):
+        artifact = ModelArtifact(weights=self.weights, scaler_mean=np.zeros(3), scaler_scale=np.ones(3),
+                                num_layers=1, roof_type='metal', net_name='net')
+        path = artifact.save(self.path+'net')
+        loaded = ModelArtifact.load(path)
+        self.assert_same_weights(loaded.weights)
+        self.assertEqual((loaded.num_layers, loaded.roof_type, loaded.net_name), (1, 'metal', 'net'))
+
+    def test_artifact_weights_can_be_loaded_as_weights(self):
+        #both files share the layout of the weights
+        path = ModelArtifact(weights=self.weights, scaler_mean=np.zeros(3), scaler_scale=np.ones(3), num_layers=1).save(self.path+'net')
+        self.assert_same_weights(model_artifact.load_weights(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+
+
+class ExtractNeuralPatchesTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.image = random_state.randint(0, 256, size=(200, 300, 3)).astype(np.uint8)
+        #boxes larger and smaller than a patch, and rotated rectangles like the detections of the rotated images
+        xmin, ymin = random_state.randint(0, 150, size=(2, 10))
+        size = random_state.randint(10, 50, size=(2, 10))
+        boxes = np.column_stack((xmin, ymin, xmin+size[0], ymin+size[1]))
+        rotated = [utils.convert_rect_to_polygon((50, 60, 45, 30)) + random_state.randint(-3, 4, size=(4, 2)) for _ in range(5)]
+        self.polygons = np.vstack((utils.boxes2polygons(boxes), np.array(rotated))).astype(np.float32)
+
+    def test_matches_four_point_transform_and_cv2_to_neural(self):
+        patches = utils.extract_neural_patches(self.image, self.polygons)
+        self.assertEqual(patches.shape, (len(self.polygons), 3, utils.PATCH_H, utils.PATCH_W))
+        self.assertEqual(patches.dtype, np.float32)
+        for patch, polygon in zip(patches, self.polygons):
+            expected = utils.cv2_to_neural(utils.four_point_transform(self.image, polygon))
+            np.testing.assert_array_equal(patch, expected)
+
+    def test_into_preallocated_patches(self):
+        out = np.empty((len(self.polygons), 3, 32, 32), dtype=np.float32)
+        patches = utils.extract_neural_patches(self.image, self.polygons, w=32, h=32, out=out)
+        self.assertIs(patches, out)
+        for patch, polygon in zip(patches, self.polygons):
+            np.testing.assert_array_equal(patch, utils.cv2_to_neural(utils.four_point_transform(self.image, polygon), w=32, h=32))
+
+
+if __name__ == '__main__':
+    unittest.main()
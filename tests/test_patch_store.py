@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+from patch_store import PatchStoreWriter, PatchStore
+
+
+class PatchStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()+'/'
+        self.random_state = np.random.RandomState(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_store(self, patches):
+        writer = PatchStoreWriter(self.path)
+        for i, patch in enumerate(patches):
+            writer.add(patch, utils.ROOF_TYPES[i%2], i%3 == 0, 'img{}.jpg'.format(i))
+        writer.close()
+        return PatchStore(self.path)
+
+    def test_color_patches(self):
+        patches = self.random_state.randint(0, 256, size=(4, utils.PATCH_H, utils.PATCH_W, 3)).astype(np.uint8)
+        store = self.write_store(patches)
+        self.assertEqual(store.channels, 3)
+        out = store.get_patches(np.arange(4))
+        self.assertEqual(out.shape, (4, 3, utils.PATCH_H, utils.PATCH_W))
+        np.testing.assert_allclose(out, patches.transpose(0,3,1,2)/np.float32(255), rtol=1e-6)
+        np.testing.assert_array_equal(store.roof_types, ['metal', 'thatch', 'metal', 'thatch'])
+        np.testing.assert_array_equal(store.positive, [True, False, False, True])
+
+    def test_grayscale_patches(self):
+        patches = self.random_state.randint(0, 256, size=(3, utils.PATCH_H, utils.PATCH_W)).astype(np.uint8)
+        store = self.write_store(patches)
+        self.assertEqual(store.channels, 1)
+        out = store.get_patches(np.array([2, 0]))
+        self.assertEqual(out.shape, (2, 1, utils.PATCH_H, utils.PATCH_W))
+        np.testing.assert_allclose(out[:,0], patches[[2, 0]]/np.float32(255), rtol=1e-6)
+
+        #the nets take 3 channels: the gray patch is repeated, like a grayscale jpg read with cv2.imread
+        color_out = np.empty((3, 3, utils.PATCH_H, utils.PATCH_W), dtype=np.float32)
+        store.get_patches(np.arange(3), out=color_out)
+        for channel in range(3):
+            np.testing.assert_allclose(color_out[:, channel], patches/np.float32(255), rtol=1e-6)
+
+    def test_patches_are_resized(self):
+        patch = self.random_state.randint(0, 256, size=(2*utils.PATCH_H, 2*utils.PATCH_W)).astype(np.uint8)
+        store = self.write_store([patch])
+        self.assertEqual(store.get_patches([0]).shape, (1, 1, utils.PATCH_H, utils.PATCH_W))
+
+    def test_mixed_channels_raise(self):
+        writer = PatchStoreWriter(self.path)
+        writer.add(np.zeros((utils.PATCH_H, utils.PATCH_W, 3), dtype=np.uint8), 'metal', True, 'img.jpg')
+        self.assertRaises(ValueError, writer.add, np.zeros((utils.PATCH_H, utils.PATCH_W), dtype=np.uint8), 'metal', True, 'img.jpg')
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import sys
+import math
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+from reporting import Evaluation
+
+
+def rectangle(center, size, angle):
+    '''Corners of a rotated rectangle, counterclockwise in image coordinates
+    '''
+    w, h = size
+    corners = np.array([[-w/2., -h/2.], [w/2., -h/2.], [w/2., h/2.], [-w/2., h/2.]])
+    theta = math.radians(angle)
+    rotation = np.array([[math.cos(theta), -math.sin(theta)], [math.sin(theta), math.cos(theta)]])
+    return corners.dot(rotation.T) + center
+
+
+def reference_area(polygon):
+    area = 0.
+    for (x1, y1), (x2, y2) in zip(polygon, list(polygon[1:])+list(polygon[:1])):
+        area += x1*y2 - x2*y1
+    return abs(area)/2
+
+
+def reference_intersection_area(subject, clip):
+    '''Sutherland-Hodgman clipping of one polygon by one convex polygon, a vertex at a time
+    '''
+    clip = [tuple(p) for p in clip]
+    if sum([x1*y2 - x2*y1 for (x1, y1), (x2, y2) in zip(clip, clip[1:]+clip[:1])]) < 0:
+        clip = clip[::-1]
+    output = [tuple(p) for p in subject]
+    for a, b in zip(clip, clip[1:]+clip[:1]):
+        side = lambda p: (b[0]-a[0])*(p[1]-a[1]) - (b[1]-a[1])*(p[0]-a[0])
+        points, output = output, list()
+        for i, current in enumerate(points):
+            previous = points[i-1]
+            if (side(current) >= 0) != (side(previous) >= 0):
+                t = side(previous)/(side(previous)-side(current))
+                output.append((previous[0]+t*(current[0]-previous[0]), previous[1]+t*(current[1]-previous[1])))
+            if side(current) >= 0:
+                output.append(current)
+        if len(output) == 0:
+            return 0.
+    return reference_area(output)
+
+
+class PolygonAreaTest(unittest.TestCase):
+    def test_polygon_areas(self):
+        polygons = np.array([rectangle((10, 10), (4, 6), 0), rectangle((50, 20), (10, 3), 33), rectangle((0, 0), (2, 2), 45)[::-1]])
+        np.testing.assert_allclose(utils.polygon_areas(polygons), [24, 30, 4])
+
+    def test_polygon_areas_with_counts(self):
+        #only the first three vertices: the triangle of half the square
+        polygons = np.array([[[0, 0], [4, 0], [4, 4], [0, 4]]])
+        np.testing.assert_allclose(utils.polygon_areas(polygons, counts=np.array([3])), [8])
+
+
+class ConvexIntersectionTest(unittest.TestCase):
+    def test_known_areas(self):
+        square = rectangle((0, 0), (2, 2), 0)
+        subjects = np.array([square, square, square, square, square])
+        clips = np.array([
+            square,                                 #itself
+            rectangle((1, 1), (2, 2), 0),           #a quarter of it
+            rectangle((5, 5), (2, 2), 30),          #far away
+            rectangle((0, 0), (1, 1), 70),          #inside it
+            #the diamond |x|+|y| <= 1.5 cuts a triangle of legs 0.5 off each corner
+            np.array([[1.5, 0], [0, 1.5], [-1.5, 0], [0, -1.5]]),
+            ])
+        np.testing.assert_allclose(utils.convex_intersection_areas(subjects, clips), [4, 1, 0, 1, 3.5], atol=1e-12)
+
+    def test_axis_aligned_boxes_match_box_intersection(self):
+        random_state = np.random.RandomState(0)
+        xmin, ymin = random_state.randint(0, 50, size=(2, 2, 100))
+        size = random_state.randint(1, 40, size=(2, 2, 100))
+        boxes = [np.column_stack((xmin[k], ymin[k], xmin[k]+size[0, k], ymin[k]+size[1, k])) for k in range(2)]
+        dx = np.minimum(boxes[0][:,2], boxes[1][:,2]) - np.maximum(boxes[0][:,0], boxes[1][:,0])
+        dy = np.minimum(boxes[0][:,3], boxes[1][:,3]) - np.maximum(boxes[0][:,1], boxes[1][:,1])
+        expected = np.maximum(dx, 0)*np.maximum(dy, 0)
+        areas = utils.convex_intersection_areas(utils.boxes2polygons(boxes[0]), utils.boxes2polygons(boxes[1]))
+        np.testing.assert_allclose(areas, expected, atol=1e-9)
+
+    def test_rotated_rectangles_match_reference(self):
+        random_state = np.random.RandomState(1)
+        subjects, clips = list(), list()
+        for _ in range(200):
+            pair = [rectangle(random_state.uniform(0, 60, size=2), random_state.uniform(5, 40, size=2), random_state.uniform(0, 180))
+                                                                                                                    for _ in range(2)]
+            #both orientations of the vertices
+            if random_state.rand() < 0.5:
+                pair[0] = pair[0][::-1]
+            if random_state.rand() < 0.5:
+                pair[1] = pair[1][::-1]
+            subjects.append(pair[0])
+            clips.append(pair[1])
+        areas = utils.convex_intersection_areas(np.array(subjects), np.array(clips))
+        expected = [reference_intersection_area(subject, clip) for subject, clip in zip(subjects, clips)]
+        self.assertGreater(np.sum(np.array(expected) > 0), 50)
+        np.testing.assert_allclose(areas, expected, rtol=1e-9, atol=1e-9)
+
+    def test_polygon_scoring_of_boxes_matches_box_scoring(self):
+        random_state = np.random.RandomState(2)
+        xmin, ymin = random_state.randint(0, 100, size=(2, 30))
+        size = random_state.randint(10, 40, size=(2, 30))
+        boxes = np.column_stack((xmin, ymin, xmin+size[0], ymin+size[1]))
+        for from_polygons, from_boxes in zip(Evaluation.get_score_matrix(boxes[:10], boxes[10:], polygons=True),
+                                             Evaluation.get_score_matrix(boxes[:10], boxes[10:])):
+            np.testing.assert_allclose(from_polygons, from_boxes, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'neuralnet'))
+sys.path.insert(0, TESTS_PATH)
+import utils
+from reporting import Detections, Evaluation
+import reference_scoring
+
+
+def make_image(random_state, roof_num=8, detection_num=30):
+    '''Roof boxes, detections around them, elsewhere and on top of them, and exact copies of some detections
+    '''
+    xmin, ymin = random_state.randint(0, 300, size=(2, roof_num))
+    size = random_state.randint(20, 50, size=(2, roof_num))
+    roofs = np.column_stack((xmin, ymin, xmin+size[0], ymin+size[1]))
+    near = roofs[random_state.randint(0, roof_num, size=detection_num/2)] + random_state.randint(-10, 11, size=(detection_num/2, 4))
+    xmin, ymin = random_state.randint(0, 300, size=(2, detection_num/2))
+    far = np.column_stack((xmin, ymin, xmin+25, ymin+25))
+    #a detection equal to a roof, one that only touches it and duplicates that tie for the best match
+    exact = roofs[:1]
+    touching = np.array([[roofs[1, 2], roofs[1, 1], roofs[1, 2]+20, roofs[1, 3]]])
+    detections = np.vstack((near, far, exact, touching, near[:4]))
+    return roofs, detections
+
+
+class ScoreMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.roofs, self.detections = make_image(np.random.RandomState(0))
+
+    def test_matches_get_score_fast(self):
+        voc_scores, detection_roof_portions = Evaluation.get_score_matrix(self.roofs, self.detections)
+        self.assertEqual(voc_scores.shape, (len(self.roofs), len(self.detections)))
+        for r, roof in enumerate(self.roofs):
+            for d, detection in enumerate(self.detections):
+                voc_score, detection_roof_portion = reference_scoring.get_score_fast(roof, detection)
+                self.assertAlmostEqual(voc_scores[r, d], voc_score, places=12)
+                self.assertAlmostEqual(detection_roof_portions[r, d], detection_roof_portion, places=12)
+
+    def test_polygon_roofs_are_scored_as_boxes(self):
+        polygons = np.array([utils.convert_rect_to_polygon((xmin, ymin, xmax-xmin, ymax-ymin))
+                                                for xmin, ymin, xmax, ymax in self.roofs])
+        for from_polygons, from_boxes in zip(Evaluation.get_score_matrix(polygons, self.detections),
+                                             Evaluation.get_score_matrix(self.roofs, self.detections)):
+            np.testing.assert_array_equal(from_polygons, from_boxes)
+
+    def test_empty(self):
+        voc_scores, _ = Evaluation.get_score_matrix(np.zeros((0, 4)), self.detections)
+        self.assertEqual(voc_scores.shape, (0, len(self.detections)))
+        voc_scores, _ = Evaluation.get_score_matrix(self.roofs, [])
+        self.assertEqual(voc_scores.shape, (len(self.roofs), 0))
+
+
+class ScoreImgTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(1)
+        self.img_name = 'a.jpg'
+        self.roofs = dict()
+        self.detections = dict()
+        for roof_type in utils.ROOF_TYPES:
+            self.roofs[roof_type], self.detections[roof_type] = make_image(random_state)
+
+    def score(self, detections):
+        '''Run score_img and return what it passes on to update_scores, per roof type
+        '''
+        image_detections = Detections()
+        for roof_type in utils.ROOF_TYPES:
+            image_detections.set_detections(roof_type=roof_type, img_name=self.img_name, detection_list=detections[roof_type])
+        correct_roofs = dict((roof_type, {self.img_name: self.roofs[roof_type]}) for roof_type in utils.ROOF_TYPES)
+        evaluation = Evaluation(method='test', detections=image_detections, correct_roofs=correct_roofs, img_names=[self.img_name])
+        scores = dict()
+        def update_scores(img_name, detections, false_pos, bad_detections, best_score_per_detection,
+                                                            easy_false_pos, easy_false_neg, write_file=None):
+            for roof_type in utils.ROOF_TYPES:
+                scores[roof_type] = dict(false_pos=false_pos[roof_type], bad_detections=bad_detections[roof_type],
+                        easy_false_pos=easy_false_pos[roof_type], easy_false_neg=easy_false_neg[roof_type],
+                        best_score_per_detection=[score for _, score in best_score_per_detection[roof_type]])
+        evaluation.update_scores = update_scores
+        evaluation.score_img(self.img_name, (400, 400), write_file=False)
+        return scores
+
+    def assert_same_scores(self, scores, expected):
+        for name in ['false_pos', 'bad_detections', 'easy_false_pos', 'easy_false_neg']:
+            np.testing.assert_array_equal(scores[name], expected[name], err_msg=name)
+        np.testing.assert_allclose(scores['best_score_per_detection'], expected['best_score_per_detection'], rtol=1e-12)
+
+    def test_matches_loop(self):
+        scores = self.score(self.detections)
+        for roof_type in utils.ROOF_TYPES:
+            expected = reference_scoring.score_image(self.roofs[roof_type], self.detections[roof_type])
+            self.assert_same_scores(scores[roof_type], expected)
+
+    def test_tied_detections_only_match_once(self):
+        roofs = self.roofs['metal']
+        detections = dict(metal=np.vstack((roofs, roofs)), thatch=self.detections['thatch'])
+        scores = self.score(detections)
+        np.testing.assert_array_equal(scores['metal']['false_pos'], [False]*len(roofs)+[True]*len(roofs))
+        self.assert_same_scores(scores['metal'], reference_scoring.score_image(roofs, detections['metal']))
+
+    def test_without_detections(self):
+        scores = self.score(dict((roof_type, np.zeros((0, 4))) for roof_type in utils.ROOF_TYPES))
+        for roof_type in utils.ROOF_TYPES:
+            self.assertEqual(len(scores[roof_type]['false_pos']), 0)
+            np.testing.assert_array_equal(scores[roof_type]['easy_false_neg'], np.ones(len(self.roofs[roof_type]), dtype=bool))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+import suppression
+
+
+def reference_nms(boxes, class_probs, overlapThres=0.3):
+    '''non_max_suppression as it was before the grid: the loop of Malisiewicz et al. over the boxes of one roof type
+    '''
+    boxes = boxes.astype("float")
+    pick = []
+    x1, y1, x2, y2 = boxes[:,0], boxes[:,1], boxes[:,2], boxes[:,3]
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    idxs = np.argsort(class_probs)
+    while len(idxs) > 0:
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+        overlap = (w * h) / area[idxs[:last]]
+        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlapThres)[0])))
+    return boxes[pick].astype("int"), class_probs[pick]
+
+
+def reference_soft_nms(boxes, class_probs, overlapThres=0.3, min_prob=0.001):
+    '''Soft-NMS without a grid or a heap: take the most probable box left, decay the boxes it covers, repeat
+    '''
+    boxes = boxes.astype("float")
+    probs = np.array(class_probs, dtype=float)
+    area = (boxes[:,2] - boxes[:,0] + 1) * (boxes[:,3] - boxes[:,1] + 1)
+    left = list(np.where(probs >= min_prob)[0])
+    pick = []
+    while len(left) > 0:
+        i = max(left, key=lambda j: probs[j])
+        left.remove(i)
+        pick.append(i)
+        for j in list(left):
+            w = max(0, min(boxes[i,2], boxes[j,2]) - max(boxes[i,0], boxes[j,0]) + 1)
+            h = max(0, min(boxes[i,3], boxes[j,3]) - max(boxes[i,1], boxes[j,1]) + 1)
+            overlap = (w * h) / area[j]
+            if overlap > overlapThres:
+                probs[j] *= (1 - overlap)
+                if probs[j] < min_prob:
+                    left.remove(j)
+    return boxes[pick].astype("int"), probs[pick]
+
+
+def make_boxes(random_state, clusters=15, per_cluster=8):
+    '''Clusters of overlapping boxes, with distinct probabilities so the order of the boxes is well defined
+    '''
+    centers = random_state.randint(0, 500, size=(clusters, 2))
+    corners = np.repeat(centers, per_cluster, axis=0) + random_state.randint(-15, 16, size=(clusters*per_cluster, 2))
+    sizes = random_state.randint(20, 60, size=(clusters*per_cluster, 2))
+    boxes = np.column_stack((corners, corners+sizes))
+    probs = random_state.permutation(len(boxes))/float(len(boxes)) + 0.5/len(boxes)
+    return boxes, probs
+
+
+class SuppressionTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.boxes = dict()
+        self.probs = dict()
+        for roof_type in ['metal', 'thatch']:
+            self.boxes[roof_type], self.probs[roof_type] = make_boxes(random_state)
+
+    def test_hard_matches_loop(self):
+        kept_boxes, kept_probs = suppression.batched_non_max_suppression(self.boxes, self.probs, overlapThres=0.3)
+        for roof_type in ['metal', 'thatch']:
+            expected_boxes, expected_probs = reference_nms(self.boxes[roof_type], self.probs[roof_type], overlapThres=0.3)
+            self.assertLess(len(expected_boxes), len(self.boxes[roof_type]))
+            np.testing.assert_array_equal(kept_boxes[roof_type], expected_boxes)
+            np.testing.assert_array_equal(kept_probs[roof_type], expected_probs)
+
+    def test_threshold_per_roof_type(self):
+        overlapThres = {'metal': 0.1, 'thatch': 0.6}
+        kept_boxes, _ = suppression.batched_non_max_suppression(self.boxes, self.probs, overlapThres=overlapThres)
+        for roof_type in ['metal', 'thatch']:
+            expected_boxes, _ = reference_nms(self.boxes[roof_type], self.probs[roof_type], overlapThres=overlapThres[roof_type])
+            np.testing.assert_array_equal(kept_boxes[roof_type], expected_boxes)
+
+    def test_roof_types_do_not_suppress_each_other(self):
+        boxes = {'metal': self.boxes['metal'], 'thatch': self.boxes['metal']}
+        probs = {'metal': self.probs['metal'], 'thatch': self.probs['metal']}
+        kept_boxes, _ = suppression.batched_non_max_suppression(boxes, probs, overlapThres=0.3)
+        np.testing.assert_array_equal(kept_boxes['metal'], kept_boxes['thatch'])
+
+    def test_soft_matches_loop(self):
+        kept_boxes, kept_probs = suppression.batched_non_max_suppression(self.boxes, self.probs, overlapThres=0.3, soft=True)
+        for roof_type in ['metal', 'thatch']:
+            expected_boxes, expected_probs = reference_soft_nms(self.boxes[roof_type], self.probs[roof_type], overlapThres=0.3)
+            np.testing.assert_array_equal(kept_boxes[roof_type], expected_boxes)
+            np.testing.assert_allclose(kept_probs[roof_type], expected_probs, rtol=1e-12)
+
+    def test_soft_decays_what_hard_discards(self):
+        #the second box is half covered by the first one
+        boxes = {'metal': np.array([[0, 0, 9, 9], [5, 0, 14, 9], [100, 100, 109, 109]])}
+        probs = {'metal': np.array([0.9, 0.8, 0.7])}
+        hard_boxes, hard_probs = suppression.batched_non_max_suppression(boxes, probs, overlapThres=0.3)
+        np.testing.assert_array_equal(hard_boxes['metal'], boxes['metal'][[0, 2]])
+        np.testing.assert_array_equal(hard_probs['metal'], [0.9, 0.7])
+
+        soft_boxes, soft_probs = suppression.batched_non_max_suppression(boxes, probs, overlapThres=0.3, soft=True)
+        np.testing.assert_array_equal(soft_boxes['metal'], boxes['metal'][[0, 2, 1]])
+        np.testing.assert_allclose(soft_probs['metal'], [0.9, 0.7, 0.4])
+
+        #a decayed box below min_prob is discarded, as in hard suppression
+        soft_boxes, _ = suppression.batched_non_max_suppression(boxes, probs, overlapThres=0.3, soft=True, min_prob=0.5)
+        np.testing.assert_array_equal(soft_boxes['metal'], hard_boxes['metal'])
+
+    def test_boxes_without_probabilities(self):
+        #neural_classification_AUC does not classify a single proposal, so its probabilities are empty
+        boxes = {'metal': np.array([[0, 0, 9, 9], [50, 50, 59, 59], [100, 100, 109, 109]]), 'thatch': np.array([[0, 0, 9, 9]])}
+        probs = {'metal': np.array([0.9, 0.8, 0.7]), 'thatch': np.array([])}
+        for soft in [False, True]:
+            kept_boxes, kept_probs = suppression.batched_non_max_suppression(boxes, probs, overlapThres=0.3, soft=soft)
+            np.testing.assert_array_equal(kept_boxes['metal'], boxes['metal'])
+            np.testing.assert_array_equal(kept_probs['metal'], [0.9, 0.8, 0.7])
+            self.assertEqual(len(kept_boxes['thatch']), 0)
+            self.assertEqual(len(kept_probs['thatch']), 0)
+
+    def test_mismatched_probabilities_raise(self):
+        boxes = {'metal': np.array([[0, 0, 9, 9], [50, 50, 59, 59]])}
+        self.assertRaises(ValueError, suppression.batched_non_max_suppression, boxes, {'metal': np.array([0.9, 0.8, 0.7])})
+
+
+class BoxGridTest(unittest.TestCase):
+    def setUp(self):
+        #the windows of a pyramid, from 40 pixels wide to most of the image
+        self.boxes = np.array(utils.window_grid((300, 500), 15, (40, 40), scale=1.5, minSize=(40, 40)), dtype=float)
+        self.probs = np.random.RandomState(0).permutation(len(self.boxes))/float(len(self.boxes))
+
+    def test_neighbors_are_the_boxes_that_can_overlap(self):
+        grid = suppression.BoxGrid(self.boxes, np.zeros(len(self.boxes), dtype=int))
+        x1, y1, x2, y2 = self.boxes.T
+        overlapping = ((np.maximum(x1[:, None], x1[None, :]) <= np.minimum(x2[:, None], x2[None, :])) &
+                       (np.maximum(y1[:, None], y1[None, :]) <= np.minimum(y2[:, None], y2[None, :])))
+        comparisons = 0
+        for i in range(len(self.boxes)):
+            neighbors = grid.neighbors(i)
+            self.assertTrue(set(np.where(overlapping[i])[0]) <= set(neighbors))
+            comparisons += len(neighbors)
+        #a single cell size for all the windows compares every box with most of the others
+        self.assertLess(comparisons, 4*np.sum(overlapping))
+        self.assertLess(comparisons, len(self.boxes)**2/3)
+
+    def test_multi_scale_suppression_matches_loop(self):
+        kept_boxes, kept_probs = suppression.batched_non_max_suppression({'metal': self.boxes}, {'metal': self.probs}, overlapThres=0.3)
+        expected_boxes, expected_probs = reference_nms(self.boxes, self.probs, overlapThres=0.3)
+        np.testing.assert_array_equal(kept_boxes['metal'], expected_boxes)
+        np.testing.assert_array_equal(kept_probs['metal'], expected_probs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import math
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'neuralnet'))
+import utils
+
+
+def reference_windows(shape, stepSize, windowSize, scale=1.5, minSize=(30, 30)):
+    '''The windows of the sliding window detector as the loop over pyramid and sliding_window found them, 
+    translated back to the image like get_translated_coords
+    '''
+    windows = list()
+    image = np.zeros(shape+(3,), dtype=np.uint8)
+    for level, resized in enumerate(utils.pyramid(image, scale=scale, minSize=minSize)):
+        for (x, y, window) in utils.sliding_window(resized, stepSize=stepSize, windowSize=windowSize):
+            if window.shape[0] != windowSize[0] or window.shape[1] != windowSize[1]:
+                continue
+            scale_factor = math.pow(scale, level)
+            x = x*scale_factor
+            y = y*scale_factor
+            w = int(scale_factor*windowSize[1])
+            h = int(scale_factor*windowSize[0])
+            windows.append((int(x), int(y), int(x+w), int(y+h)))
+    return np.array(windows, dtype=int).reshape(-1, 4)
+
+
+class WindowGridTest(unittest.TestCase):
+    def setUp(self):
+        utils.clear_window_grids()
+
+    def tearDown(self):
+        utils.clear_window_grids()
+
+    def assert_same_windows(self, shape, stepSize, windowSize, **kwargs):
+        grid = utils.window_grid(shape, stepSize, windowSize, **kwargs)
+        expected = reference_windows(shape, stepSize, windowSize, **kwargs)
+        self.assertEqual(grid.dtype, np.int32)
+        np.testing.assert_array_equal(grid, expected, err_msg='{} {} {} {}'.format(shape, stepSize, windowSize, kwargs))
+        return grid
+
+    def test_matches_loop(self):
+        #odd shapes leave partial windows at the right and bottom edges of every level
+        for shape in [(120, 200), (97, 151), (300, 301)]:
+            grid = self.assert_same_windows(shape, 15, (40, 40))
+            self.assertGreater(len(grid), 0)
+
+    def test_matches_loop_other_scales(self):
+        self.assert_same_windows((300, 301), 10, (40, 40), scale=1.3, minSize=(50, 60))
+        self.assert_same_windows((97, 151), 7, (32, 32), scale=2, minSize=(32, 32))
+        #too small for a single window
+        self.assertEqual(len(self.assert_same_windows((30, 50), 15, (40, 40))), 0)
+
+    def test_cached_grid_is_read_only(self):
+        grid = utils.window_grid((120, 200), 15, (40, 40))
+        self.assertIs(utils.window_grid((120, 200), 15, (40, 40)), grid)
+        self.assertRaises(ValueError, grid.__setitem__, (0, 0), 1)
+        #another configuration gets its own grid
+        self.assertIsNot(utils.window_grid((120, 200), 15, (40, 40), scale=1.3), grid)
+
+
+if __name__ == '__main__':
+    unittest.main()